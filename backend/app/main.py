@@ -1,34 +1,57 @@
 # app/main.py
 
 from fastapi import HTTPException
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, Query, Request, Response, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse
 from dotenv import load_dotenv
 import pandas as pd
 from datetime import datetime 
 import os
 import json
 import math
-import io
+import time
 import asyncio      
 import httpx        
 import numpy as np  
 from cachetools import cached, TTLCache 
 
 # utils
-from app.utils.history_utils import fetch_history
-from app.utils.weather_utils import fetch_hourly_weather
-from app.utils.data_utils import CITY_BOUNDING_BOXES 
-from app.utils.report_utils import generate_pdf_report
+from app.utils.history_utils import fetch_history, fetch_history_point, fetch_pollutants, fetch_pollutants_point, on_history
+from app.utils.analytics import ANALYTICS, GRANULARITIES
+from app.utils.weather_utils import fetch_hourly_weather, fetch_ensemble_weather
+from app.utils.locations import REGISTRY, CITY_COORDS, CITY_BOUNDING_BOXES
+from app.utils.dataset import has_dataset, read_window, iter_dataset, dataset_end, DATASET_MAX_LAG_HOURS
+from app.utils.report_jobs import ReportJobQueue, PENDING, RUNNING, FAILED
+from app.utils.upstream import GOVERNOR, UpstreamError
+from app.utils.history_feed import HistoryFeed, etag, etag_matches, since_hour
+from app.utils.profiler import ProfileMiddleware, FORMATS as PROFILE_FORMATS, authorized, profile_for
+from app.utils.logging_utils import RequestLogMiddleware, get_logger, stage
+from app.utils.tiles import TileStore, TileRenderer, EMPTY_TILE, TILE_MAX_AGE, IMMUTABLE_MAX_AGE, in_pyramid, summary as tile_summary
 
 # ml
-from app.ml.model import train_model, load_model, predict_future, get_metrics
+from app.ml.model import train_model, load_model, predict_future, get_metrics, promote_candidate, list_versions, rollback, current_version, MODEL_KEEP_VERSIONS
+from app.ml.global_model import MODEL_MODE, GLOBAL_KEY, train_global_model, predict_future_batch, add_location_features
+from app.ml.monitoring import ForecastMonitor, PRIMARY
+from app.ml.shadow import ShadowEvaluator, CANDIDATE
+from app.ml.explain import contributions, explain_forecast
+from app.ml.orchestrator import train_all
+from app.model.lstm_model import ENGINE as LSTM_ENGINE, forecast as lstm_forecast, train_lstm
+from app.ml.multi_pollutant import ENGINE as MULTI_ENGINE, forecast as multi_forecast, train_multi
+from app.ml.montecarlo import ENSEMBLE_PATHS, simulate as simulate_ensemble
+from app.ml.baseline import ENGINE as BASELINE_ENGINE, forecast as baseline_forecast
 
 load_dotenv()
 
 OWM_API_KEY = os.environ.get("OWM_API_KEY")
-print(f"--- SERVER START: OWM API Key is Loaded: {OWM_API_KEY is not None} ---")
+TRAIN_MODE = os.environ.get("TRAIN_MODE", "memory")
+# cities without a bundle get the baseline forecast while it trains in the background (0 = train inline)
+BASELINE_FALLBACK = os.environ.get("BASELINE_FALLBACK", "1") != "0"
+COLD_TRAIN_RETRY = float(os.environ.get("COLD_TRAIN_RETRY", 300))  # seconds before a failed background training is retried
+# heatmap points that cannot get an OWM slot within this many seconds are dropped, not queued
+HEATMAP_MAX_WAIT = float(os.environ.get("HEATMAP_MAX_WAIT", 5))
+log = get_logger(__name__)
+log.info("Server start", extra={"owm_key_loaded": OWM_API_KEY is not None})
 
 app = FastAPI(title="BreatheBetter Hybrid Backend", version="4.0")
 
@@ -38,21 +61,45 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Request-ID"],
 )
-
-CITY_COORDS = {
-    "Delhi": (28.7041, 77.1025),
-    "Mumbai": (19.0760, 72.8777),
-    "Bengaluru": (12.9716, 77.5946),
-    "Hyderabad": (17.3850, 78.4867),
-    "Chennai": (13.0827, 80.2707),
-    "Kolkata": (22.5726, 88.3639)
-}
+# X-Profile + X-Admin-Token on any request returns its sampled profile (app/utils/profiler.py)
+app.add_middleware(ProfileMiddleware)
+# outermost: request id + one structured access record per request (app/utils/logging_utils.py)
+app.add_middleware(RequestLogMiddleware)
 
 # -------------------------------------------------------------------
 # CACHE & HELPERS
 # -------------------------------------------------------------------
 spatial_cache = TTLCache(maxsize=10, ttl=900)
+# served forecasts (with their feature rows) for the current hour; their SHAP values are cached in the same entry
+forecast_cache = TTLCache(maxsize=64, ttl=3600)
+report_jobs = ReportJobQueue(fetch_history, get_metrics)
+# fetch_training_frames is defined at the bottom of this module
+monitor = ForecastMonitor(fetch_history, lambda city, days: fetch_training_frames(city, days), get_metrics)
+shadow = ShadowEvaluator(monitor)
+# every city history fetch also feeds the analytics rollups
+on_history(ANALYTICS.ingest)
+# last fetched history per city with its data version: /history and /predict answer deltas and 304s from it
+history_feed = HistoryFeed(fetch_history)
+# pre-rendered heatmap tile pyramids, re-rendered in the background whenever new spatial samples arrive
+tile_store = TileStore()
+tile_renderer = TileRenderer(tile_store)
+
+def forecast_key(city: str, duration_hours: int, bundle: dict):
+    return (city, duration_hours, bundle.get("trained_at"), datetime.utcnow().strftime("%Y%m%d%H"))
+
+def residual_sigma(metrics: dict) -> float:
+    """Ensemble-weighted one-step residual sd from the bundle's metrics."""
+    stds = metrics.get("residual_std", {"xgb":1, "rf":1, "lr":1}) 
+    w = metrics.get("weights", {"xgb":0.5, "rf":0.3, "lr":0.2}) 
+
+    sigma = (w.get("xgb", 0) * stds.get("xgb", 1) + 
+             w.get("rf", 0) * stds.get("rf", 1) + 
+             w.get("lr", 0) * stds.get("lr", 1))
+    
+    if sigma == 0: sigma = stds.get("rf", 1.0) 
+    return sigma
 
 def get_aqi_category(pm25):
     """Categorizes PM2.5 value based on US EPA standards for AQI"""
@@ -72,13 +119,17 @@ async def fetch_air_quality_for_point(lat: float, lon: float, client: httpx.Asyn
         
     url = f"http://api.openweathermap.org/data/2.5/air_pollution?lat={lat}&lon={lon}&appid={OWM_API_KEY}"
     try:
-        response = await client.get(url, timeout=10.0) 
-        response.raise_for_status() 
-        data = response.json()
-        pm25 = data.get("list", [{}])[0].get("components", {}).get("pm2_5", 0)
-        return [lat, lon, pm25]
-    except Exception:
-        return None 
+        # random points never repeat, so don't fill the stale-response cache with them
+        data = await GOVERNOR.aget_json("owm", url, client, timeout=10.0, max_wait=HEATMAP_MAX_WAIT, cache=False)
+    except UpstreamError:
+        # counted by the governor (GET /upstream/quota)
+        return None
+    try:
+        pm25 = data["list"][0]["components"]["pm2_5"]
+        return [lat, lon, float(pm25)]
+    except (KeyError, IndexError, TypeError, ValueError):
+        # a point without a reading is left out of the sweep, not turned into a 0 or a 500
+        return None
 
 # -----------------------------------------------------------
 # MODEL & PREDICTION ENDPOINTS
@@ -101,9 +152,7 @@ async def live_pollutants(city: str = Query("Delhi")):
     
     try:
         async with httpx.AsyncClient() as client:
-            response = await client.get(url, timeout=10.0)
-            response.raise_for_status()
-            data = response.json()
+            data = await GOVERNOR.aget_json("owm", url, client, timeout=10.0)
             
         components = data.get("list", [{}])[0].get("components", {})
         dt = data.get("list", [{}])[0].get("dt", datetime.now().timestamp())
@@ -126,7 +175,7 @@ async def current_aqi(city: str = Query("Delhi")):
     if city not in CITY_COORDS:
         return {"error": "City not supported"}, 400
 
-    df_pm25 = fetch_history(city, days=1)
+    df_pm25 = await asyncio.to_thread(fetch_history, city, days=1)
     if df_pm25 is None or df_pm25.empty:
         return {"error": "No current historical data found."}, 404
 
@@ -143,53 +192,284 @@ async def current_aqi(city: str = Query("Delhi")):
     }
 
 @app.get("/train")
-async def train(city: str = Query("Delhi"), days: int = Query(30)):
+async def train(city: str = Query("Delhi"), days: int = Query(30), mode: str = Query(None), variant: str = Query(None), engine: str = Query(None)):
     # Helper wrapper to handle async call properly
+    # mode: "memory" (default) or "chunked" (out-of-core, needs a backfilled dataset)
+    # variant: "candidate" always trains a side-by-side bundle for shadow / A-B evaluation
+    # engine: "lstm" trains the sequence model (needs tensorflow) instead of the ensemble,
+    #         "multi" the multi-pollutant ensemble (PM2.5, PM10, NO2, O3, SO2, CO)
     from app.main import get_or_train_model as helper
     try:
-        metrics = await helper(city, train_days=days)
+        if engine == LSTM_ENGINE:
+            if city not in CITY_COORDS: raise Exception("City not supported")
+            df_pm25, df_weather = await asyncio.to_thread(fetch_training_frames, city, days)
+            return await asyncio.to_thread(train_lstm, city, df_pm25, df_weather)
+        if engine == MULTI_ENGINE:
+            if city not in CITY_COORDS: raise Exception("City not supported")
+            df_pollutants, df_weather = await asyncio.to_thread(fetch_pollutant_frames, city, days)
+            return await asyncio.to_thread(train_multi, city, df_pollutants, df_weather)
+        if variant == CANDIDATE:
+            return await train_candidate(city, days)
+        metrics = await helper(city, train_days=days, mode=mode)
         return metrics
     except Exception as e:
         return {"error": f"Training failed: {str(e)}"}
 
+# one orchestrated training job at a time; a second one would fight the first for the cores
+train_all_lock = asyncio.Lock()
+
+@app.post("/train/all")
+async def train_all_cities(days: int = Query(30), cores: int = Query(None), parallel: int = Query(None), variant: str = Query(None)):
+    """
+    Trains every city in one job: concurrent data fetch, cores split between parallel trainings,
+    atomic bundle writes. Returns wall time and per-city timings.
+    """
+    if train_all_lock.locked():
+        return JSONResponse({"error": "A training job is already running."}, status_code=409)
+    async with train_all_lock:
+        return await asyncio.to_thread(train_all, fetch_training_frames, None, days, cores, parallel, variant)
+
+async def _predict_lstm(city: str, duration_hours: int, lat: float, lon: float, station: dict = None):
+    """/predict?engine=lstm: one batched forward pass of the city's exported LSTM for the whole horizon."""
+    bundle, _, metrics = load_model(city, LSTM_ENGINE)
+    if bundle is None:
+        return {"error": f"LSTM engine not trained for {city}. Train it with /train?city={city}&engine=lstm"}
+    if duration_hours > bundle["horizon"]:
+        return {"error": f"engine=lstm forecasts at most {bundle['horizon']} hours"}
+
+    if station is not None:
+        df_pm25 = await asyncio.to_thread(fetch_history_point, lat, lon, days=7)
+    else:
+        df_pm25 = await asyncio.to_thread(fetch_history, city, days=7)
+    if df_pm25 is None or df_pm25.empty:
+        return {"error": "Cannot fetch recent PM2.5 data."}
+    df_weather = await asyncio.to_thread(fetch_hourly_weather, lat, lon, past_days=0, forecast_hours=duration_hours)
+    if df_weather is None or df_weather.empty:
+        return {"error": "No weather forecast found."}
+
+    try:
+        output = lstm_forecast(bundle, df_pm25, df_weather)
+    except Exception as e:
+        return {"error": f"Prediction failed: {str(e)}"}
+    if station is None:
+        monitor.record(city, output["datetimes"], output["predictions"], variant=LSTM_ENGINE)
+
+    # per-step validation residuals: the band widens with the horizon
+    sigmas = (metrics or {}).get("residual_std_by_step") or [1.0]
+    final = []
+    for i, (dt, p) in enumerate(zip(output["datetimes"], output["predictions"])):
+        sigma = sigmas[min(i, len(sigmas) - 1)]
+        final.append({
+            "hour_index": i,
+            "datetime": dt,
+            "pm25": round(float(p), 3),
+            "lower_95": round(max(0.0, float(p) - 1.96 * sigma), 3),
+            "upper_95": round(float(p) + 1.96 * sigma, 3),
+        })
+    return {"city": city, "duration_hours": duration_hours, "engine": LSTM_ENGINE, "predictions": final}
+
+async def _predict_multi(city: str, duration_hours: int, lat: float, lon: float, station: dict = None):
+    """/predict?engine=multi: every pollutant from the city's multi-output bundle, plus the AQI they imply."""
+    bundle, _, metrics = load_model(city, MULTI_ENGINE)
+    if bundle is None:
+        return {"error": f"Multi-pollutant engine not trained for {city}. Train it with /train?city={city}&engine=multi"}
+
+    if station is not None:
+        df_pollutants = await asyncio.to_thread(fetch_pollutants_point, lat, lon, days=7)
+    else:
+        df_pollutants = await asyncio.to_thread(fetch_pollutants, city, days=7)
+    if df_pollutants is None or df_pollutants.empty:
+        return {"error": "Cannot fetch recent pollutant data."}
+    df_weather = await asyncio.to_thread(fetch_hourly_weather, lat, lon, past_days=0, forecast_hours=duration_hours)
+    if df_weather is None or df_weather.empty:
+        return {"error": "No weather forecast found."}
+
+    try:
+        output = await asyncio.to_thread(multi_forecast, bundle, df_pollutants, df_weather)
+    except Exception as e:
+        return {"error": f"Prediction failed: {str(e)}"}
+    preds = output["predictions"]
+    if station is None:
+        monitor.record(city, output["datetimes"], preds["pm25"], variant=MULTI_ENGINE)
+
+    final = []
+    for i, dt in enumerate(output["datetimes"]):
+        aqi = output["aqi"][i]
+        row = {"hour_index": i, "datetime": dt}
+        row.update({p: round(float(v[i]), 3) for p, v in preds.items()})
+        if math.isnan(aqi):
+            row.update(aqi=None, dominant=None)
+        else:
+            row.update(aqi=int(aqi), dominant=output["dominant"][i], **get_aqi_category(aqi))
+        final.append(row)
+    return {"city": city, "duration_hours": duration_hours, "engine": MULTI_ENGINE, "pollutants": list(preds),
+            "units": "µg/m³", "predictions": final}
+
+async def _predict_ensemble(city: str, duration_hours: int, lat: float, lon: float, bundle: dict, scaler, metrics: dict,
+                            df_weather: pd.DataFrame, df_pm25: pd.DataFrame, paths: int):
+    """/predict?mode=ensemble: percentile bands over Monte Carlo trajectories, all advanced in one batch per hour."""
+    members = await asyncio.to_thread(fetch_ensemble_weather, lat, lon, duration_hours)
+    try:
+        with stage("predict"):
+            output = await asyncio.to_thread(simulate_ensemble, bundle, scaler, df_weather, df_pm25, members, paths, residual_sigma(metrics))
+    except Exception as e:
+        return {"error": f"Prediction failed: {str(e)}"}
+
+    bands = output["percentiles"]
+    final = []
+    for i, dt in enumerate(output["datetimes"]):
+        row = {"hour_index": i, "datetime": dt, "pm25": round(float(bands[50][i]), 3), "mean": round(float(output["mean"][i]), 3)}
+        row.update({f"p{q}": round(float(v[i]), 3) for q, v in bands.items()})
+        final.append(row)
+    return {
+        "city": city,
+        "duration_hours": duration_hours,
+        "mode": "ensemble",
+        "paths": output["paths"],
+        "weather_members": output["members"],
+        "scenario_source": output["source"],
+        "predictions": final,
+    }
+
+def _predict_baseline(city: str, duration_hours: int, df_pm25: pd.DataFrame, df_weather: pd.DataFrame, record: bool = True):
+    """Baseline forecast (diurnal climatology + decaying anomaly) for a city whose model is still training."""
+    try:
+        with stage("predict"):
+            output = baseline_forecast(df_pm25, df_weather)
+    except Exception as e:
+        return {"error": f"Prediction failed: {str(e)}"}
+    if record:
+        monitor.record(city, output["datetimes"], output["predictions"], variant=BASELINE_ENGINE)
+
+    final = []
+    for i, (dt, p, sigma) in enumerate(zip(output["datetimes"], output["predictions"], output["sigma"])):
+        final.append({
+            "hour_index": i,
+            "datetime": dt,
+            "pm25": round(float(p), 3),
+            "lower_95": round(max(0.0, float(p - 1.96 * sigma)), 3),
+            "upper_95": round(float(p + 1.96 * sigma), 3),
+        })
+    return {
+        "city": city,
+        "duration_hours": duration_hours,
+        "model": BASELINE_ENGINE,
+        "model_variant": BASELINE_ENGINE,
+        "training": cold_training_status(GLOBAL_KEY if MODEL_MODE == "global" else city),
+        "predictions": final,
+    }
+
 @app.get("/predict")
-async def predict(city: str = Query("Delhi"), duration_hours: int = Query(24)):
+async def predict(request: Request, city: str = Query("Delhi"), duration_hours: int = Query(24), lat: float = Query(None), lon: float = Query(None),
+                  engine: str = Query(None), since: str = Query(None), mode: str = Query(None), paths: int = Query(ENSEMBLE_PATHS)):
+    """
+    mode=ensemble runs `paths` Monte Carlo trajectories over weather-ensemble members and returns
+    percentile bands instead of one trajectory.
+    since=<ISO timestamp> returns only the forecast hours after it. City forecasts carry an ETag
+    (model version, history data version, hour); a matching If-None-Match gets a 304 before any
+    weather fetch or model call.
+    """
+    if since is not None:
+        try:
+            since_cut = since_hour(since)
+        except ValueError:
+            return JSONResponse({"error": "since must be an ISO timestamp"}, status_code=400)
+    station = None
+    if lat is not None and lon is not None:
+        # arbitrary coordinate: serve the nearest station's cluster model with local inputs
+        station, dist_km = REGISTRY.nearest(lat, lon)
+        if station is None:
+            return {"error": f"No monitoring station within range ({dist_km:.0f} km to nearest)"}
+        city = station["cluster"]
+
     if city not in CITY_COORDS:
         return {"error": "City not supported"}
 
+    if engine in (LSTM_ENGINE, MULTI_ENGINE):
+        if station is None:
+            lat, lon = CITY_COORDS[city]
+        engine_predict = _predict_lstm if engine == LSTM_ENGINE else _predict_multi
+        response = await engine_predict(city, duration_hours, lat, lon, station)
+        if station is not None and "error" not in response:
+            response["station"] = {"id": station["id"], "name": station["name"], "distance_km": round(dist_km, 2)}
+        return response
+
     try:
-        # Import locally to avoid circular issues if any
-        from app.main import get_or_train_model as helper
-        bundle, scaler, metrics = await helper(city)
+        # bundle is None while the city's first model trains: the baseline is served meanwhile
+        bundle, scaler, metrics = await get_model_or_baseline(city)
     except Exception as e:
         return {"error": f"Failed to get model: {str(e)}"}
 
-    lat, lon = CITY_COORDS[city]
-    df_pm25 = fetch_history(city, days=7)
-    
+    # A-B split: a share of requests is served by the candidate bundle, if there is one
+    key = GLOBAL_KEY if MODEL_MODE == "global" else city
+    served = shadow.choose(key) if bundle is not None else BASELINE_ENGINE
+    if served == CANDIDATE:
+        cand_bundle, cand_scaler, cand_metrics = load_model(key, CANDIDATE)
+        if cand_bundle is not None:
+            bundle, scaler, metrics = cand_bundle, cand_scaler, cand_metrics or {}
+        else:
+            served = PRIMARY
+
+    tag = None
+    if station is not None:
+        df_pm25 = await asyncio.to_thread(fetch_history_point, lat, lon, days=7)
+    else:
+        lat, lon = CITY_COORDS[city]
+        feed = await asyncio.to_thread(history_feed.get, city, 7)
+        df_pm25 = feed.df if feed is not None else None
+        if feed is not None:
+            model_version = BASELINE_ENGINE if bundle is None else metrics.get("version") or bundle.get("trained_at")
+            tag = etag("p", city, duration_hours, served, model_version,
+                       feed.version, datetime.utcnow().strftime("%Y%m%d%H"), *((mode, paths) if mode == "ensemble" else ()))
+            if etag_matches(request.headers.get("if-none-match"), tag):
+                return Response(status_code=304, headers={"ETag": tag, "Cache-Control": "no-cache"})
+
     if df_pm25 is None or df_pm25.empty:
         return {"error": "Cannot fetch recent PM2.5 data."}
 
-    df_weather = fetch_hourly_weather(lat, lon, past_days=0, forecast_hours=duration_hours)
+    df_weather = await asyncio.to_thread(fetch_hourly_weather, lat, lon, past_days=0, forecast_hours=duration_hours)
     if df_weather is None or df_weather.empty:
         return {"error": "No weather forecast found."}
+    if MODEL_MODE == "global":
+        df_weather = add_location_features(df_weather, city)
+
+    def finish(response: dict):
+        if since is not None:
+            response["since"] = since
+            response["predictions"] = [p for p in response["predictions"] if since_hour(p["datetime"]) > since_cut]
+        if station is not None:
+            response["station"] = {"id": station["id"], "name": station["name"], "distance_km": round(dist_km, 2)}
+            response["lat"], response["lon"] = lat, lon
+        return JSONResponse(response, headers={"ETag": tag, "Cache-Control": "no-cache"}) if tag is not None else response
+
+    if bundle is None:
+        response = _predict_baseline(city, duration_hours, df_pm25, df_weather, record=station is None)
+        return finish(response) if "error" not in response else response
+
+    if mode == "ensemble":
+        response = await _predict_ensemble(city, duration_hours, lat, lon, bundle, scaler, metrics, df_weather, df_pm25, paths)
+        if "error" in response:
+            return response
+        response["model_variant"] = served
+        return finish(response)
 
     try:
-        output = predict_future(bundle, scaler, df_weather, last_history=df_pm25)
+        with stage("predict"):
+            output = predict_future(bundle, scaler, df_weather, last_history=df_pm25, return_features=True)
     except Exception as e:
         return {"error": f"Prediction failed: {str(e)}"}
 
+    if station is None:
+        if served == PRIMARY:
+            forecast_cache[forecast_key(city, duration_hours, bundle)] = {"output": output, "contributions": None}
+        monitor.record(city, output["datetimes"], output["predictions"], df_weather, bundle, variant=served)
+        # the other variant is scored in a background process; this returns immediately
+        shadow.submit(city, key, served, df_weather, df_pm25)
+
     preds = output["predictions"]
     result_df = output["result_df"] 
 
-    stds = metrics.get("residual_std", {"xgb":1, "rf":1, "lr":1}) 
-    w = metrics.get("weights", {"xgb":0.5, "rf":0.3, "lr":0.2}) 
-
-    sigma = (w.get("xgb", 0) * stds.get("xgb", 1) + 
-             w.get("rf", 0) * stds.get("rf", 1) + 
-             w.get("lr", 0) * stds.get("lr", 1))
-    
-    if sigma == 0: sigma = stds.get("rf", 1.0) 
+    sigma = residual_sigma(metrics)
     ci_mult = 1.96
 
     final = []
@@ -215,11 +495,121 @@ async def predict(city: str = Query("Delhi"), duration_hours: int = Query(24)):
             "upper_95": round(upper, 3) if upper is not None else None,
         })
 
-    return {
+    response = {
         "city": city,
         "duration_hours": duration_hours,
+        "model_variant": served,
         "predictions": final
     }
+    return finish(response)
+
+@app.get("/predict/all")
+async def predict_all(duration_hours: int = Query(24)):
+    """
+    Forecasts every city at once. With MODEL_MODE=global this is one batched model call per hour.
+    Cities whose model is still training get the baseline forecast (listed under "baseline").
+    """
+    def _inputs(city):
+        lat, lon = CITY_COORDS[city]
+        return (fetch_hourly_weather(lat, lon, past_days=0, forecast_hours=duration_hours),
+                fetch_history(city, days=7))
+
+    results = await asyncio.gather(*[asyncio.to_thread(_inputs, city) for city in CITY_COORDS], return_exceptions=True)
+    inputs = {}
+    for city, r in zip(CITY_COORDS, results):
+        if isinstance(r, Exception): continue
+        df_weather, df_pm25 = r
+        if df_weather is None or df_weather.empty or df_pm25 is None or df_pm25.empty: continue
+        inputs[city] = (df_weather, df_pm25)
+
+    if not inputs:
+        return {"error": "No input data for any city."}
+
+    # cold models train in the background (get_model_or_baseline); those cities get the baseline meanwhile
+    outputs, bundles, baseline = {}, {}, []
+    try:
+        if MODEL_MODE == "global":
+            bundle, scaler, _ = await get_model_or_baseline(next(iter(inputs)))
+            if bundle is not None:
+                outputs = await asyncio.to_thread(predict_future_batch, bundle, scaler, inputs)
+                bundles = dict.fromkeys(outputs, bundle)
+        for city, (df_weather, df_pm25) in inputs.items():
+            if city in outputs:
+                continue
+            bundle, scaler, _ = (None, None, None) if MODEL_MODE == "global" else await get_model_or_baseline(city)
+            if bundle is None:
+                outputs[city] = await asyncio.to_thread(baseline_forecast, df_pm25, df_weather)
+                baseline.append(city)
+            else:
+                outputs[city] = await asyncio.to_thread(predict_future, bundle, scaler, df_weather, last_history=df_pm25)
+                bundles[city] = bundle
+    except Exception as e:
+        return {"error": f"Prediction failed: {str(e)}"}
+
+    for city, output in outputs.items():
+        if city in bundles:
+            monitor.record(city, output["datetimes"], output["predictions"], inputs[city][0], bundles[city])
+        else:
+            monitor.record(city, output["datetimes"], output["predictions"], variant=BASELINE_ENGINE)
+
+    cities = {}
+    for city, output in outputs.items():
+        cities[city] = [
+            {"hour_index": i, "datetime": d, "pm25": round(float(p), 3) if not math.isnan(p) else None}
+            for i, (d, p) in enumerate(zip(output["datetimes"], output["predictions"]))
+        ]
+
+    return {"mode": MODEL_MODE, "duration_hours": duration_hours, "cities": cities, "baseline": baseline}
+
+@app.get("/explain")
+async def explain(city: str = Query("Delhi"), duration_hours: int = Query(24), top: int = Query(8)):
+    """
+    Per-feature contributions (SHAP) for every hour of the forecast, plus the bundle's global importances.
+    Reuses the forecast /predict served this hour when there is one.
+    """
+    if city not in CITY_COORDS:
+        return {"error": "City not supported"}
+
+    try:
+        bundle, scaler, metrics = await get_or_train_model(city)
+    except Exception as e:
+        return {"error": f"Failed to get model: {str(e)}"}
+
+    key = forecast_key(city, duration_hours, bundle)
+    entry = forecast_cache.get(key)
+    if entry is None:
+        lat, lon = CITY_COORDS[city]
+        df_pm25 = await asyncio.to_thread(fetch_history, city, days=7)
+        if df_pm25 is None or df_pm25.empty:
+            return {"error": "Cannot fetch recent PM2.5 data."}
+        df_weather = await asyncio.to_thread(fetch_hourly_weather, lat, lon, past_days=0, forecast_hours=duration_hours)
+        if df_weather is None or df_weather.empty:
+            return {"error": "No weather forecast found."}
+        if MODEL_MODE == "global":
+            df_weather = add_location_features(df_weather, city)
+        try:
+            output = predict_future(bundle, scaler, df_weather, last_history=df_pm25, return_features=True)
+        except Exception as e:
+            return {"error": f"Prediction failed: {str(e)}"}
+        entry = forecast_cache[key] = {"output": output, "contributions": None}
+
+    output = entry["output"]
+    if entry["contributions"] is None:
+        try:
+            # one batched SHAP call per model for the whole horizon, off the event loop
+            entry["contributions"] = await asyncio.to_thread(contributions, bundle, output["X_scaled"])
+        except Exception as e:
+            return {"error": f"Explanation failed: {str(e)}"}
+    explanation = explain_forecast(bundle, entry["contributions"], output["datetimes"], output["predictions"], top)
+
+    importance = bundle.get("feature_importance") or (metrics or {}).get("feature_importance", {})
+    return {
+        "city": city,
+        "duration_hours": duration_hours,
+        "trained_at": bundle.get("trained_at"),
+        "global_importance": dict(list(importance.items())[:top]),
+        **explanation
+    }
 
 @app.get("/forecast/weekly")
 async def weekly_forecast(city: str = Query("Delhi")):
@@ -227,31 +617,39 @@ async def weekly_forecast(city: str = Query("Delhi")):
         return {"error": "City not supported"}
 
     try:
-        from app.main import get_or_train_model as helper
-        bundle, scaler, metrics = await helper(city)
+        bundle, scaler, metrics = await get_model_or_baseline(city)
     except Exception as e:
         return {"error": f"Failed to get model: {str(e)}"}
 
     lat, lon = CITY_COORDS[city]
-    df_pm25 = fetch_history(city, days=7)
+    df_pm25 = await asyncio.to_thread(fetch_history, city, days=7)
     if df_pm25 is None or df_pm25.empty:
         return {"error": "Cannot fetch recent PM2.5 data."}
 
     hours = 7 * 24
-    df_weather = fetch_hourly_weather(lat, lon, past_days=0, forecast_hours=hours)
+    df_weather = await asyncio.to_thread(fetch_hourly_weather, lat, lon, past_days=0, forecast_hours=hours)
     if df_weather is None or df_weather.empty:
         return {"error": "No weather forecast found."}
+    if MODEL_MODE == "global":
+        df_weather = add_location_features(df_weather, city)
 
     try:
-        output = predict_future(bundle, scaler, df_weather, last_history=df_pm25)
+        if bundle is None:
+            output = baseline_forecast(df_pm25, df_weather)
+        else:
+            output = predict_future(bundle, scaler, df_weather, last_history=df_pm25)
     except Exception as e:
         return {"error": f"Prediction failed: {str(e)}"}
 
+    if bundle is None:
+        monitor.record(city, output["datetimes"], output["predictions"], variant=BASELINE_ENGINE)
+    else:
+        monitor.record(city, output["datetimes"], output["predictions"], df_weather, bundle)
+
     preds = output["predictions"]
-    result_df = output["result_df"]
 
     df = pd.DataFrame({
-        "datetime": result_df["datetime"],
+        "datetime": output["datetimes"],
         "pm25": preds
     })
     df["date"] = pd.to_datetime(df["datetime"]).dt.date
@@ -262,88 +660,129 @@ async def weekly_forecast(city: str = Query("Delhi")):
         max_pm25=("pm25", "max")
     ).reset_index()
 
-    return {
+    response = {
         "city": city,
         "days": 7,
         "daily_forecast": grouped.round(3).to_dict(orient="records")
     }
+    if bundle is None:
+        response["model"] = BASELINE_ENGINE
+        response["training"] = cold_training_status(GLOBAL_KEY if MODEL_MODE == "global" else city)
+    return response
+
+@app.get("/locations/nearest")
+async def nearest_location(lat: float = Query(...), lon: float = Query(...)):
+    """Resolves a coordinate to its nearest monitoring station and model cluster."""
+    station, dist_km = REGISTRY.nearest(lat, lon)
+    if station is None:
+        return JSONResponse({"error": "No monitoring station within range", "distance_km": round(dist_km, 2)}, status_code=404)
+    return {"station": station, "cluster": station["cluster"], "distance_km": round(dist_km, 2)}
 
 @app.get("/metrics")
 async def metrics(city: str = Query("Delhi")):
     try:
-        return get_metrics(city)
+        metrics = get_metrics(city)
     except Exception as e:
         return {"error": str(e)}
+    # training-time scores next to the rolling error of what has actually been served
+    if "error" not in metrics:
+        metrics["online"] = monitor.city_stats(city)
+    return metrics
 
-@app.get("/report/pdf")
-async def report_pdf(city: str = Query("Delhi"), days: int = Query(7)):
-    """
-    Generates and downloads a PDF report for the specified city and duration.
-    """
-    if city not in CITY_COORDS:
-        return {"error": "City not supported."}
-    
-    print(f"📄 Generating PDF Report for {city}, Days: {days}")
-    
-    # 1. Fetch History
-    df_history = fetch_history(city, days)
-    
-    # 2. Get Metrics
-    metrics = get_metrics(city) or {} 
-    
-    # 3. Generate PDF
-    try:
-        pdf_bytes = generate_pdf_report(city, df_history, metrics, days=days)
-    except Exception as e:
-        print(f"❌ Report Gen Error: {e}")
-        return {"error": f"Failed to generate PDF: {e}"}
-        
-    filename = f"{city}_BreatheBetter_report_{days}d.pdf"
-    
-    return StreamingResponse(
-        io.BytesIO(pdf_bytes), 
-        media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
-    )
+@app.get("/monitoring")
+async def monitoring():
+    """Rolling forecast error per city and horizon, input drift, and the retrain queue."""
+    return monitor.snapshot()
+
+@app.post("/monitoring/evaluate")
+async def monitoring_evaluate():
+    """Runs one evaluation pass now instead of waiting for MONITOR_INTERVAL."""
+    scored = await monitor.evaluate()
+    return {"scored": scored, **monitor.snapshot()}
 
 @app.get("/history")
-async def get_history(city: str = Query("Delhi"), days: int = Query(7)):
+async def get_history(request: Request, city: str = Query("Delhi"), days: int = Query(7), since: str = Query(None),
+                      version: int = Query(None)):
     """
     Returns hourly historical PM2.5 data for the specified city and duration.
+    since=<ISO timestamp> returns only the rows after it; with version=<the client's data version>
+    the full window comes back instead (no "since" in the body) when rows before it were revised.
+    Responses carry an ETag built from the city's data version; a matching If-None-Match gets a
+    304 while the cached history is fresh.
     """
     if city not in CITY_COORDS:
-        return {"error": "City not supported"}, 400
-        
+        return JSONResponse({"error": "City not supported"}, status_code=400)
+    if since is not None:
+        try:
+            since_hour(since)
+        except ValueError:
+            return JSONResponse({"error": "since must be an ISO timestamp"}, status_code=400)
+
+    # conditional request: answered from memory, no upstream call, no pandas
+    feed = history_feed.peek(city, days)
+    if feed is not None and etag_matches(request.headers.get("if-none-match"), etag(city, days, feed.version)):
+        return Response(status_code=304, headers={"ETag": etag(city, days, feed.version), "Cache-Control": "no-cache"})
+
     try:
-        # Reuse your existing utility!
-        df = fetch_history(city, days=days)
-        
-        if df is None or df.empty:
+        feed = await asyncio.to_thread(history_feed.get, city, days)
+        if feed is None:
             return {"city": city, "history": []}
-            
-        # Convert DataFrame to list of dicts for JSON response
-        # df has 'datetime' and 'pm25' columns
-        records = df.to_dict(orient="records")
-        
-        return {
+
+        if since is not None and not history_feed.delta_ok(feed, version):
+            since = None
+        body = {
             "city": city,
             "days": days,
-            "history": records
+            "version": feed.version,
+            "history": history_feed.window(feed, days, since),
         }
+        if since is not None:
+            body["since"] = since
+        return JSONResponse(body, headers={"ETag": etag(city, days, feed.version), "Cache-Control": "no-cache"})
     except Exception as e:
-        return {"error": f"Failed to fetch history: {str(e)}"}, 500
+        return JSONResponse({"error": f"Failed to fetch history: {str(e)}"}, status_code=500)
 
-@app.get("/spatial_heatmap")
-async def get_spatial_heatmap(city: str = Query("Delhi")):
-    """Generates random-scattered PM2.5 points."""
-    if city not in CITY_BOUNDING_BOXES:
-        raise HTTPException(status_code=404, detail="City bounding box not found")
+@app.get("/analytics")
+async def get_analytics(
+    city: str = Query("Delhi"),
+    granularity: str = Query("day"),
+    start: str = Query(None, alias="from"),
+    end: str = Query(None, alias="to"),
+    percentiles: str = Query("50,90,99"),
+):
+    """
+    PM2.5 aggregates over any range from the pre-aggregated rollups (local dataset + every fetched history).
+    granularity: hour | day | week | month. from/to are ISO timestamps (UTC), default all stored data.
+    """
+    if city not in CITY_COORDS:
+        return JSONResponse({"error": "City not supported"}, status_code=400)
+    if granularity not in GRANULARITIES:
+        return JSONResponse({"error": f"granularity must be one of {GRANULARITIES}"}, status_code=400)
+    try:
+        pcts = [float(p) for p in percentiles.split(",") if p.strip()]
+    except ValueError:
+        return JSONResponse({"error": "percentiles must be comma-separated numbers"}, status_code=400)
+    if any(not 0 <= p <= 100 for p in pcts):
+        return JSONResponse({"error": "percentiles must be between 0 and 100"}, status_code=400)
 
+    # new or rewritten partitions only; a no-op once the city is loaded
+    await asyncio.to_thread(ANALYTICS.sync_dataset, city)
+    try:
+        return ANALYTICS.query(city, granularity, start, end, pcts)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+@app.get("/analytics/status")
+async def analytics_status():
+    """Hours held per city in the analytics store."""
+    return ANALYTICS.status()
+
+async def sample_city(city: str, num_points: int = 300):
+    """PM2.5 at random points of the city's bounding box; cached, and the city's tiles re-render from new samples."""
     cached_value = spatial_cache.get(city)
     if cached_value: return cached_value
 
     bounds = CITY_BOUNDING_BOXES[city]
-    num_points = 300 
     lats = np.random.uniform(bounds["lat_min"], bounds["lat_max"], num_points)
     lons = np.random.uniform(bounds["lon_min"], bounds["lon_max"], num_points)
 
@@ -354,44 +793,308 @@ async def get_spatial_heatmap(city: str = Query("Delhi")):
         results = await asyncio.gather(*tasks)
 
     spatial_data = [r for r in results if r is not None]
-    response = {"city": city, "points": spatial_data}
+    if not spatial_data:
+        return None
+
+    response = {"city": city, "points": spatial_data, "requested": num_points, "missing": num_points - len(spatial_data),
+                "sampled_at": datetime.utcnow().isoformat()}
     spatial_cache[city] = response
+    tile_renderer.schedule(city, spatial_data, bounds, response["sampled_at"])
+    return response
+
+@app.get("/spatial_heatmap")
+async def get_spatial_heatmap(city: str = Query("Delhi")):
+    """Generates random-scattered PM2.5 points."""
+    if city not in CITY_BOUNDING_BOXES:
+        raise HTTPException(status_code=404, detail="City bounding box not found")
+
+    response = await sample_city(city)
+    if response is None:
+        # don't cache (or silently serve) an empty map: say why it is empty
+        return JSONResponse({"error": "No air quality data from upstream.", "upstream": GOVERNOR.snapshot()["owm"]}, status_code=503)
     return response
 
+# -----------------------------------------------------------
+# HEATMAP TILES
+# -----------------------------------------------------------
+_sampling = {}  # city -> in-flight sampling task, referenced until it finishes
+
+async def _sample_and_render(city: str):
+    if await sample_city(city) is None:
+        log.warning("No spatial samples: tiles not rendered", extra={"city": city})
+
+def _sample_in_background(city: str) -> asyncio.Task:
+    """One sampling sweep per city at a time: concurrent first views and re-render requests share it."""
+    task = _sampling.get(city)
+    if task is None:
+        task = asyncio.get_running_loop().create_task(_sample_and_render(city))
+        _sampling[city] = task
+        task.add_done_callback(lambda _: _sampling.pop(city, None))
+    return task
+
+@app.get("/tiles/{city}")
+async def tiles_meta(city: str):
+    """Current tile pyramid of a city: version, zooms, bounds and the versioned URL template."""
+    if city not in CITY_BOUNDING_BOXES:
+        raise HTTPException(status_code=404, detail="City bounding box not found")
+    manifest = tile_store.manifest(city)
+    status = {"rendering": city in _sampling or tile_renderer.rendering(city), "error": tile_renderer.errors.get(city)}
+    if manifest is None:
+        return JSONResponse({"city": city, "error": "No tiles rendered yet.", **status}, status_code=404)
+    return {**tile_summary(manifest), **status}
+
+@app.post("/tiles/{city}/render")
+async def tiles_render(city: str, resample: bool = Query(False, description="Fetch new spatial samples first")):
+    """Re-renders the city's pyramid in the background from the latest (or, with resample, new) samples."""
+    if city not in CITY_BOUNDING_BOXES:
+        raise HTTPException(status_code=404, detail="City bounding box not found")
+    cached_value = None if resample else spatial_cache.get(city)
+    if resample:
+        spatial_cache.pop(city, None)
+    if cached_value:
+        tile_renderer.schedule(city, cached_value["points"], CITY_BOUNDING_BOXES[city], cached_value.get("sampled_at"))
+    else:
+        _sample_in_background(city)
+    return JSONResponse({"city": city, "status": "scheduled"}, status_code=202)
+
+@app.get("/tiles/{city}/{z}/{x}/{y}.png")
+async def get_tile(request: Request, city: str, z: int, x: int, y: int, v: str = Query(None)):
+    """
+    One 256 px PM2.5 tile. With v= the current version the URL names this exact content and is
+    cached for a year; otherwise it is cacheable for TILE_MAX_AGE and revalidated by ETag.
+    """
+    bounds = CITY_BOUNDING_BOXES.get(city)
+    if bounds is None:
+        raise HTTPException(status_code=404, detail="City bounding box not found")
+    manifest = tile_store.manifest(city)
+    if manifest is None:
+        # first request for the city: render in the background, show nothing meanwhile
+        if not tile_renderer.rendering(city):
+            _sample_in_background(city)
+        return Response(EMPTY_TILE, media_type="image/png", headers={"Cache-Control": "no-store"})
+    if not in_pyramid(manifest["bounds"], z, x, y, manifest["zooms"]):
+        raise HTTPException(status_code=404, detail="Tile outside the pyramid")
+
+    stored = tile_store.tile(city, z, x, y)
+    tag = etag("t", stored[1][:16] if stored else "empty")
+    if v == manifest["version"]:
+        cache = f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    else:
+        cache = f"public, max-age={TILE_MAX_AGE}"
+    headers = {"Cache-Control": cache, "ETag": tag}
+    if etag_matches(request.headers.get("if-none-match"), tag):
+        return Response(status_code=304, headers=headers)
+    if stored is None:
+        return Response(EMPTY_TILE, media_type="image/png", headers=headers)
+    return FileResponse(stored[0], media_type="image/png", headers=headers)
+
+@app.get("/shadow")
+async def shadow_status():
+    """Shadow scorer load plus primary vs candidate rolling error per city (from the monitor)."""
+    cities = {}
+    for city, stats in monitor.snapshot()["cities"].items():
+        if stats.get("variants"):
+            cities[city] = {PRIMARY: stats["horizons"], **{v: s["horizons"] for v, s in stats["variants"].items()}}
+    return {**shadow.snapshot(), "cities": cities}
+
+@app.post("/models/{city}/promote")
+async def promote_model(city: str):
+    """Makes the candidate bundle the production one."""
+    key = GLOBAL_KEY if MODEL_MODE == "global" else city
+    if key != GLOBAL_KEY and city not in CITY_COORDS:
+        return JSONResponse({"error": "City not supported"}, status_code=400)
+    try:
+        metrics = promote_candidate(key)
+    except FileNotFoundError as e:
+        return JSONResponse({"error": str(e)}, status_code=404)
+    return {"status": "promoted", "city": key, "metrics": metrics}
+
+@app.get("/models/{city}/versions")
+async def model_versions(city: str):
+    """Stored bundle versions (newest first) and which one each pointer serves."""
+    key = GLOBAL_KEY if MODEL_MODE == "global" else city
+    if key != GLOBAL_KEY and city not in CITY_COORDS:
+        return JSONResponse({"error": "City not supported"}, status_code=400)
+    return {
+        "city": key,
+        "current": current_version(key),
+        "candidate": current_version(key, CANDIDATE),
+        "keep": MODEL_KEEP_VERSIONS,
+        "versions": list_versions(key),
+    }
+
+@app.post("/models/{city}/rollback")
+async def rollback_model(city: str, version: str = Query(None)):
+    """Points production back at `version` (default: the previously served one). Pointer swap only."""
+    key = GLOBAL_KEY if MODEL_MODE == "global" else city
+    if key != GLOBAL_KEY and city not in CITY_COORDS:
+        return JSONResponse({"error": "City not supported"}, status_code=400)
+    try:
+        result = rollback(key, version)
+    except FileNotFoundError as e:
+        return JSONResponse({"error": str(e)}, status_code=404)
+    return {"status": "rolled_back", "city": key, **result, "metrics": get_metrics(key)}
+
+@app.get("/upstream/quota")
+async def upstream_quota():
+    """Today's upstream call counters, rate/concurrency limits and circuit state per API."""
+    return GOVERNOR.snapshot()
+
+@app.get("/admin/profile")
+async def admin_profile(seconds: float = Query(10), format: str = Query("collapsed"), interval_ms: float = Query(None),
+                        idle: bool = Query(False), x_admin_token: str = Header(None)):
+    """
+    Samples every thread of this worker for `seconds` and returns collapsed stacks (flamegraph.pl,
+    speedscope) or speedscope JSON. Needs the X-Admin-Token header to match ADMIN_TOKEN.
+    """
+    if not authorized(x_admin_token):
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+    if format not in PROFILE_FORMATS:
+        return JSONResponse({"error": f"format must be one of {list(PROFILE_FORMATS)}"}, status_code=400)
+    try:
+        sampler = await asyncio.to_thread(profile_for, seconds, interval_ms / 1000 if interval_ms else None, idle)
+    except RuntimeError as e:
+        return JSONResponse({"error": str(e)}, status_code=409)
+    body, media = sampler.render(format, name=f"worker {os.getpid()}")
+    return Response(body, media_type=media, headers={f"X-Profile-{k.title().replace('_', '-')}": str(v)
+                                                     for k, v in sampler.summary().items()})
+
 @app.get("/clear_cache")
 async def clear():
     spatial_cache.clear()
     return {"status": "cleared"}
 
+# -----------------------------------------------------------
+# REPORT JOBS
+# -----------------------------------------------------------
+
+@app.post("/report")
+async def create_report(city: str = Query("Delhi"), days: int = Query(7)):
+    """
+    Enqueues a PDF report job and returns its id. Poll GET /report/{job_id} for the result.
+    """
+    if city not in CITY_COORDS:
+        return JSONResponse({"error": "City not supported."}, status_code=400)
+
+    try:
+        job = report_jobs.submit(city, days)
+    except asyncio.QueueFull:
+        return JSONResponse({"error": "Report queue is full, try again shortly."}, status_code=503)
+
+    return JSONResponse(job.to_dict(), status_code=202)
+
 @app.get("/report/pdf")
 async def report_pdf(city: str = Query("Delhi"), days: int = Query(7)):
+    """
+    Generates and downloads a PDF report for the specified city and duration.
+    Kept for existing clients: goes through the job queue and waits for the render.
+    """
     if city not in CITY_COORDS:
         return {"error": "City not supported."}
-    df_history = fetch_history(city, days)
-    metrics = get_metrics(city) or {} 
+
+    log.info("Report requested", extra={"city": city, "days": days})
+
     try:
-        pdf_bytes = generate_pdf_report(city, df_history, metrics, days=days)
-    except Exception as e:
-        return {"error": f"Failed to generate PDF: {e}"}
-    filename = f"{city}_BreatheBetter_report_{days}d.pdf"
-    return StreamingResponse(
-        io.BytesIO(pdf_bytes), 
+        job = report_jobs.submit(city, days)
+    except asyncio.QueueFull:
+        return JSONResponse({"error": "Report queue is full, try again shortly."}, status_code=503)
+
+    await job.done_event.wait()
+    return _report_response(job)
+
+@app.get("/report/{job_id}")
+async def report_status(job_id: str):
+    """
+    Returns the job status while it is pending/running, or the finished PDF.
+    """
+    job = report_jobs.get(job_id)
+    if job is None:
+        return JSONResponse({"error": "Unknown report job."}, status_code=404)
+
+    if job.status in (PENDING, RUNNING):
+        return JSONResponse(job.to_dict(), status_code=202)
+
+    return _report_response(job)
+
+def _report_response(job):
+    if job.status == FAILED or job.path is None or not job.path.exists():
+        return JSONResponse({"error": f"Failed to generate PDF: {job.error}"}, status_code=500)
+
+    filename = f"{job.city}_BreatheBetter_report_{job.days}d.pdf"
+    return FileResponse(
+        job.path,
         media_type="application/pdf",
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
-# Helper must be defined last to avoid circular import issues if moved
-async def get_or_train_model(city: str, train_days: int = 30):
-    bundle, scaler, metrics = load_model(city)
-    if bundle and scaler: return bundle, scaler, metrics
-    
-    print(f"Training new model for {city}...")
+@app.on_event("shutdown")
+async def stop_report_workers():
+    await report_jobs.shutdown()
+    await monitor.shutdown()
+    await shadow.shutdown()
+    for task in list(_sampling.values()):
+        task.cancel()
+    await asyncio.gather(*_sampling.values(), return_exceptions=True)
+    await tile_renderer.shutdown()
+
+def fetch_training_frames(city: str, train_days: int = 30):
+    """
+    Returns (df_pm25, df_weather) for training over the `train_days` before now: the local dataset
+    if backfilled (its missing tail topped up from the APIs when it lags), else the APIs.
+    """
     if city not in CITY_COORDS: raise Exception("City not supported")
     lat, lon = CITY_COORDS[city]
-    
+    now = pd.Timestamp.now(tz="UTC").floor("h")
+
+    # Prefer the backfilled local dataset: it allows windows far beyond the 90-day API cap
+    end = dataset_end(city)
+    lag_hours = (now - end) / pd.Timedelta(hours=1) if end is not None else None
+    # usable if it reaches into the window and the APIs (90 days back) can fill whatever it lacks
+    if end is not None and lag_hours < min(train_days, 89) * 24:
+        df_pm25, df_weather = read_window(city, train_days, end=now)
+        if not df_pm25.empty and not df_weather.empty:
+            if lag_hours <= DATASET_MAX_LAG_HOURS:
+                log.info("Training frames", extra={"city": city, "source": "dataset", "rows": len(df_pm25)})
+                return df_pm25, df_weather
+            tail = _api_tail(city, lat, lon, end, now)
+            if tail is not None:
+                df_pm25 = pd.concat([df_pm25, tail[0]], ignore_index=True)
+                df_weather = pd.concat([df_weather, tail[1]], ignore_index=True).drop_duplicates("datetime").reset_index(drop=True)
+                log.info("Training frames", extra={"city": city, "source": "dataset+api", "rows": len(df_pm25),
+                                                   "topped_up_hours": len(tail[0])})
+                return df_pm25, df_weather
+            log.warning("Dataset lags and the API tail failed", extra={"city": city, "lag_hours": round(lag_hours)})
+
     df_pm25 = fetch_history(city, 14)
     if df_pm25 is None or df_pm25.empty: raise Exception("No history found")
-    
+    log.info("Training frames", extra={"city": city, "source": "api", "rows": len(df_pm25),
+                                       "dataset_end": str(end) if end is not None else None})
+    return df_pm25, _training_weather(lat, lon, df_pm25)
+
+def _api_tail(city: str, lat: float, lon: float, after: pd.Timestamp, now: pd.Timestamp):
+    """(df_pm25, df_weather) for the observed hours in (after, now] from the APIs, or None."""
+    days = min(90, math.ceil((now - after) / pd.Timedelta(days=1)) + 1)
+    df_pm25 = fetch_history(city, days)
+    if df_pm25 is None or df_pm25.empty:
+        return None
+    df_pm25 = df_pm25[(df_pm25["datetime"] > after) & (df_pm25["datetime"] <= now)][["datetime", "pm25"]].reset_index(drop=True)
+    if df_pm25.empty:
+        return None
+    try:
+        return df_pm25, _training_weather(lat, lon, df_pm25)
+    except Exception:
+        return None
+
+def fetch_pollutant_frames(city: str, train_days: int = 30):
+    """Returns (df_pollutants, df_weather) for the multi-pollutant engine; the APIs keep at most 90 days."""
+    if city not in CITY_COORDS: raise Exception("City not supported")
+    lat, lon = CITY_COORDS[city]
+    df_pollutants = fetch_pollutants(city, min(train_days, 90))
+    if df_pollutants is None or df_pollutants.empty: raise Exception("No history found")
+    return df_pollutants, _training_weather(lat, lon, df_pollutants)
+
+def _training_weather(lat: float, lon: float, df_pm25: pd.DataFrame):
+    """Past weather covering the datetimes of df_pm25."""
     start = pd.to_datetime(df_pm25["datetime"].min())
     days_fetch = max(1, (pd.Timestamp.utcnow() - start).days + 2)
     df_weather = fetch_hourly_weather(lat, lon, past_days=days_fetch, forecast_hours=0)
@@ -402,7 +1105,102 @@ async def get_or_train_model(city: str, train_days: int = 30):
                             (df_weather["datetime"] <= end + pd.Timedelta(hours=1))].reset_index(drop=True)
     
     if df_weather.empty: raise Exception("No overlapping weather data")
+    return df_weather
+
+async def get_or_train_global_model(train_days: int = 30):
+    bundle, scaler, metrics = load_model(GLOBAL_KEY)
+    if bundle and scaler: return bundle, scaler, metrics
+
+    log.info("Training new global model for all cities")
+    results = await asyncio.gather(
+        *[asyncio.to_thread(fetch_training_frames, city, train_days) for city in CITY_COORDS],
+        return_exceptions=True
+    )
+    frames = {city: r for city, r in zip(CITY_COORDS, results) if not isinstance(r, Exception)}
+    metrics = await asyncio.to_thread(train_global_model, frames)
+    bundle, scaler, _ = load_model(GLOBAL_KEY)
+    return bundle, scaler, metrics
+
+async def train_candidate(city: str, train_days: int = 30):
+    """Trains the candidate bundle for `city` (or the global candidate) without touching production."""
+    if city not in CITY_COORDS: raise Exception("City not supported")
+    if MODEL_MODE == "global":
+        results = await asyncio.gather(
+            *[asyncio.to_thread(fetch_training_frames, c, train_days) for c in CITY_COORDS],
+            return_exceptions=True
+        )
+        frames = {c: r for c, r in zip(CITY_COORDS, results) if not isinstance(r, Exception)}
+        return await asyncio.to_thread(train_global_model, frames, variant=CANDIDATE)
+
+    df_pm25, df_weather = await asyncio.to_thread(fetch_training_frames, city, train_days)
+    return await asyncio.to_thread(train_model, city, df_pm25, df_weather, variant=CANDIDATE)
+
+# Helper must be defined last to avoid circular import issues if moved
+async def get_or_train_model(city: str, train_days: int = 30, mode: str = None):
+    if MODEL_MODE == "global":
+        if city not in CITY_COORDS: raise Exception("City not supported")
+        return await get_or_train_global_model(train_days)
+
+    bundle, scaler, metrics = load_model(city)
+    if bundle and scaler: return bundle, scaler, metrics
     
-    metrics = train_model(city, df_pm25, df_weather)
+    log.info("Training new model", extra={"city": city})
+    if city not in CITY_COORDS: raise Exception("City not supported")
+
+    mode = mode or TRAIN_MODE
+    if has_dataset(city) and mode == "chunked":
+        from app.ml.chunked import train_model_chunked
+        start = pd.Timestamp.now("UTC") - pd.Timedelta(days=train_days)
+        metrics = await asyncio.to_thread(train_model_chunked, city, iter_dataset(city, start=start))
+        bundle, scaler, _ = load_model(city)
+        return bundle, scaler, metrics
+
+    df_pm25, df_weather = await asyncio.to_thread(fetch_training_frames, city, train_days)
+    metrics = await asyncio.to_thread(train_model, city, df_pm25, df_weather)
     bundle, scaler, _ = load_model(city)
-    return bundle, scaler, metrics
\ No newline at end of file
+    return bundle, scaler, metrics
+
+# -----------------------------------------------------------
+# COLD CITIES: baseline now, full model in the background
+# -----------------------------------------------------------
+cold_trainings = {}  # model key -> background training task
+cold_failures = {}   # model key -> (time.monotonic() of the failure, error)
+
+async def _train_cold(key: str, city: str):
+    try:
+        await get_or_train_model(city)
+        cold_failures.pop(key, None)
+        log.info("Background training finished", extra={"key": key})
+    except Exception as e:
+        cold_failures[key] = (time.monotonic(), str(e))
+        log.error("Background training failed", extra={"key": key, "error": str(e)})
+    finally:
+        cold_trainings.pop(key, None)
+
+def cold_training_status(key: str) -> dict:
+    if key in cold_trainings:
+        return {"status": "training"}
+    failed = cold_failures.get(key)
+    if failed is not None:
+        return {"status": "failed", "error": failed[1],
+                "retry_in_seconds": max(0, round(COLD_TRAIN_RETRY - (time.monotonic() - failed[0])))}
+    return {"status": "trained"}
+
+async def get_model_or_baseline(city: str):
+    """
+    (bundle, scaler, metrics) when the city's model (or the global one) is trained. Otherwise starts
+    training it in the background, once (a failure is retried after COLD_TRAIN_RETRY), and returns
+    (None, None, None) so the caller serves the baseline meanwhile.
+    """
+    if not BASELINE_FALLBACK:
+        return await get_or_train_model(city)
+    if city not in CITY_COORDS: raise Exception("City not supported")
+    key = GLOBAL_KEY if MODEL_MODE == "global" else city
+    bundle, scaler, metrics = load_model(key)
+    if bundle and scaler: return bundle, scaler, metrics
+
+    failed = cold_failures.get(key)
+    if key not in cold_trainings and (failed is None or time.monotonic() - failed[0] >= COLD_TRAIN_RETRY):
+        log.info("Serving the baseline while the model trains", extra={"key": key})
+        cold_trainings[key] = asyncio.get_running_loop().create_task(_train_cold(key, city))
+    return None, None, None
@@ -0,0 +1,101 @@
+# app/ml/baseline.py
+"""
+Instant baseline forecast for cities without a trained bundle.
+- diurnal climatology: mean PM2.5 per hour of day over the recent history, lightly smoothed
+  around the clock (1-2-1 over neighbouring hours)
+- the last observed anomaly from that profile decays with the lag-1 autocorrelation of the
+  anomalies (an AR(1) on top of the climatology): near hours follow the latest reading, later
+  hours relax to the daily cycle
+- the 95% band comes from the anomaly spread, widening with lead time like the AR(1) does
+- no training and no weather: a few array operations on the history /predict fetched anyway
+- the history is cut at the hour before the first forecast hour (like the LSTM's anchor):
+  fetch_history ends with Open-Meteo's forecast days, which are not observations
+
+/predict and /forecast/weekly serve it (model: "baseline") while the city's first bundle trains
+in the background; the next request after training finishes gets the full model.
+"""
+
+import numpy as np
+import pandas as pd
+
+from app.utils.resample import epoch_hours, hourly_grid
+
+ENGINE = "baseline"
+CLIMATOLOGY_DAYS = 7
+DEFAULT_RHO = 0.9   # anomaly persistence when the history is too short to estimate it
+MAX_RHO = 0.98
+
+
+def _hourly(last_history: pd.DataFrame, anchor: int = None):
+    """
+    (epoch hours, values) of the last CLIMATOLOGY_DAYS up to `anchor` (default: the newest reading)
+    on a dense hourly grid, NaN where nothing was observed.
+    """
+    hours = epoch_hours(last_history["datetime"])
+    values = pd.to_numeric(last_history["pm25"], errors="coerce").to_numpy(dtype=np.float64)
+    ok = ~np.isnan(values)
+    if anchor is not None:
+        ok &= hours <= anchor
+    if not ok.any():
+        raise ValueError("No PM2.5 readings in the history")
+    end = int(hours[ok].max())
+    grid, means = hourly_grid(hours[ok], values[ok], start=end - CLIMATOLOGY_DAYS * 24 + 1, end=end)
+    return grid, means[:, 0]
+
+
+def fit(last_history: pd.DataFrame, anchor: int = None) -> dict:
+    """Climatology (24 values), anomaly persistence and spread, and the last observation up to `anchor`."""
+    hours, values = _hourly(last_history, anchor)
+    hod = hours % 24
+    ok = ~np.isnan(values)
+
+    sums = np.bincount(hod[ok], weights=values[ok], minlength=24)
+    counts = np.bincount(hod[ok], minlength=24)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        clim = np.where(counts > 0, sums / counts, np.nan)
+    clim = np.where(np.isnan(clim), np.nanmean(values), clim)
+    clim = (np.roll(clim, 1) + 2 * clim + np.roll(clim, -1)) / 4
+
+    anomaly = values - clim[hod]
+    pairs = ~np.isnan(anomaly[1:]) & ~np.isnan(anomaly[:-1])
+    if pairs.sum() >= 24:
+        prev, cur = anomaly[:-1][pairs], anomaly[1:][pairs]
+        denom = float(prev @ prev)
+        rho = float(np.clip(prev @ cur / denom, 0.0, MAX_RHO)) if denom > 0 else DEFAULT_RHO
+    else:
+        rho = DEFAULT_RHO
+    spread = float(np.nanstd(anomaly)) if ok.sum() > 1 else 0.0
+
+    last = np.flatnonzero(ok)[-1]
+    return {
+        "climatology": clim,
+        "rho": rho,
+        "spread": spread,
+        "last_hour": int(hours[last]),
+        "last_anomaly": float(anomaly[last]),
+        "history_hours": int(ok.sum()),
+    }
+
+
+def forecast(last_history: pd.DataFrame, future_weather: pd.DataFrame) -> dict:
+    """
+    Baseline PM2.5 for the datetimes of `future_weather` (only its datetime column is used).
+    Returns datetimes, predictions and the per-hour sd of the forecast.
+    """
+    if last_history is None or last_history.empty:
+        raise ValueError("last_history required for the baseline forecast.")
+    dt = pd.to_datetime(future_weather["datetime"], utc=True).sort_values()
+    hours = epoch_hours(dt)
+    params = fit(last_history, anchor=int(hours.min()) - 1 if len(hours) else None)
+
+    lead = np.maximum(hours - params["last_hour"], 1)
+    decay = params["rho"] ** lead
+    preds = np.maximum(params["climatology"][hours % 24] + params["last_anomaly"] * decay, 0.0)
+    sigma = params["spread"] * np.sqrt(1.0 - decay ** 2)
+    return {
+        "datetimes": [str(d) for d in dt],
+        "predictions": preds,
+        "sigma": sigma,
+        "rho": round(params["rho"], 4),
+        "history_hours": params["history_hours"],
+    }
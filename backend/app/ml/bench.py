@@ -0,0 +1,285 @@
+# app/ml/bench.py
+"""
+Offline benchmarks for the ML path. Artifacts are written to a temporary weights dir,
+never over app/ml/weights.
+
+    python -m app.ml.bench layout --days 60 --hours 168
+    python -m app.ml.bench memory --days 90
+"""
+
+import io
+import sys
+import json
+import zlib
+import time
+import pickle
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import app.ml.model as model_mod
+from app.utils.locations import CITY_COORDS
+
+
+def synthetic_city(city: str, days: int, seed: int = 0):
+    """Deterministic hourly PM2.5 + weather with a diurnal cycle, a slow drift and noise."""
+    rng = np.random.default_rng(zlib.crc32(city.encode()) + seed)
+    t = pd.date_range(end=pd.Timestamp.now("UTC").floor("h"), periods=days * 24, freq="h")
+    phase = 2 * np.pi * t.hour.values / 24
+    base = 40 + 15 * rng.random()
+    temp = 25 + 6 * np.sin(phase) + rng.normal(0, 1, len(t))
+    wind = np.clip(3 + rng.normal(0, 1, len(t)), 0, None)
+    pm25 = np.clip(base + 25 * np.sin(phase + 1) - 4 * wind + np.cumsum(rng.normal(0, 1, len(t))) * 0.2 + rng.normal(0, 4, len(t)), 1, None)
+    df_pm25 = pd.DataFrame({"datetime": t, "pm25": pm25})
+    df_weather = pd.DataFrame({
+        "datetime": t, "temp": temp, "humidity": 60 + rng.normal(0, 8, len(t)),
+        "pressure": 1008 + rng.normal(0, 2, len(t)), "wind": wind, "precipitation": np.zeros(len(t)),
+    })
+    return df_pm25, df_weather
+
+
+def future_weather(df_weather: pd.DataFrame, hours: int) -> pd.DataFrame:
+    """Reuses the last `hours` of weather, shifted into the future."""
+    fut = df_weather.tail(hours).copy()
+    fut["datetime"] = fut["datetime"] + pd.Timedelta(hours=hours)
+    return fut.reset_index(drop=True)
+
+
+def _bundle_bytes(bundle) -> int:
+    buf = io.BytesIO()
+    pickle.dump(bundle, buf, protocol=pickle.HIGHEST_PROTOCOL)
+    return buf.tell()
+
+
+def _load_traced(key: str):
+    """Loads a bundle and returns (bundle, scaler, python heap bytes allocated by the load)."""
+    tracemalloc.start()
+    bundle, scaler, _ = model_mod.load_model(key)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return bundle, scaler, peak
+
+
+# -----------------------
+# per-city vs global layout
+# -----------------------
+def bench_layout(days: int, hours: int) -> dict:
+    from app.ml.global_model import GLOBAL_KEY, train_global_model, predict_future_batch, add_location_features
+
+    cities = list(CITY_COORDS)
+    frames = {c: synthetic_city(c, days) for c in cities}
+    inputs = {c: (future_weather(frames[c][1], hours), frames[c][0]) for c in cities}
+    report = {"cities": len(cities), "days": days, "horizon_hours": hours}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_mod.WEIGHTS_DIR = Path(tmp)
+
+        # per-city bundles
+        t0 = time.perf_counter()
+        per_city_mae = {}
+        for c in cities:
+            per_city_mae[c] = model_mod.train_model(c, *frames[c])["MAE"]
+        train_s = time.perf_counter() - t0
+
+        loaded, disk, heap, resident = {}, 0, 0, 0
+        for c in cities:
+            bundle, scaler, traced = _load_traced(c)
+            loaded[c] = (bundle, scaler)
+            disk += model_mod.get_model_paths(c)[0].stat().st_size
+            heap += traced
+            resident += _bundle_bytes(bundle)
+
+        t0 = time.perf_counter()
+        for c in cities:
+            bundle, scaler = loaded[c]
+            model_mod.predict_future(bundle, scaler, inputs[c][0], last_history=inputs[c][1])
+        predict_s = time.perf_counter() - t0
+
+        report["per_city"] = {
+            "train_seconds": round(train_s, 2),
+            "bundle_disk_mb": round(disk / 1e6, 2),
+            "bundle_pickled_mb": round(resident / 1e6, 2),
+            "load_heap_mb": round(heap / 1e6, 2),
+            "predict_all_seconds": round(predict_s, 3),
+            "mae": per_city_mae,
+        }
+        del loaded
+
+        # one global bundle
+        t0 = time.perf_counter()
+        g_metrics = train_global_model(frames)
+        train_s = time.perf_counter() - t0
+
+        bundle, scaler, traced = _load_traced(GLOBAL_KEY)
+        g_inputs = {c: (add_location_features(fw, c), hist) for c, (fw, hist) in inputs.items()}
+        t0 = time.perf_counter()
+        predict_future_batch(bundle, scaler, g_inputs)
+        predict_s = time.perf_counter() - t0
+
+        report["global"] = {
+            "train_seconds": round(train_s, 2),
+            "bundle_disk_mb": round(model_mod.get_model_paths(GLOBAL_KEY)[0].stat().st_size / 1e6, 2),
+            "bundle_pickled_mb": round(_bundle_bytes(bundle) / 1e6, 2),
+            "load_heap_mb": round(traced / 1e6, 2),
+            "predict_all_seconds": round(predict_s, 3),
+            "mae": {c: v["MAE"] for c, v in g_metrics["per_city"].items()},
+        }
+
+    return report
+
+
+# -----------------------
+# inference backends
+# -----------------------
+def bench_inference(days: int, hours: int, backends: list) -> dict:
+    from app.ml import inference
+
+    frames = synthetic_city("Delhi", days)
+    fw = future_weather(frames[1], hours)
+    report = {"days": days, "horizon_hours": hours, "backends": {}}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_mod.WEIGHTS_DIR = Path(tmp)
+        model_mod.train_model("Delhi", *frames)
+        bundle, scaler, _ = model_mod.load_model("Delhi")
+
+        baseline = None
+        for backend in backends:
+            try:
+                t0 = time.perf_counter()
+                predictor, parity = inference.export(bundle, backend)
+                export_s = time.perf_counter() - t0
+            except Exception as e:
+                report["backends"][backend] = {"error": str(e)}
+                continue
+
+            inference._PREDICTORS.clear()
+            inference.INFERENCE_BACKEND = backend
+            model_mod.predict_future(bundle, scaler, fw, last_history=frames[0])  # warm the cache
+            t0 = time.perf_counter()
+            out = model_mod.predict_future(bundle, scaler, fw, last_history=frames[0])
+            predict_s = time.perf_counter() - t0
+
+            X = inference.probe_rows(bundle, n=hours)
+            t0 = time.perf_counter()
+            for i in range(len(X)):
+                predictor.predict(X[i:i + 1])
+            per_row_us = (time.perf_counter() - t0) / len(X) * 1e6
+
+            if baseline is None:
+                baseline = out["predictions"]
+            report["backends"][backend] = {
+                "export_seconds": round(export_s, 3),
+                "parity": parity,
+                "predict_future_seconds": round(predict_s, 4),
+                "single_row_predict_us": round(per_row_us, 1),
+                "max_abs_diff_vs_first": float(np.abs(out["predictions"] - baseline).max()),
+            }
+
+    return report
+
+
+# -----------------------
+# data-path memory: DataFrames vs HourlySeries
+# -----------------------
+def _traced(fn):
+    """(result, peak bytes, bytes still allocated afterwards) of fn() under tracemalloc."""
+    tracemalloc.start()
+    try:
+        result = fn()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak, current
+
+
+def _frame_path(df_pm25, df_weather):
+    """What train_model did before the compact path: merged frame -> feature frame -> float64 X + scaled copies."""
+    from app.utils.preprocess import merge_pm25_weather, make_features
+    from sklearn.preprocessing import StandardScaler
+
+    df_feat = make_features(merge_pm25_weather(df_pm25, df_weather))
+    X = df_feat.drop(columns=["datetime", "y"])
+    split = int(len(X) * 0.8)
+    scaler = StandardScaler()
+    return scaler.fit_transform(X.iloc[:split]), scaler.transform(X.iloc[split:]), df_feat["y"].values
+
+
+def _compact_path(df_pm25, df_weather):
+    from app.utils.preprocess import series_inputs, merge_series, feature_arrays
+    from sklearn.preprocessing import StandardScaler
+
+    X, y, _, _, _ = feature_arrays(merge_series(*series_inputs(df_pm25, df_weather)))
+    split = int(len(X) * 0.8)
+    scaler = StandardScaler(copy=False).fit(X[:split])
+    scaler.transform(X)
+    return X[:split], X[split:], y
+
+
+def bench_memory(days: int) -> dict:
+    """
+    Python-heap peak while preparing training matrices for every city, and what stays allocated
+    when each city's inputs are held between requests, for both representations.
+    """
+    from app.utils.series import HourlySeries
+
+    frames = {c: synthetic_city(c, days) for c in CITY_COORDS}
+    report = {"cities": len(frames), "days": days, "hours_per_city": days * 24}
+
+    for name, path in (("dataframe", _frame_path), ("compact", _compact_path)):
+        path(*frames[next(iter(frames))])  # warm up: lazy imports and caches are not the data path
+        t0 = time.perf_counter()
+        out, peak, held = _traced(lambda: {c: path(*f) for c, f in frames.items()})
+        report[name] = {
+            "prepare_peak_mb": round(peak / 1e6, 2),
+            "matrices_held_mb": round(held / 1e6, 2),
+            "seconds": round(time.perf_counter() - t0, 3),
+        }
+        del out
+
+    # steady state: the inputs a worker keeps per city (history + weather)
+    _, _, held = _traced(lambda: {c: (pm.copy(), w.copy()) for c, (pm, w) in frames.items()})
+    report["dataframe"]["inputs_held_mb"] = round(held / 1e6, 2)
+    _, _, held = _traced(lambda: {c: (HourlySeries.from_frame(pm), HourlySeries.from_frame(w)) for c, (pm, w) in frames.items()})
+    report["compact"]["inputs_held_mb"] = round(held / 1e6, 2)
+
+    for key in ("prepare_peak_mb", "matrices_held_mb", "inputs_held_mb"):
+        before, after = report["dataframe"][key], report["compact"][key]
+        report.setdefault("reduction_percent", {})[key] = round(100 * (1 - after / before), 1) if before else None
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="BreatheBetter ML benchmarks (synthetic data).")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_layout = sub.add_parser("layout", help="per-city bundles vs one global bundle")
+    p_layout.add_argument("--days", type=int, default=60)
+    p_layout.add_argument("--hours", type=int, default=168)
+
+    p_inf = sub.add_parser("inference", help="sklearn vs compiled inference backends")
+    p_inf.add_argument("--days", type=int, default=60)
+    p_inf.add_argument("--hours", type=int, default=168)
+    p_inf.add_argument("--backends", nargs="+", default=["sklearn", "numpy", "onnx"])
+
+    p_mem = sub.add_parser("memory", help="DataFrame vs compact (HourlySeries / float32) data path")
+    p_mem.add_argument("--days", type=int, default=90)
+
+    args = parser.parse_args(argv)
+    if args.cmd == "memory":
+        report = bench_memory(args.days)
+    elif args.cmd == "layout":
+        report = bench_layout(args.days, args.hours)
+    elif args.cmd == "inference":
+        report = bench_inference(args.days, args.hours, args.backends)
+
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+# app/ml/chunked.py
+"""
+Out-of-core training for long histories.
+
+train_model_chunked builds the same features as train_model, but one source chunk
+(e.g. one monthly Parquet partition) at a time, and never holds the full history in memory:
+- features are spilled to float32 .npy files and re-read through memory maps
+- the scaler is fitted with StandardScaler.partial_fit
+- XGBoost trains from a DataIter into an external-memory quantile DMatrix
+- LinearRegression is solved from accumulated normal equations (exact)
+- RandomForest is fitted on a bounded reservoir sample of the training rows
+- test metrics are accumulated chunk by chunk
+
+Peak RSS of the process is reported in the metrics.
+"""
+
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from sklearn.preprocessing import StandardScaler
+from sklearn.linear_model import LinearRegression
+from sklearn.ensemble import RandomForestRegressor
+
+from app.ml.model import DEFAULT_LAGS, ENSEMBLE_WEIGHTS, get_xgb_regressor, accuracy_from_mae, save_bundle, feature_importance
+from app.ml.explain import IMPORTANCE_MAX_ROWS
+
+# rows kept for the RandomForest fit; bounds its memory regardless of history length
+RF_MAX_ROWS = int(os.environ.get("RF_MAX_ROWS", 200_000))
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (None where `resource` is unavailable)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+# -----------------------
+# Feature spilling
+# -----------------------
+def spill_feature_chunks(source, workdir: str, lags: list, horizon: int):
+    """
+    Builds features for each raw chunk from `source` and writes X/y as float32 .npy files.
+    The last (max_lag + horizon) raw rows of each chunk are carried into the next one so
+    lags and targets across chunk boundaries match a single-frame make_features.
+    Returns (feature_names, [(X_path, y_path, rows)]).
+    """
+    from app.utils.preprocess import merge_pm25_weather, make_features, WEIGHT_COLUMN
+
+    carry = None
+    last_emitted = None
+    feature_names = None
+    chunks = []
+    keep = max(lags) + horizon
+
+    for raw in source:
+        if raw is None or raw.empty:
+            continue
+        raw = pd.concat([carry, raw], ignore_index=True) if carry is not None else raw
+        carry = raw.tail(keep)
+
+        df_pm25 = raw[["datetime", "pm25"]].dropna()
+        df_weather = raw.drop(columns=["pm25"])
+        if df_pm25.empty:
+            continue
+
+        merged = merge_pm25_weather(df_pm25, df_weather)
+        if merged is None or merged.empty:
+            continue
+        df_feat = make_features(merged, lags=lags, horizon=horizon)
+        if last_emitted is not None:
+            df_feat = df_feat[df_feat["datetime"] > last_emitted]
+        if df_feat.empty:
+            continue
+        last_emitted = df_feat["datetime"].iloc[-1]
+
+        # per-row weights are not spilled; out-of-core training weighs every row the same
+        X = df_feat.drop(columns=["datetime", "y", WEIGHT_COLUMN], errors="ignore")
+        if feature_names is None:
+            feature_names = list(X.columns)
+        X = X.reindex(columns=feature_names, fill_value=0.0).to_numpy(dtype=np.float32)
+        y = df_feat["y"].to_numpy(dtype=np.float32)
+
+        i = len(chunks)
+        x_path = os.path.join(workdir, f"X_{i:05d}.npy")
+        y_path = os.path.join(workdir, f"y_{i:05d}.npy")
+        np.save(x_path, X)
+        np.save(y_path, y)
+        chunks.append((x_path, y_path, len(y)))
+        del raw, df_pm25, df_weather, merged, df_feat, X, y
+
+    return feature_names, chunks
+
+
+def _slices(chunks: list, lo: int, hi: int):
+    """Yields memory-mapped (X, y) slices covering global rows [lo, hi)."""
+    offset = 0
+    for x_path, y_path, rows in chunks:
+        start, end = max(lo, offset), min(hi, offset + rows)
+        if start < end:
+            X = np.load(x_path, mmap_mode="r")
+            y = np.load(y_path, mmap_mode="r")
+            yield X[start - offset:end - offset], y[start - offset:end - offset]
+        offset += rows
+
+
+def _make_data_iter(chunks, lo, hi, scaler, cache_prefix):
+    import xgboost
+
+    class _ChunkIter(xgboost.DataIter):
+        def __init__(self):
+            self._it = None
+            super().__init__(cache_prefix=cache_prefix)
+
+        def next(self, input_data):
+            if self._it is None:
+                self._it = _slices(chunks, lo, hi)
+            try:
+                X, y = next(self._it)
+            except StopIteration:
+                return False
+            input_data(data=scaler.transform(X).astype(np.float32), label=np.asarray(y))
+            return True
+
+        def reset(self):
+            self._it = None
+
+    return _ChunkIter()
+
+
+# -----------------------
+# Training
+# -----------------------
+def train_model_chunked(city: str, source, lags: list = None, horizon: int = 1, rf_max_rows: int = RF_MAX_ROWS, seed: int = 42) -> dict:
+    """
+    Train the ensemble from an iterable of raw hourly chunks (datetime, pm25, weather columns),
+    e.g. app.utils.dataset.iter_dataset(city, start=...). Saves the bundle like train_model.
+    """
+    if lags is None:
+        lags = DEFAULT_LAGS
+
+    XGBRegressor = get_xgb_regressor()
+    rng = np.random.default_rng(seed)
+    weights = dict(ENSEMBLE_WEIGHTS)
+    if XGBRegressor is None:
+        weights = {"xgb": 0, "rf": 0.6, "lr": 0.4}
+
+    with tempfile.TemporaryDirectory(prefix=f"bb_train_{city.lower()}_") as workdir:
+        feature_names, chunks = spill_feature_chunks(source, workdir, lags, horizon)
+        n = sum(rows for _, _, rows in chunks)
+        if n < 30:
+            raise ValueError(f"Not enough rows to train for {city} (need >=30 rows, got {n}).")
+
+        # chronological split, same as train_model
+        split_idx = int(n * 0.8)
+
+        # 1. streaming scaler fit on the training rows
+        scaler = StandardScaler()
+        for X, _ in _slices(chunks, 0, split_idx):
+            scaler.partial_fit(X)
+
+        # 2. linear regression from normal equations + reservoir sample for the forest
+        n_feat = len(feature_names)
+        xtx = np.zeros((n_feat + 1, n_feat + 1))
+        xty = np.zeros(n_feat + 1)
+        sample_size = min(rf_max_rows, split_idx)
+        res_X = np.empty((sample_size, n_feat), dtype=np.float32)
+        res_y = np.empty(sample_size, dtype=np.float32)
+        seen = 0
+        for X, y in _slices(chunks, 0, split_idx):
+            Xs = scaler.transform(X)
+            Xa = np.hstack([Xs, np.ones((len(Xs), 1))])
+            xtx += Xa.T @ Xa
+            xty += Xa.T @ y
+
+            # vectorized reservoir sampling (Algorithm R)
+            idx = np.arange(seen, seen + len(y))
+            fill = idx < sample_size
+            res_X[idx[fill]] = Xs[fill]
+            res_y[idx[fill]] = y[fill]
+            slots = rng.integers(0, idx[~fill] + 1) if (~fill).any() else np.array([], dtype=int)
+            take = slots < sample_size
+            res_X[slots[take]] = Xs[~fill][take]
+            res_y[slots[take]] = y[~fill][take]
+            seen += len(y)
+
+        beta = np.linalg.lstsq(xtx, xty, rcond=None)[0]
+        lr = LinearRegression()
+        lr.coef_, lr.intercept_ = beta[:-1], float(beta[-1])
+        lr.n_features_in_ = n_feat
+
+        rf = RandomForestRegressor(n_estimators=200, n_jobs=-1, random_state=seed)
+        rf.fit(res_X, res_y)
+        del res_X, res_y
+
+        # 3. external-memory XGBoost
+        xgb_model = None
+        if XGBRegressor is not None:
+            import xgboost
+            it = _make_data_iter(chunks, 0, split_idx, scaler, os.path.join(workdir, "xgb_cache"))
+            dtrain = xgboost.ExtMemQuantileDMatrix(it) if hasattr(xgboost, "ExtMemQuantileDMatrix") else xgboost.DMatrix(it)
+            params = {"learning_rate": 0.05, "max_depth": 6, "subsample": 0.9, "colsample_bytree": 0.9,
+                      "objective": "reg:squarederror", "seed": seed, "verbosity": 0, "tree_method": "hist"}
+            booster = xgboost.train(params, dtrain, num_boost_round=250)
+            del dtrain
+            xgb_model = XGBRegressor(n_estimators=250, **{k: v for k, v in params.items() if k != "seed"}, random_state=seed)
+            xgb_model._Booster = booster
+
+        models = {"xgb": xgb_model, "rf": rf, "lr": lr}
+
+        # 4. streaming evaluation on the test rows
+        acc = {"n": 0, "abs": 0.0, "sq": 0.0, "y": 0.0, "y2": 0.0, "tree_var": 0.0}
+        res = {k: [0.0, 0.0] for k in models}  # sum, sum of squares of residuals
+        # evenly spaced test rows for the global importances, picked up as their chunk goes by
+        probe_at = np.unique(np.linspace(split_idx, n - 1, IMPORTANCE_MAX_ROWS).astype(np.int64))
+        probe, pos = [], split_idx
+        for X, y in _slices(chunks, split_idx, n):
+            Xs = scaler.transform(X)
+            take = probe_at[(probe_at >= pos) & (probe_at < pos + len(Xs))] - pos
+            if len(take):
+                probe.append(Xs[take])
+            pos += len(Xs)
+            y = np.asarray(y, dtype=float)
+            preds = {k: (m.predict(Xs) if m is not None else np.zeros(len(y))) for k, m in models.items()}
+            p = sum(weights.get(k, 0) * preds[k] for k in models)
+
+            acc["n"] += len(y)
+            acc["abs"] += float(np.abs(y - p).sum())
+            acc["sq"] += float(((y - p) ** 2).sum())
+            acc["y"] += float(y.sum())
+            acc["y2"] += float((y ** 2).sum())
+            for k in models:
+                r = y - preds[k]
+                res[k][0] += float(r.sum())
+                res[k][1] += float((r ** 2).sum())
+
+            # per-tree spread, bounded by the chunk size
+            tree_preds = np.vstack([t.predict(Xs) for t in rf.estimators_])
+            acc["tree_var"] += float(np.var(tree_preds, axis=0, ddof=1).sum())
+
+    n_test = acc["n"]
+    mae = acc["abs"] / n_test
+    rmse = float(np.sqrt(acc["sq"] / n_test))
+    mean_y = acc["y"] / n_test
+    sst = acc["y2"] - n_test * mean_y ** 2
+    r2 = 1.0 - acc["sq"] / sst if sst > 0 else 0.0
+
+    def _std(s, s2):
+        return float(np.sqrt(max(0.0, (s2 - s * s / n_test) / (n_test - 1)))) if n_test > 1 else 0.0
+
+    stds = {k: _std(*res[k]) if models[k] is not None else 0.0 for k in models}
+
+    bundle = {
+        "models": models,
+        "scaler": scaler,
+        "feature_names": feature_names,
+        "lags": lags,
+        "horizon": horizon,
+        "weights": weights,
+        "trained_at": datetime.utcnow().isoformat()
+    }
+    bundle["feature_importance"] = feature_importance(bundle, np.vstack(probe)) if probe else {}
+
+    metrics = {
+        "status": "trained",
+        "mode": "chunked",
+        "city": city,
+        "rows": int(n),
+        "test_rows": int(n_test),
+        "MAE": round(mae, 4),
+        "RMSE": round(rmse, 4),
+        "R2_score": round(r2, 4),
+        "accuracy_percent": round(accuracy_from_mae(mae, mean_y), 2),
+        "residual_std": {k: round(v, 4) for k, v in stds.items()},
+        "rf_tree_var": round(acc["tree_var"] / n_test, 6),
+        "rf_sample_rows": int(sample_size),
+        "weights": weights,
+        "peak_rss_mb": peak_rss_mb(),
+        "feature_importance": bundle["feature_importance"],
+        "trained_at": bundle["trained_at"]
+    }
+
+    save_bundle(city, bundle, metrics)
+    return metrics
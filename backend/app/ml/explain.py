@@ -0,0 +1,236 @@
+# app/ml/explain.py
+"""
+Per-feature contributions for the ensemble, one batched call per model over a whole matrix.
+- XGBoost: native TreeSHAP (`pred_contribs=True`)
+- RandomForest: the sklearn trees are loaded into an XGBoost booster (BFS node order, leaf values / n_trees,
+  node sample counts as cover), so the same native TreeSHAP runs on them; without xgboost installed
+  a vectorized Saabas path attribution is used instead
+- LinearRegression: exact linear SHAP, coef * x_scaled (the scaled training mean is 0)
+
+The ensemble contribution is the weighted sum of the model contributions, so per row
+base + sum(contributions) equals the ensemble prediction.
+
+Exact TreeSHAP on a deep forest costs O(trees x leaves x depth^2) per row (seconds for a week's
+horizon on one core). EXPLAIN_METHOD=approx switches both tree models to Saabas attribution
+(xgboost approx_contribs), which is a single tree walk per row.
+"""
+
+import os
+import json
+import threading
+
+import numpy as np
+from cachetools import LRUCache
+
+from app.ml.inference import FlatForest, PREDICTOR_CACHE_SIZE
+
+EXPLAIN_METHOD = os.environ.get("EXPLAIN_METHOD", "tree_shap")  # tree_shap | approx
+IMPORTANCE_MAX_ROWS = 100  # test rows used for the global importances at training time
+
+# converted forests, keyed by bundle identity and bounded like the inference predictors
+_EXPLAINERS = LRUCache(maxsize=PREDICTOR_CACHE_SIZE)
+_EXPLAINERS_LOCK = threading.Lock()
+ROOT_PARENT = 2147483647
+
+
+# -----------------------
+# RandomForest -> XGBoost booster
+# -----------------------
+def _bfs_order(children_left, children_right) -> np.ndarray:
+    order = [0]
+    k = 0
+    while k < len(order):
+        node = order[k]
+        k += 1
+        if children_left[node] != -1:
+            order.extend((children_left[node], children_right[node]))
+    return np.asarray(order)
+
+
+def _tree_json(est, tree_id: int, n_trees: int, n_features: int) -> dict:
+    t = est.tree_
+    order = _bfs_order(t.children_left, t.children_right)  # xgboost expects breadth-first node ids
+    new_id = np.empty(t.node_count, dtype=np.int64)
+    new_id[order] = np.arange(t.node_count)
+
+    cl, cr = t.children_left[order], t.children_right[order]
+    leaf = cl == -1
+    left = np.where(leaf, -1, new_id[np.maximum(cl, 0)])
+    right = np.where(leaf, -1, new_id[np.maximum(cr, 0)])
+    parents = np.full(t.node_count, ROOT_PARENT, dtype=np.int64)
+    internal = np.flatnonzero(~leaf)
+    parents[left[internal]] = internal
+    parents[right[internal]] = internal
+
+    value = t.value.reshape(t.node_count, -1)[order, 0] / n_trees
+    # sklearn goes left on x <= t for float32 x; xgboost on x < c, so c = next float32 above t
+    thr = t.threshold[order]
+    t32 = thr.astype(np.float32)
+    cond = np.where(t32.astype(np.float64) <= thr, np.nextafter(t32, np.float32(np.inf)), t32).astype(np.float64)
+    n = t.node_count
+
+    return {
+        "base_weights": value.tolist(),
+        "categories": [], "categories_nodes": [], "categories_segments": [], "categories_sizes": [],
+        "default_left": [0] * n,
+        "id": tree_id,
+        "left_children": left.tolist(),
+        "loss_changes": [0.0] * n,
+        "parents": parents.tolist(),
+        "right_children": right.tolist(),
+        "split_conditions": np.where(leaf, value, cond).tolist(),
+        "split_indices": np.where(leaf, 0, t.feature[order]).tolist(),
+        "split_type": [0] * n,
+        "sum_hessian": t.weighted_n_node_samples[order].astype(np.float64).tolist(),
+        "tree_param": {"num_deleted": "0", "num_feature": str(n_features), "num_nodes": str(n), "size_leaf_vector": "1"},
+    }
+
+
+def forest_to_booster(rf, n_features: int):
+    """An xgboost.Booster whose trees are the forest's trees (averaged instead of summed)."""
+    import xgboost
+
+    n_trees = len(rf.estimators_)
+    trees = [_tree_json(est, i, n_trees, n_features) for i, est in enumerate(rf.estimators_)]
+    model = {
+        "learner": {
+            "attributes": {}, "feature_names": [], "feature_types": [],
+            "gradient_booster": {
+                "model": {
+                    "gbtree_model_param": {"num_parallel_tree": "1", "num_trees": str(n_trees)},
+                    "iteration_indptr": list(range(n_trees + 1)),
+                    "tree_info": [0] * n_trees,
+                    "trees": trees,
+                },
+                "name": "gbtree",
+            },
+            "learner_model_param": {"base_score": "0", "boost_from_average": "0", "num_class": "0",
+                                    "num_feature": str(n_features), "num_target": "1"},
+            "objective": {"name": "reg:squarederror", "reg_loss_param": {"scale_pos_weight": "1"}},
+        },
+        "version": [int(v) for v in xgboost.__version__.split(".")[:3]],
+    }
+    booster = xgboost.Booster()
+    booster.load_model(bytearray(json.dumps(model).encode()))
+    return booster
+
+
+def saabas_contributions(flat: FlatForest, X: np.ndarray):
+    """
+    Path attribution over all trees and rows at once: each split's change in node mean goes to
+    its feature. Returns (rows x features contributions, rows bias), averaged over trees.
+    """
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    n_trees, n_rows = len(flat.roots), len(X)
+    rows = np.broadcast_to(np.arange(n_rows)[None, :], (n_trees, n_rows))
+    node = np.repeat(flat.roots[:, None], n_rows, axis=1)
+    contrib = np.zeros((n_rows, X.shape[1]))
+    for _ in range(flat.depth):
+        feat = flat.feature[node]
+        x = X[rows, feat]
+        nxt = np.where(x <= flat.threshold[node], flat.left[node], flat.right[node])
+        np.add.at(contrib, (rows, feat), flat.value[nxt] - flat.value[node])  # leaves loop to themselves: 0
+        node = nxt
+    bias = flat.value[flat.roots].mean()
+    return contrib / n_trees, np.full(n_rows, bias)
+
+
+# -----------------------
+# Bundle contributions
+# -----------------------
+def _explainers(bundle: dict) -> dict:
+    key = (bundle.get("trained_at"), tuple(bundle.get("feature_names", [])))
+    with _EXPLAINERS_LOCK:
+        cached = _EXPLAINERS.get(key)
+    if cached is not None:
+        return cached
+
+    models = bundle.get("models", {})
+    n_feat = len(bundle.get("feature_names", []))
+    try:
+        cached = {"rf": forest_to_booster(models["rf"], n_feat), "rf_method": "tree_shap"}
+    except ImportError:
+        cached = {"rf": FlatForest.from_sklearn(models["rf"].estimators_), "rf_method": "saabas"}
+    with _EXPLAINERS_LOCK:
+        _EXPLAINERS[key] = cached
+    return cached
+
+
+def contributions(bundle: dict, X_scaled: np.ndarray, method: str = None) -> dict:
+    """
+    Returns {"contributions": rows x features, "base": rows, "methods": {...}} for the ensemble.
+    One batched call per model, no per-row loop.
+    """
+    approx = (method or EXPLAIN_METHOD) == "approx"
+    tree_method = "saabas" if approx else "tree_shap"
+    X = np.asarray(X_scaled, dtype=np.float64)
+    models = bundle.get("models", {})
+    w = bundle.get("weights", {})
+    explainers = _explainers(bundle)
+
+    total = np.zeros_like(X)
+    base = np.zeros(len(X))
+    methods = {}
+
+    if models.get("xgb") is not None and w.get("xgb", 0):
+        import xgboost
+        c = models["xgb"].get_booster().predict(xgboost.DMatrix(X.astype(np.float32)), pred_contribs=True, approx_contribs=approx)
+        total += w["xgb"] * c[:, :-1]
+        base += w["xgb"] * c[:, -1]
+        methods["xgb"] = tree_method
+
+    if w.get("rf", 0):
+        if explainers["rf_method"] == "tree_shap":
+            import xgboost
+            c = explainers["rf"].predict(xgboost.DMatrix(X.astype(np.float32)), pred_contribs=True, approx_contribs=approx)
+            c_rf, b_rf = c[:, :-1], c[:, -1]
+            methods["rf"] = tree_method
+        else:
+            c_rf, b_rf = saabas_contributions(explainers["rf"], X)
+            methods["rf"] = "saabas"
+        total += w["rf"] * c_rf
+        base += w["rf"] * b_rf
+
+    lr = models.get("lr")
+    if lr is not None and w.get("lr", 0):
+        coef = np.asarray(lr.coef_, dtype=np.float64).ravel()
+        total += w["lr"] * X * coef
+        base += w["lr"] * float(np.ravel(lr.intercept_)[0])
+        methods["lr"] = "linear_shap"
+
+    return {"contributions": total, "base": base, "methods": methods}
+
+
+def global_importance(bundle: dict, X_scaled: np.ndarray) -> dict:
+    """Mean |contribution| per feature over (at most IMPORTANCE_MAX_ROWS evenly spaced rows of) X_scaled, largest first."""
+    X_scaled = np.asarray(X_scaled)
+    if len(X_scaled) > IMPORTANCE_MAX_ROWS:
+        X_scaled = X_scaled[np.linspace(0, len(X_scaled) - 1, IMPORTANCE_MAX_ROWS).astype(int)]
+    c = contributions(bundle, X_scaled)["contributions"]
+    mean_abs = np.abs(c).mean(axis=0)
+    names = bundle.get("feature_names", [])
+    order = np.argsort(-mean_abs)
+    return {names[i]: round(float(mean_abs[i]), 4) for i in order}
+
+
+def explain_forecast(bundle: dict, out: dict, datetimes: list, predictions, top: int = 8) -> dict:
+    """
+    Formats `contributions()` output for a forecast horizon: per hour the top features by |value|
+    plus the rest as "other", and the horizon's mean |contribution| per feature.
+    """
+    c, base = out["contributions"], out["base"]
+    names = bundle.get("feature_names", [])
+    top = max(1, min(top, len(names)))
+
+    # one argpartition for the whole horizon
+    top_idx = np.argpartition(-np.abs(c), top - 1, axis=1)[:, :top]
+    hours = []
+    for i, dt in enumerate(datetimes):
+        idx = top_idx[i][np.argsort(-np.abs(c[i, top_idx[i]]))]
+        contrib = {names[j]: round(float(c[i, j]), 4) for j in idx}
+        contrib["other"] = round(float(c[i].sum() - c[i, idx].sum()), 4)
+        hours.append({"datetime": dt, "pm25": round(float(predictions[i]), 3), "base": round(float(base[i]), 4), "contributions": contrib})
+
+    mean_abs = np.abs(c).mean(axis=0)
+    summary = {names[j]: round(float(mean_abs[j]), 4) for j in np.argsort(-mean_abs)[:top]}
+    return {"methods": out["methods"], "horizon_importance": summary, "hours": hours}
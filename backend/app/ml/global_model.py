@@ -0,0 +1,241 @@
+# app/ml/global_model.py
+"""
+Global cross-city model.
+- One ensemble trained on every city's rows, with the city's coordinates (lat, lon) as features
+  next to the usual lag / weather / time features from make_features
+- Saved through save_bundle under GLOBAL_KEY (weights/<GLOBAL_KEY>/versions/..., with the same
+  current / candidate pointers and rollback) instead of one bundle per city
+- predict_future_batch advances all cities together: one (cities x features) matrix per step
+
+Enable with MODEL_MODE=global.
+"""
+
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from app.ml.model import DEFAULT_LAGS, ENSEMBLE_WEIGHTS, get_xgb_regressor, accuracy_from_mae, save_bundle, feature_importance, _scale
+from app.ml.inference import get_predictor
+from app.utils.locations import CITY_COORDS
+
+MODEL_MODE = os.environ.get("MODEL_MODE", "per_city")
+GLOBAL_KEY = "global"
+LOCATION_FEATURES = ["lat", "lon"]
+TIME_FEATURES = ["hour", "day", "month", "weekday"]
+
+
+def add_location_features(df: pd.DataFrame, city: str) -> pd.DataFrame:
+    """Adds the city's coordinates as constant lat/lon columns."""
+    lat, lon = CITY_COORDS[city]
+    df = df.copy()
+    df["lat"] = lat
+    df["lon"] = lon
+    return df
+
+
+# -----------------------
+# Training
+# -----------------------
+def train_global_model(frames: dict, lags: list = None, horizon: int = 1, variant: str = None, n_jobs: int = -1) -> dict:
+    """
+    frames: {city: (df_pm25, df_weather)}.
+    Each city is split chronologically 80/20 on its own, then all cities are fitted together.
+    """
+    if lags is None:
+        lags = DEFAULT_LAGS
+
+    from app.utils.preprocess import merge_pm25_weather, make_features, WEIGHT_COLUMN
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.linear_model import LinearRegression
+    from sklearn.ensemble import RandomForestRegressor
+    XGBRegressor = get_xgb_regressor()
+
+    train_parts, test_parts = [], []
+    cities = []
+    for city, (df_pm25, df_weather) in frames.items():
+        if df_pm25 is None or df_weather is None or df_pm25.empty or df_weather.empty:
+            continue
+        merged = merge_pm25_weather(df_pm25, df_weather)
+        if merged is None or merged.empty:
+            continue
+        df_feat = make_features(merged, lags=lags, horizon=horizon)
+        if len(df_feat) < 30:
+            continue
+        df_feat = add_location_features(df_feat, city)
+        split_idx = int(len(df_feat) * 0.8)
+        train_parts.append(df_feat.iloc[:split_idx])
+        test_parts.append(df_feat.iloc[split_idx:])
+        cities.append(city)
+
+    if not train_parts:
+        raise ValueError("No city has enough rows to train the global model.")
+
+    train_df = pd.concat(train_parts, ignore_index=True)
+    test_df = pd.concat(test_parts, ignore_index=True)
+    del train_parts, test_parts
+
+    X_train = train_df.drop(columns=["datetime", "y", WEIGHT_COLUMN], errors="ignore")
+    feature_names = list(X_train.columns)
+    X_test = test_df[feature_names]
+    y_train, y_test = train_df["y"].values, test_df["y"].values
+    w_train = train_df[WEIGHT_COLUMN].values if WEIGHT_COLUMN in train_df.columns else None
+
+    scaler = StandardScaler()
+    X_train_scaled = scaler.fit_transform(X_train)
+    X_test_scaled = scaler.transform(X_test)
+
+    weights = dict(ENSEMBLE_WEIGHTS)
+    models = {"xgb": None}
+    if XGBRegressor is not None:
+        xgb = XGBRegressor(n_estimators=250, learning_rate=0.05, max_depth=6, subsample=0.9, colsample_bytree=0.9, objective="reg:squarederror", random_state=42, verbosity=0, n_jobs=n_jobs)
+        xgb.fit(X_train_scaled, y_train, sample_weight=w_train)
+        models["xgb"] = xgb
+    else:
+        weights = {"xgb": 0, "rf": 0.6, "lr": 0.4}
+
+    rf = RandomForestRegressor(n_estimators=200, n_jobs=n_jobs, random_state=42)
+    rf.fit(X_train_scaled, y_train, sample_weight=w_train)
+    models["rf"] = rf
+
+    lr = LinearRegression()
+    lr.fit(X_train_scaled, y_train, sample_weight=w_train)
+    models["lr"] = lr
+
+    preds = {k: (m.predict(X_test_scaled) if m is not None else np.zeros_like(y_test)) for k, m in models.items()}
+    p = sum(weights.get(k, 0) * preds[k] for k in models)
+
+    abs_err = np.abs(y_test - p)
+    mae = float(abs_err.mean())
+    rmse = float(np.sqrt(((y_test - p) ** 2).mean()))
+    ss_res = float(((y_test - p) ** 2).sum())
+    ss_tot = float(((y_test - y_test.mean()) ** 2).sum())
+    r2 = 1.0 - ss_res / ss_tot if ss_tot > 0 else 0.0
+
+    stds = {k: (float(np.std(y_test - preds[k], ddof=1)) if models[k] is not None and len(y_test) > 1 else 0.0) for k in models}
+
+    # per-city test error, so the global model can be compared with per-city bundles
+    per_city = {}
+    test_lat = X_test["lat"].values
+    for city in cities:
+        mask = test_lat == CITY_COORDS[city][0]
+        if mask.any():
+            per_city[city] = {"MAE": round(float(abs_err[mask].mean()), 4), "test_rows": int(mask.sum())}
+
+    bundle = {
+        "models": models,
+        "scaler": scaler,
+        "feature_names": feature_names,
+        "lags": lags,
+        "horizon": horizon,
+        "weights": weights,
+        "cities": cities,
+        "trained_at": datetime.utcnow().isoformat()
+    }
+    bundle["feature_importance"] = feature_importance(bundle, X_test_scaled)
+
+    metrics = {
+        "status": "trained",
+        "city": GLOBAL_KEY,
+        "cities": cities,
+        "rows": int(len(train_df) + len(test_df)),
+        "test_rows": int(len(test_df)),
+        "MAE": round(mae, 4),
+        "RMSE": round(rmse, 4),
+        "R2_score": round(r2, 4),
+        "accuracy_percent": round(accuracy_from_mae(mae, float(y_test.mean())), 2),
+        "residual_std": {k: round(v, 4) for k, v in stds.items()},
+        "per_city": per_city,
+        "weights": weights,
+        "feature_importance": bundle["feature_importance"],
+        "trained_at": bundle["trained_at"]
+    }
+
+    if variant:
+        metrics["variant"] = variant
+    save_bundle(GLOBAL_KEY, bundle, metrics, variant=variant)
+    return metrics
+
+
+# -----------------------
+# Batched prediction
+# -----------------------
+def predict_future_batch(bundle: dict, scaler: "StandardScaler", inputs: dict) -> dict:
+    """
+    inputs: {city: (future_weather, last_history)}.
+    Runs every city's iterative forecast in lockstep, one model call per step for all cities.
+    Returns {city: {"datetimes", "predictions", "result_df"}} like predict_future.
+    """
+    if bundle is None:
+        raise ValueError("Model bundle missing")
+
+    feature_names = bundle.get("feature_names", [])
+    lags = bundle.get("lags", DEFAULT_LAGS)
+    predictor = get_predictor(bundle)
+    max_lag = max(lags)
+
+    cities = list(inputs)
+    futures, steps = [], []
+    for city in cities:
+        future_weather, last_history = inputs[city]
+        if last_history is None or last_history.empty:
+            raise ValueError(f"last_history required for iterative predictions ({city}).")
+        future = future_weather.copy()
+        future["datetime"] = pd.to_datetime(future["datetime"])
+        future = future.sort_values("datetime").reset_index(drop=True)
+        if "lat" in feature_names:
+            future = add_location_features(future, city)
+        futures.append(future)
+        steps.append(len(future))
+
+    C, T, F = len(cities), max(steps), len(feature_names)
+
+    # history buffer: max_lag seed values followed by the T predictions
+    H = np.zeros((C, max_lag + T))
+    for c, city in enumerate(cities):
+        hist = inputs[city][1].copy()
+        hist["datetime"] = pd.to_datetime(hist["datetime"])
+        recent = hist.sort_values("datetime")["pm25"].tail(max_lag).to_numpy(dtype=float)
+        if len(recent) < max_lag:
+            pad_val = float(np.nanmean(hist["pm25"])) if hist["pm25"].notna().any() else 0.0
+            recent = np.concatenate([np.full(max_lag - len(recent), pad_val), recent])
+        H[c, :max_lag] = recent
+
+    # exogenous features (weather, time, location) for every (city, step), padded with the last row
+    lag_idx = [(feature_names.index(f"pm25_lag_{lag}"), lag) for lag in lags if f"pm25_lag_{lag}" in feature_names]
+    lag_cols = {i for i, _ in lag_idx}
+    E = np.zeros((C, T, F))
+    for c, future in enumerate(futures):
+        dt = future["datetime"]
+        time_vals = {"hour": dt.dt.hour, "day": dt.dt.day, "month": dt.dt.month, "weekday": dt.dt.weekday}
+        for j, col in enumerate(feature_names):
+            if j in lag_cols:
+                continue
+            if col in time_vals:
+                vals = time_vals[col].to_numpy(dtype=float)
+            elif col in future.columns:
+                vals = pd.to_numeric(future[col], errors="coerce").fillna(0.0).to_numpy(dtype=float)
+            else:
+                vals = np.zeros(len(future))
+            E[c, :len(vals), j] = vals
+            if len(vals) < T and len(vals) > 0:
+                E[c, len(vals):, j] = vals[-1]
+
+    for t in range(T):
+        X = E[:, t, :].copy()
+        for j, lag in lag_idx:
+            X[:, j] = H[:, max_lag + t - lag]
+        H[:, max_lag + t] = predictor.predict(_scale(scaler, X))
+
+    out = {}
+    for c, city in enumerate(cities):
+        preds = H[c, max_lag:max_lag + steps[c]]
+        result_df = futures[c].copy()
+        result_df["pm25_pred"] = preds
+        out[city] = {
+            "datetimes": [str(d) for d in result_df["datetime"]],
+            "predictions": preds.copy(),
+            "result_df": result_df,
+        }
+    return out
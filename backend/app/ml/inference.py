@@ -0,0 +1,317 @@
+# app/ml/inference.py
+"""
+Pluggable inference backends for the ensemble bundle.
+
+- "sklearn": the fitted RandomForest / XGBoost / LinearRegression objects (default)
+- "numpy":   every tree compiled into flat node arrays and evaluated for all trees and rows at once
+- "onnx":    the three models converted to ONNX and run with onnxruntime on CPU
+             (needs skl2onnx, onnxmltools and onnxruntime)
+
+Select per deployment with INFERENCE_BACKEND. A compiled backend is checked against the
+original models on probe rows when it is built; if parity fails the report is logged and the
+bundle falls back to sklearn.
+
+    python -m app.ml.inference export --city Delhi --backend numpy
+"""
+
+import os
+import json
+import argparse
+import threading
+
+import numpy as np
+from cachetools import LRUCache
+
+from app.utils.locations import CITY_COORDS
+from app.utils.logging_utils import get_logger
+
+log = get_logger(__name__)
+
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "sklearn")
+PARITY_TOLERANCE = float(os.environ.get("INFERENCE_PARITY_TOL", 1e-3))
+PARITY_PROBE_ROWS = 512
+# primary + candidate per city and the global bundle; retrained / rolled-back bundles age out
+PREDICTOR_CACHE_SIZE = int(os.environ.get("PREDICTOR_CACHE_SIZE", 2 * len(CITY_COORDS) + 2))
+
+# compiled predictors, keyed by bundle identity (trained_at + backend)
+_PREDICTORS = LRUCache(maxsize=PREDICTOR_CACHE_SIZE)
+_PREDICTORS_LOCK = threading.Lock()
+
+
+# -----------------------
+# sklearn (reference)
+# -----------------------
+class SklearnPredictor:
+    name = "sklearn"
+
+    def __init__(self, bundle: dict):
+        self.models = bundle.get("models", {})
+        self.weights = bundle.get("weights", {})
+
+    def predict(self, X_scaled: np.ndarray) -> np.ndarray:
+        models, w = self.models, self.weights
+        p_xgb = models.get("xgb").predict(X_scaled) if models.get("xgb") is not None else np.zeros(len(X_scaled))
+        p_rf = models.get("rf").predict(X_scaled)
+        p_lr = models.get("lr").predict(X_scaled)
+        return w.get("xgb", 0) * p_xgb + w.get("rf", 0) * p_rf + w.get("lr", 0) * p_lr
+
+
+# -----------------------
+# Flat NumPy tree evaluator
+# -----------------------
+class FlatForest:
+    """
+    All trees of one model in struct-of-arrays form. Leaves point to themselves with an
+    always-true split, so evaluation is `depth` vectorized steps over a (trees x rows) node grid.
+    """
+
+    def __init__(self, feature, threshold, left, right, missing, value, roots, depth, strict: bool):
+        self.feature = np.asarray(feature, dtype=np.int32)
+        # float64 thresholds against float32-cast inputs, exactly like sklearn and xgboost
+        self.threshold = np.asarray(threshold, dtype=np.float64)
+        self.left = np.asarray(left, dtype=np.int32)
+        self.right = np.asarray(right, dtype=np.int32)
+        self.missing = np.asarray(missing, dtype=np.int32)
+        self.value = np.asarray(value, dtype=np.float64)
+        self.roots = np.asarray(roots, dtype=np.int32)
+        self.depth = int(depth)
+        self.strict = strict  # xgboost goes left on x < t, sklearn on x <= t
+
+    @classmethod
+    def from_sklearn(cls, estimators):
+        feature, threshold, left, right, value, roots = [], [], [], [], [], []
+        offset, depth = 0, 0
+        for est in estimators:
+            t = est.tree_
+            n = t.node_count
+            is_leaf = t.children_left == -1
+            idx = np.arange(n) + offset
+            feature.append(np.where(is_leaf, 0, t.feature))
+            threshold.append(np.where(is_leaf, np.inf, t.threshold))
+            left.append(np.where(is_leaf, idx, t.children_left + offset))
+            right.append(np.where(is_leaf, idx, t.children_right + offset))
+            value.append(t.value.reshape(n, -1)[:, 0])
+            roots.append(offset)
+            depth = max(depth, t.max_depth)
+            offset += n
+        left, right = np.concatenate(left), np.concatenate(right)
+        return cls(np.concatenate(feature), np.concatenate(threshold), left, right, right,
+                   np.concatenate(value), roots, depth, strict=False)
+
+    @classmethod
+    def from_xgboost(cls, booster):
+        # the JSON model keeps split conditions as exact float32 values (text dumps round them)
+        model = json.loads(booster.save_raw(raw_format="json"))
+        trees = model["learner"]["gradient_booster"]["model"]["trees"]
+
+        feature, threshold, left, right, missing, value, roots = [], [], [], [], [], [], []
+        offset, depth = 0, 0
+        for tree in trees:
+            lc = np.asarray(tree["left_children"])
+            rc = np.asarray(tree["right_children"])
+            cond = np.asarray(tree["split_conditions"], dtype=np.float32).astype(np.float64)
+            is_leaf = lc == -1
+            idx = np.arange(len(lc)) + offset
+            default_left = np.asarray(tree["default_left"]).astype(bool)
+
+            feature.append(np.where(is_leaf, 0, tree["split_indices"]))
+            threshold.append(np.where(is_leaf, np.inf, cond))
+            left.append(np.where(is_leaf, idx, lc + offset))
+            right.append(np.where(is_leaf, idx, rc + offset))
+            missing.append(np.where(is_leaf, idx, np.where(default_left, lc, rc) + offset))
+            value.append(np.where(is_leaf, cond, 0.0))  # leaves store their weight in split_conditions
+            roots.append(offset)
+
+            # tree depth from parent links (children always follow their parent)
+            d = np.zeros(len(lc), dtype=int)
+            for n in np.flatnonzero(~is_leaf):
+                d[lc[n]] = d[rc[n]] = d[n] + 1
+            depth = max(depth, int(d.max()))
+            offset += len(lc)
+
+        return cls(np.concatenate(feature), np.concatenate(threshold), np.concatenate(left), np.concatenate(right),
+                   np.concatenate(missing), np.concatenate(value), roots, depth, strict=True)
+
+    def leaf_values(self, X: np.ndarray) -> np.ndarray:
+        """Returns (trees, rows) leaf values for float32 inputs."""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        rows = np.arange(len(X))[None, :]
+        node = np.repeat(self.roots[:, None], len(X), axis=1)
+        for _ in range(self.depth):
+            x = X[rows, self.feature[node]]
+            go_left = (x < self.threshold[node]) if self.strict else (x <= self.threshold[node])
+            nxt = np.where(go_left, self.left[node], self.right[node])
+            if self.strict:
+                nxt = np.where(np.isnan(x), self.missing[node], nxt)
+            node = nxt
+        return self.value[node]
+
+
+def _xgb_base_score(booster) -> float:
+    raw = json.loads(booster.save_config())["learner"]["learner_model_param"]["base_score"]
+    return float(str(raw).strip("[]").split(",")[0])
+
+
+class NumpyPredictor:
+    name = "numpy"
+
+    def __init__(self, bundle: dict):
+        models = bundle.get("models", {})
+        self.weights = bundle.get("weights", {})
+        self.rf = FlatForest.from_sklearn(models["rf"].estimators_)
+        self.xgb = None
+        if models.get("xgb") is not None:
+            booster = models["xgb"].get_booster()
+            self.xgb = FlatForest.from_xgboost(booster)
+            self.xgb_base = _xgb_base_score(booster)
+        lr = models["lr"]
+        self.lr_coef = np.asarray(lr.coef_, dtype=np.float64).ravel()
+        self.lr_intercept = float(np.ravel(lr.intercept_)[0]) if np.ndim(lr.intercept_) else float(lr.intercept_)
+
+    def predict(self, X_scaled: np.ndarray) -> np.ndarray:
+        X = np.asarray(X_scaled, dtype=np.float64)
+        w = self.weights
+        p = w.get("rf", 0) * self.rf.leaf_values(X).mean(axis=0)
+        p = p + w.get("lr", 0) * (X @ self.lr_coef + self.lr_intercept)
+        if self.xgb is not None and w.get("xgb", 0):
+            p = p + w["xgb"] * (self.xgb_base + self.xgb.leaf_values(X).sum(axis=0))
+        return p
+
+
+# -----------------------
+# ONNX Runtime
+# -----------------------
+class OnnxPredictor:
+    name = "onnx"
+
+    def __init__(self, bundle: dict):
+        import onnxruntime as ort
+        from skl2onnx import convert_sklearn
+        from skl2onnx.common.data_types import FloatTensorType
+
+        models = bundle.get("models", {})
+        self.weights = bundle.get("weights", {})
+        n_feat = len(bundle.get("feature_names", []))
+        initial_types = [("input", FloatTensorType([None, n_feat]))]
+
+        onnx_models = {
+            "rf": convert_sklearn(models["rf"], initial_types=initial_types),
+            "lr": convert_sklearn(models["lr"], initial_types=initial_types),
+        }
+        if models.get("xgb") is not None:
+            from onnxmltools import convert_xgboost
+            onnx_models["xgb"] = convert_xgboost(models["xgb"], initial_types=initial_types)
+
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = 1
+        self.sessions = {
+            k: ort.InferenceSession(m.SerializeToString(), opts, providers=["CPUExecutionProvider"])
+            for k, m in onnx_models.items()
+        }
+
+    def predict(self, X_scaled: np.ndarray) -> np.ndarray:
+        X = np.asarray(X_scaled, dtype=np.float32)
+        p = np.zeros(len(X))
+        for k, sess in self.sessions.items():
+            if self.weights.get(k, 0):
+                p += self.weights[k] * sess.run(None, {"input": X})[0].ravel()
+        return p
+
+
+BACKENDS = {"sklearn": SklearnPredictor, "numpy": NumpyPredictor, "onnx": OnnxPredictor}
+
+
+# -----------------------
+# Export + parity
+# -----------------------
+def probe_rows(bundle: dict, n: int = PARITY_PROBE_ROWS, seed: int = 0) -> np.ndarray:
+    """
+    Scaled probe rows: half roughly covering the training distribution (scaler output is ~N(0, 1)),
+    half placed exactly on split thresholds, where float rounding differences would show up.
+    """
+    rng = np.random.default_rng(seed)
+    n_feat = len(bundle.get("feature_names", []))
+    X = rng.normal(0.0, 1.5, size=(n, n_feat))
+
+    models = bundle.get("models", {})
+    forests = [FlatForest.from_sklearn(models["rf"].estimators_)] if models.get("rf") is not None else []
+    if models.get("xgb") is not None:
+        forests.append(FlatForest.from_xgboost(models["xgb"].get_booster()))
+    for forest in forests:
+        split = np.isfinite(forest.threshold)
+        for j in range(n_feat):
+            cuts = forest.threshold[split & (forest.feature == j)]
+            if len(cuts):
+                X[n // 2:, j] = np.where(rng.random(n - n // 2) < 0.5, rng.choice(cuts, n - n // 2), X[n // 2:, j])
+    return X
+
+
+def export(bundle: dict, backend: str = INFERENCE_BACKEND):
+    """Builds a predictor for `backend` and checks it against the sklearn models. Returns (predictor, report)."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend}")
+
+    reference = SklearnPredictor(bundle)
+    if backend == "sklearn":
+        return reference, {"backend": "sklearn", "parity": True, "max_abs_diff": 0.0}
+
+    predictor = BACKENDS[backend](bundle)
+    X = probe_rows(bundle)
+    ref = reference.predict(X)
+    got = predictor.predict(X)
+    diff = np.abs(ref - got)
+    tol = PARITY_TOLERANCE * np.maximum(1.0, np.abs(ref))
+    report = {
+        "backend": backend,
+        "parity": bool((diff <= tol).all()),
+        "max_abs_diff": float(diff.max()),
+        "mismatched_rows": int((diff > tol).sum()),
+        "probe_rows": len(X),
+    }
+    return predictor, report
+
+
+def get_predictor(bundle: dict, backend: str = None):
+    """Cached predictor for a bundle; falls back to sklearn if the backend fails to build or loses parity."""
+    backend = backend or INFERENCE_BACKEND
+    key = (bundle.get("trained_at"), tuple(bundle.get("feature_names", [])), backend)
+    with _PREDICTORS_LOCK:
+        predictor = _PREDICTORS.get(key)
+    if predictor is not None:
+        return predictor
+
+    try:
+        predictor, report = export(bundle, backend)
+        if not report["parity"]:
+            log.error("Inference parity failed, using sklearn", extra={"backend": backend, "report": report})
+            predictor = SklearnPredictor(bundle)
+    except Exception as e:
+        log.error("Inference backend unavailable, using sklearn", extra={"backend": backend, "error": str(e)})
+        predictor = SklearnPredictor(bundle)
+
+    with _PREDICTORS_LOCK:
+        _PREDICTORS[key] = predictor
+    return predictor
+
+
+def main(argv=None):
+    from app.ml.model import load_model
+
+    parser = argparse.ArgumentParser(description="Export a city bundle to a compiled inference backend and check parity.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_export = sub.add_parser("export")
+    p_export.add_argument("--city", default="Delhi")
+    p_export.add_argument("--backend", default="numpy", choices=sorted(BACKENDS))
+    args = parser.parse_args(argv)
+
+    bundle, _, _ = load_model(args.city)
+    if bundle is None:
+        print(f"No bundle for {args.city}")
+        return 1
+    _, report = export(bundle, args.backend)
+    print(json.dumps(report, indent=2))
+    return 0 if report["parity"] else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -2,31 +2,53 @@
 """
 Updated model training / load / predict
 - Saves and loads models/scalers/metrics based on city name.
+- Versioned store: every save_bundle writes an immutable weights/<city>/versions/<version>/ directory
+  (bundle.joblib + metrics.json) and then swaps the weights/<city>/current (or /candidate) pointer
+  file atomically. The last MODEL_KEEP_VERSIONS versions are kept for rollback.
+- Cities without a pointer still load the flat ensemble_bundle_<city>.joblib files.
 """
 
 import os
 import json
+import time
+import shutil
 import joblib
 from pathlib import Path
 from datetime import datetime
 import numpy as np
 import pandas as pd
 
-from sklearn.preprocessing import StandardScaler
-from sklearn.linear_model import LinearRegression
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+from app.utils.logging_utils import get_logger
 
-try:
-    from xgboost import XGBRegressor
-except Exception:
-    XGBRegressor = None
+log = get_logger(__name__)
+
+# sklearn and xgboost are imported on first use (training or unpickling a bundle),
+# so importing this module stays cheap at server startup.
+_XGB_UNSET = object()
+_xgb_regressor = _XGB_UNSET
+
+
+def get_xgb_regressor():
+    """Returns the XGBRegressor class, or None if xgboost is not installed."""
+    global _xgb_regressor
+    if _xgb_regressor is _XGB_UNSET:
+        try:
+            from xgboost import XGBRegressor
+            _xgb_regressor = XGBRegressor
+        except Exception:
+            _xgb_regressor = None
+    return _xgb_regressor
 
 # paths
 BASE_DIR = Path(__file__).resolve().parent
 WEIGHTS_DIR = BASE_DIR / "weights"
 WEIGHTS_DIR.mkdir(parents=True, exist_ok=True)
 
+MODEL_KEEP_VERSIONS = int(os.environ.get("MODEL_KEEP_VERSIONS", 5))
+# how long a worker trusts its cached pointer before stat()ing the file again
+POINTER_CHECK_SECONDS = float(os.environ.get("MODEL_POINTER_CHECK_SECONDS", 1.0))
+CURRENT = "current"
+
 # default ensemble weights (can be tuned)
 ENSEMBLE_WEIGHTS = {"xgb": 0.5, "rf": 0.3, "lr": 0.2}
 DEFAULT_LAGS = [1,2,3,6,12,24]
@@ -35,48 +57,209 @@ DEFAULT_LAGS = [1,2,3,6,12,24]
 # -----------------------
 # NEW: Helper for city-specific paths
 # -----------------------
-def get_model_paths(city: str):
-    """Returns city-specific paths for model, scaler, and metrics."""
-    city_slug = city.lower().replace(" ", "_")
+def _city_slug(city: str) -> str:
+    return city.lower().replace(" ", "_")
+
+
+def get_model_paths(city: str, variant: str = None):
+    """
+    Returns city-specific paths for model, scaler, and metrics.
+    `city` is a location-registry cluster name, so all stations in a cluster share one bundle.
+    `variant` (e.g. "candidate") selects a side-by-side bundle next to the production one.
+    Resolves to the version the pointer names, or to the flat (pre-versioning) files.
+    """
+    version = current_version(city, variant)
+    if version is not None:
+        return version_paths(city, version)
+
+    city_slug = _city_slug(city)
+    if variant:
+        city_slug = f"{city_slug}_{variant}"
     MODEL_PATH = WEIGHTS_DIR / f"ensemble_bundle_{city_slug}.joblib"
     METRICS_PATH = WEIGHTS_DIR / f"metrics_{city_slug}.json"
     # Note: Scaler is now inside the bundle, so no separate path needed
     return MODEL_PATH, METRICS_PATH
 
 
+# -----------------------
+# Versioned store
+# -----------------------
+_POINTERS = {}  # pointer path -> (checked_at, (inode, mtime_ns), version)
+
+
+def model_dir(city: str) -> Path:
+    return WEIGHTS_DIR / _city_slug(city)
+
+
+def version_paths(city: str, version: str):
+    vdir = model_dir(city) / "versions" / version
+    return vdir / "bundle.joblib", vdir / "metrics.json"
+
+
+def _pointer_path(city: str, variant: str = None) -> Path:
+    return model_dir(city) / (variant or CURRENT)
+
+
+def current_version(city: str, variant: str = None):
+    """
+    Version the city's pointer names, or None. The pointer is re-stat()ed at most every
+    POINTER_CHECK_SECONDS and only re-read when it was replaced, so a swap made by any
+    process reaches every worker within that interval without touching the bundle files.
+    """
+    path = _pointer_path(city, variant)
+    now = time.monotonic()
+    cached = _POINTERS.get(path)
+    if cached is not None and now - cached[0] < POINTER_CHECK_SECONDS:
+        return cached[2]
+
+    try:
+        st = path.stat()
+    except OSError:
+        _POINTERS[path] = (now, None, None)
+        return None
+    stamp = (st.st_ino, st.st_mtime_ns)
+    if cached is not None and cached[1] == stamp:
+        version = cached[2]
+    else:
+        try:
+            version = path.read_text(encoding="utf-8").strip() or None
+        except OSError:
+            version = None
+    _POINTERS[path] = (now, stamp, version)
+    return version
+
+
+def _set_pointer(city: str, version: str, variant: str = None):
+    path = _pointer_path(city, variant)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    _write_atomic(path, lambda tmp: tmp.write_text(version, encoding="utf-8"))
+    _POINTERS.pop(path, None)
+    _log_history(city, {"action": "pointer", "pointer": variant or CURRENT, "version": version})
+
+
+def _clear_pointer(city: str, variant: str):
+    path = _pointer_path(city, variant)
+    path.unlink(missing_ok=True)
+    _POINTERS.pop(path, None)
+
+
+def _log_history(city: str, entry: dict):
+    entry = {"at": datetime.utcnow().isoformat(), **entry}
+    with open(model_dir(city) / "history.jsonl", "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry) + "\n")
+
+
+def _served_versions(city: str) -> set:
+    """Versions that have been the production pointer at some point."""
+    served = set()
+    path = model_dir(city) / "history.jsonl"
+    if path.exists():
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("pointer") == CURRENT:
+                    served.add(entry.get("version"))
+    return served
+
+
+def _version_ids(city: str) -> list:
+    vroot = model_dir(city) / "versions"
+    if not vroot.exists():
+        return []
+    return sorted(p.name for p in vroot.iterdir() if p.is_dir() and not p.name.startswith("."))
+
+
+def list_versions(city: str) -> list:
+    """Stored versions, newest first, with their headline metrics and which pointers name them."""
+    current, candidate = current_version(city), current_version(city, "candidate")
+    served = _served_versions(city)
+    out = []
+    for version in reversed(_version_ids(city)):
+        metrics = _read_json(version_paths(city, version)[1]) or {}
+        out.append({
+            "version": version,
+            "trained_at": metrics.get("trained_at"),
+            "trained_as": metrics.get("variant", "primary"),
+            "MAE": metrics.get("MAE"),
+            "accuracy_percent": metrics.get("accuracy_percent"),
+            "current": version == current,
+            "candidate": version == candidate,
+            "served": version in served,
+        })
+    return out
+
+
+def prune_versions(city: str, keep: int = None):
+    """Deletes all but the newest `keep` versions; versions a pointer names are always kept."""
+    keep = MODEL_KEEP_VERSIONS if keep is None else keep
+    pinned = {current_version(city), current_version(city, "candidate")}
+    versions = _version_ids(city)
+    for version in versions[:max(0, len(versions) - keep)]:
+        if version not in pinned:
+            shutil.rmtree(model_dir(city) / "versions" / version, ignore_errors=True)
+
+
+def rollback(city: str, version: str = None) -> dict:
+    """
+    Points production at `version`, by default the newest previously served version older than
+    the current one. Only the pointer changes, so this is instant.
+    """
+    current = current_version(city)
+    versions = _version_ids(city)
+    if version is None:
+        served = _served_versions(city)
+        older = [v for v in versions if v in served and (current is None or v < current)]
+        if not older:
+            raise FileNotFoundError(f"No earlier version of {city} to roll back to")
+        version = older[-1]
+    elif version not in versions:
+        raise FileNotFoundError(f"Unknown version {version} for {city}")
+
+    _set_pointer(city, version)
+    return {"version": version, "previous": current}
+
+
 # -----------------------
 # Training
 # -----------------------
-def train_model(city: str, df_pm25: pd.DataFrame, df_weather: pd.DataFrame, lags: list = None, horizon: int = 1) -> dict:
+def train_model(city: str, df_pm25: pd.DataFrame, df_weather: pd.DataFrame, lags: list = None, horizon: int = 1, variant: str = None, n_jobs: int = -1) -> dict:
     """
     Train ensemble using lag features and weather/time features.
     Saves bundle (model+scaler) and metrics to city-specific files.
+    `n_jobs` caps the cores XGBoost / RandomForest use (-1 = all), so several cities can train side by side.
     """
     if lags is None:
         lags = DEFAULT_LAGS
-    
-    MODEL_PATH, METRICS_PATH = get_model_paths(city)
 
-    # lazy import preprocess
-    from app.utils.preprocess import merge_pm25_weather, make_features
+    # lazy imports
+    from app.utils.preprocess import series_inputs, merge_series, feature_arrays
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.linear_model import LinearRegression
+    from sklearn.ensemble import RandomForestRegressor
+    from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+    XGBRegressor = get_xgb_regressor()
 
     # validate
     if df_pm25 is None or df_weather is None:
         raise ValueError("Missing input dataframes")
+    if df_pm25.empty or df_weather.empty:
+        raise ValueError("Merged data is empty")
 
-    merged = merge_pm25_weather(df_pm25, df_weather)
-    if merged is None or merged.empty:
+    # compact path: int64 hours + float32 arrays from here on, no intermediate DataFrames
+    merged = merge_series(*series_inputs(df_pm25, df_weather))
+    if merged is None:
         raise ValueError("Merged data is empty")
 
-    df_feat = make_features(merged, lags=lags, horizon=horizon)
-    if df_feat is None or df_feat.empty:
+    # Prepare X, y (same columns and rows as make_features); imputed targets down-weighted
+    # (IMPUTED_TARGETS=weight), sample_weight None = all rows count fully
+    X, y, _, feature_names, sample_weight = feature_arrays(merged, lags=lags, horizon=horizon)
+    del merged
+    if len(X) == 0:
         raise ValueError("No usable rows after feature creation. Increase history or adjust lags.")
 
-    # Prepare X, y
-    y = df_feat["y"].values
-    X = df_feat.drop(columns=["datetime", "y"], errors="ignore")
-    feature_names = list(X.columns)
-
     # need enough rows
     n = len(X)
     if n < 30:
@@ -84,19 +267,21 @@ def train_model(city: str, df_pm25: pd.DataFrame, df_weather: pd.DataFrame, lags
 
     # chronological split
     split_idx = int(n * 0.8)
-    X_train, X_test = X.iloc[:split_idx], X.iloc[split_idx:]
-    y_train, y_test = y[:split_idx], y[split_idx:]
+    y_train, y_test = y[:split_idx], y[split_idx:].astype(np.float64)
+    w_train = sample_weight[:split_idx] if sample_weight is not None else None
 
-    # scaler fit on train
-    scaler = StandardScaler()
-    X_train_scaled = scaler.fit_transform(X_train)
-    X_test_scaled = scaler.transform(X_test)
+    # scaler fit on train, applied in place: the train / test matrices are views of X
+    scaler = StandardScaler(copy=False)
+    scaler.fit(X[:split_idx])
+    scaler.transform(X)
+    scaler.copy = True  # the bundle's scaler must not overwrite callers' arrays later
+    X_train_scaled, X_test_scaled = X[:split_idx], X[split_idx:]
 
     # instantiate models
     models = {}
     if XGBRegressor is not None:
-        xgb = XGBRegressor(n_estimators=250, learning_rate=0.05, max_depth=6, subsample=0.9, colsample_bytree=0.9, objective="reg:squarederror", random_state=42, verbosity=0)
-        xgb.fit(X_train_scaled, y_train)
+        xgb = XGBRegressor(n_estimators=250, learning_rate=0.05, max_depth=6, subsample=0.9, colsample_bytree=0.9, objective="reg:squarederror", random_state=42, verbosity=0, n_jobs=n_jobs)
+        xgb.fit(X_train_scaled, y_train, sample_weight=w_train)
         models["xgb"] = xgb
     else:
         models["xgb"] = None
@@ -104,12 +289,12 @@ def train_model(city: str, df_pm25: pd.DataFrame, df_weather: pd.DataFrame, lags
         ENSEMBLE_WEIGHTS["rf"] = 0.6 # Re-balance
         ENSEMBLE_WEIGHTS["lr"] = 0.4
 
-    rf = RandomForestRegressor(n_estimators=200, n_jobs=-1, random_state=42)
-    rf.fit(X_train_scaled, y_train)
+    rf = RandomForestRegressor(n_estimators=200, n_jobs=n_jobs, random_state=42)
+    rf.fit(X_train_scaled, y_train, sample_weight=w_train)
     models["rf"] = rf
 
     lr = LinearRegression()
-    lr.fit(X_train_scaled, y_train)
+    lr.fit(X_train_scaled, y_train, sample_weight=w_train)
     models["lr"] = lr
 
     # predictions on test set
@@ -159,22 +344,17 @@ def train_model(city: str, df_pm25: pd.DataFrame, df_weather: pd.DataFrame, lags
         "weights": ENSEMBLE_WEIGHTS,
         "trained_at": datetime.utcnow().isoformat()
     }
-
-    try:
-        joblib.dump(bundle, MODEL_PATH)
-    except Exception as e:
-        raise RuntimeError(f"Failed to save model bundle for {city}: {e}")
+    bundle["feature_importance"] = feature_importance(bundle, X_test_scaled)
 
     # compute accuracy
     mean_y = float(np.mean(y_test)) if len(y_test)>0 else 0.0
-    accuracy_percent = (1.0 - (mae / (mean_y + 1e-9))) * 100.0 if mean_y > 0 else 0.0
-    accuracy_percent = max(0.0, min(100.0, accuracy_percent))
+    accuracy_percent = accuracy_from_mae(mae, mean_y)
 
     metrics = {
         "status": "trained",
         "city": city,
         "rows": int(n),
-        "test_rows": int(len(X_test)),
+        "test_rows": int(len(X_test_scaled)),
         "MAE": round(mae, 4),
         "RMSE": round(rmse, 4),
         "R2_score": round(r2, 4),
@@ -182,143 +362,255 @@ def train_model(city: str, df_pm25: pd.DataFrame, df_weather: pd.DataFrame, lags
         "residual_std": {"xgb": round(stds["xgb"],4), "rf": round(stds["rf"],4), "lr": round(stds["lr"],4)},
         "rf_tree_var": round(mean_tree_var,6),
         "weights": ENSEMBLE_WEIGHTS,
+        "feature_importance": bundle["feature_importance"],
         "trained_at": bundle["trained_at"]
     }
 
+    if variant:
+        metrics["variant"] = variant
+    save_bundle(city, bundle, metrics, variant=variant)
+    return metrics
+
+
+def feature_importance(bundle: dict, X_scaled) -> dict:
+    """Global importances (mean |SHAP| on the test rows); empty if they cannot be computed."""
     try:
-        with open(METRICS_PATH, "w", encoding="utf-8") as f:
-            json.dump(metrics, f, ensure_ascii=False, indent=2)
+        from app.ml.explain import global_importance
+        return global_importance(bundle, X_scaled)
+    except Exception as e:
+        log.warning("Feature importance skipped", extra={"error": str(e)})
+        return {}
+
+
+def accuracy_from_mae(mae: float, mean_y: float) -> float:
+    accuracy_percent = (1.0 - (mae / (mean_y + 1e-9))) * 100.0 if mean_y > 0 else 0.0
+    return max(0.0, min(100.0, accuracy_percent))
+
+
+def _write_atomic(path: Path, write):
+    """
+    Calls write(tmp_path) for a temp file next to `path`, then renames it over `path`.
+    Readers (load_model, other workers) see either the old file or the complete new one.
+    """
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def _dump_json(obj, path: Path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, indent=2)
+
+
+def _read_json(path: Path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
     except Exception:
-        pass
+        return None
 
-    return metrics
+
+def save_bundle(city: str, bundle: dict, metrics: dict, variant: str = None):
+    """
+    Stores the bundle and its metrics as a new immutable version, then points `variant`
+    (production if None) at it. Adds the version id to `metrics`.
+    """
+    version = datetime.utcnow().strftime("%Y%m%dT%H%M%S%fZ")
+    vdir = model_dir(city) / "versions" / version
+    tmp_dir = vdir.with_name(f".{version}.{os.getpid()}.tmp")
+    metrics["version"] = version
+
+    try:
+        tmp_dir.mkdir(parents=True)
+        joblib.dump(bundle, tmp_dir / "bundle.joblib")
+        _dump_json(metrics, tmp_dir / "metrics.json")
+        os.rename(tmp_dir, vdir)  # the whole version appears at once
+    except Exception as e:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise RuntimeError(f"Failed to save model bundle for {city}: {e}")
+
+    _set_pointer(city, version, variant)
+    try:
+        prune_versions(city)
+    except OSError as e:
+        log.warning("Pruning old model versions failed", extra={"city": city, "error": str(e)})
 
 
 # -----------------------
 # Load model
 # -----------------------
-def load_model(city: str):
+_BUNDLE_CACHE = {}  # (city, variant) -> (version or legacy mtime_ns, bundle, metrics)
+
+
+def _as_variant(metrics: dict, variant: str = None):
+    """Version metrics are immutable; label them with the pointer they were reached through."""
+    if metrics is None:
+        return None
+    metrics = dict(metrics)
+    metrics.pop("variant", None)
+    if variant:
+        metrics["variant"] = variant
+    return metrics
+
+
+def load_model(city: str, variant: str = None):
     """
     Returns (bundle, scaler, metrics_dict) for a specific city.
     """
-    MODEL_PATH, METRICS_PATH = get_model_paths(city)
+    version = current_version(city, variant)
+    MODEL_PATH, METRICS_PATH = version_paths(city, version) if version else get_model_paths(city, variant)
+
+    # versions never change on disk, so a cached one needs no stat(); flat files are checked by mtime
+    # (either way also what a preloaded parent shares with forked workers)
+    cached = _BUNDLE_CACHE.get((city, variant))
+    if version is not None and cached is not None and cached[0] == version:
+        bundle, scaler, metrics = cached[1], cached[1].get("scaler"), cached[2]
+        return bundle, scaler, _as_variant(metrics, variant)
 
     if not MODEL_PATH.exists():
         return None, None, None
-    try:
-        bundle = joblib.load(MODEL_PATH)
-    except Exception as e:
-        print(f"Failed to load model bundle for {city}: {e}")
-        return None, None, None
-        
+
+    stamp = version or MODEL_PATH.stat().st_mtime_ns
+    if cached is not None and cached[0] == stamp:
+        bundle = cached[1]
+    else:
+        try:
+            bundle = joblib.load(MODEL_PATH)
+        except Exception as e:
+            log.error("Failed to load model bundle", extra={"city": city, "error": str(e)})
+            return None, None, None
+
     scaler = bundle.get("scaler")
-    if scaler is None:
-        print(f"Model bundle for {city} is missing scaler.")
+    if scaler is None and bundle.get("engine") is None:  # sequence engines standardize internally
+        log.error("Model bundle is missing its scaler", extra={"city": city})
         return None, None, None
-        
-    metrics = None
-    if METRICS_PATH.exists():
-        try:
-            with open(METRICS_PATH, "r", encoding="utf-8") as f:
-                metrics = json.load(f)
-        except Exception:
-            metrics = None
-            
-    return bundle, scaler, metrics
+
+    metrics = _read_json(METRICS_PATH) if METRICS_PATH.exists() else None
+    _BUNDLE_CACHE[(city, variant)] = (stamp, bundle, metrics)
+    return bundle, scaler, _as_variant(metrics, variant) if version else metrics
 
 
 # -----------------------
 # Iterative future prediction
 # -----------------------
-def predict_future(bundle: dict, scaler: StandardScaler, future_weather: pd.DataFrame, last_history: pd.DataFrame = None):
+def predict_future(bundle: dict, scaler: "StandardScaler", future_weather: pd.DataFrame, last_history: pd.DataFrame = None, return_features: bool = False):
     """
     Iteratively predict horizon=1 forward for len(future_weather) hours.
-    (No changes needed in this function's logic)
+    Weather / time features of all hours are built and scaled as one matrix up front; each step
+    only fills in the pm25 lag columns of its row.
+    With return_features, the scaled feature rows that were fed to the models are returned
+    as "X_scaled" (one row per hour) so the forecast can be explained in one batch.
     """
     from app.utils.preprocess import _ensure_dt
+    from app.ml.inference import get_predictor
 
     if bundle is None:
         raise ValueError("Model bundle missing")
 
-    future = future_weather.copy()
-    future = _ensure_dt(future, col="datetime")
-    future = future.sort_values("datetime").reset_index(drop=True)
+    future = _ensure_dt(future_weather, col="datetime").sort_values("datetime").reset_index(drop=True)
 
     feature_names = bundle.get("feature_names", [])
     lags = bundle.get("lags", DEFAULT_LAGS)
-    horizon = bundle.get("horizon", 1)
-    models = bundle.get("models", {})
-    weights = bundle.get("weights", ENSEMBLE_WEIGHTS)
 
     if last_history is None or last_history.empty:
         raise ValueError("last_history required for iterative predictions.")
         
-    last_hist = last_history.copy()
+    last_hist = last_history[["datetime", "pm25"]].copy()
     last_hist["datetime"] = pd.to_datetime(last_hist["datetime"])
-    last_hist = last_hist.sort_values("datetime").reset_index(drop=True)
+    last_hist = last_hist.sort_values("datetime")
 
     max_lag = max(lags)
-    recent = last_hist.tail(max_lag)["pm25"].tolist()
+    recent = last_hist["pm25"].tail(max_lag).to_numpy(dtype=np.float64)
     if len(recent) < max_lag:
         pad_val = float(last_hist["pm25"].mean()) if not last_hist["pm25"].isna().all() else 0.0
-        pad = [pad_val] * (max_lag - len(recent))
-        recent = pad + recent
-
-    preds = []
-    pred_datetimes = []
-
-    for idx, row in future.iterrows():
-        feat = {}
-        for lag in lags:
-            val = recent[-lag] if lag <= len(recent) else recent[0]
-            feat[f"pm25_lag_{lag}"] = float(val) if val is not None else 0.0
-
-        dt = pd.to_datetime(row["datetime"])
-        feat["hour"] = int(dt.hour)
-        feat["day"] = int(dt.day)
-        feat["month"] = int(dt.month)
-        feat["weekday"] = int(dt.weekday())
+        recent = np.concatenate([np.full(max_lag - len(recent), pad_val), recent])
 
-        for col in feature_names:
-            if col.startswith("pm25_lag_") or col in ["hour","day","month","weekday"]:
-                continue
-            feat[col] = float(row[col]) if col in row and not pd.isna(row[col]) else 0.0
+    lag_pos = [(feature_names.index(f"pm25_lag_{lag}"), lag) for lag in lags if f"pm25_lag_{lag}" in feature_names]
+    lag_cols = np.array([j for j, _ in lag_pos], dtype=np.intp)
+    lag_back = np.array([lag for _, lag in lag_pos], dtype=np.intp)
+    lag_mean = scaler.mean_[lag_cols] if scaler.with_mean else 0.0
+    lag_scale = scaler.scale_[lag_cols] if scaler.with_std else 1.0
 
-        X_row = pd.DataFrame([feat], columns=feature_names)
-        X_scaled = scaler.transform(X_row)
+    T = len(future)
+    X_scaled = _scale(scaler, exogenous_matrix(future, feature_names, set(lag_cols.tolist())))
+    H = np.concatenate([recent, np.zeros(T)])  # observed lags, then the predictions
 
-        p_xgb = models.get("xgb").predict(X_scaled) if models.get("xgb") is not None else np.zeros(1)
-        p_rf = models.get("rf").predict(X_scaled)
-        p_lr = models.get("lr").predict(X_scaled)
-
-        p = weights.get("xgb",0)*p_xgb + weights.get("rf",0)*p_rf + weights.get("lr",0)*p_lr
-        p_val = float(p.ravel()[0])
-        preds.append(p_val)
-        pred_datetimes.append(str(dt))
-
-        recent.append(p_val)
-        if len(recent) > max_lag:
-            recent.pop(0)
+    predictor = get_predictor(bundle)
+    for t in range(T):
+        row = X_scaled[t:t + 1]
+        row[0, lag_cols] = (H[max_lag + t - lag_back] - lag_mean) / lag_scale
+        H[max_lag + t] = float(predictor.predict(row).ravel()[0])
+    preds = H[max_lag:]
 
     # Return result_df for compatibility with main.py
-    result_df = future.copy()
-    result_df['pm25_pred'] = preds
+    result_df = future
+    result_df["pm25_pred"] = preds
     
-    return {"datetimes": pred_datetimes, "predictions": np.array(preds), "result_df": result_df}
+    output = {"datetimes": [str(d) for d in future["datetime"]], "predictions": preds, "result_df": result_df}
+    if return_features:
+        output["X_scaled"] = X_scaled
+    return output
+
+
+def exogenous_matrix(future: pd.DataFrame, feature_names: list, skip: set = ()) -> np.ndarray:
+    """(hours, features) float64 matrix of the weather / time / location features; `skip` columns (lags) stay 0."""
+    dt = future["datetime"]
+    time_vals = {"hour": dt.dt.hour, "day": dt.dt.day, "month": dt.dt.month, "weekday": dt.dt.weekday}
+    E = np.zeros((len(future), len(feature_names)))
+    for j, col in enumerate(feature_names):
+        if j in skip:
+            continue
+        if col in time_vals:
+            E[:, j] = time_vals[col].to_numpy(dtype=float)
+        elif col in future.columns:
+            E[:, j] = pd.to_numeric(future[col], errors="coerce").fillna(0.0).to_numpy(dtype=float)
+    return E
+
+
+def _scale(scaler: "StandardScaler", X: np.ndarray) -> np.ndarray:
+    """StandardScaler.transform without the per-call validation (or feature-name checks)."""
+    out = X - scaler.mean_ if scaler.with_mean else X.astype(np.float64)
+    if scaler.with_std:
+        out /= scaler.scale_
+    return out
 
 
 # -----------------------
 # Metrics helper
 # -----------------------
-def get_metrics(city: str):
+def get_metrics(city: str, variant: str = None):
     """Gets metrics for a specific city."""
-    MODEL_PATH, METRICS_PATH = get_model_paths(city)
+    version = current_version(city, variant)
+    MODEL_PATH, METRICS_PATH = get_model_paths(city, variant)
     
     if METRICS_PATH.exists():
-        try:
-            with open(METRICS_PATH, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception:
+        metrics = _read_json(METRICS_PATH)
+        if metrics is None:
             return {"error":f"failed to read metrics for {city}"}
+        return _as_variant(metrics, variant) if version else metrics
             
-    return {"error":f"model not trained for {city}"}
\ No newline at end of file
+    return {"error":f"model not trained for {city}"}
+
+
+def promote_candidate(city: str) -> dict:
+    """Makes the candidate of `city` its production bundle (a pointer swap for stored versions)."""
+    candidate = current_version(city, "candidate")
+    if candidate is not None:
+        _set_pointer(city, candidate)
+        _clear_pointer(city, "candidate")
+        return get_metrics(city)
+
+    # flat candidate files from before versioning: store them as a new production version
+    cand_model, cand_metrics = get_model_paths(city, "candidate")
+    if not cand_model.exists():
+        raise FileNotFoundError(f"No candidate bundle for {city}")
+
+    metrics = get_metrics(city, "candidate")
+    metrics.pop("variant", None)
+    save_bundle(city, joblib.load(cand_model), metrics)
+    cand_model.unlink(missing_ok=True)
+    cand_metrics.unlink(missing_ok=True)
+    return metrics
@@ -0,0 +1,428 @@
+# app/ml/monitoring.py
+"""
+Online evaluation of served forecasts and automatic retraining.
+- record(): every served forecast is kept as (target hour, horizon, prediction) in a per-city ring
+- evaluate(): joins pending forecasts with the PM2.5 observed since (fetch_history, up to the
+  current hour), keeping rolling MAE / RMSE / bias per city and horizon bucket in fixed-size
+  float32 ring buffers
+- forecasts can be tagged with a model variant (e.g. a shadow-scored "candidate"); every variant
+  gets its own error buffers, only the primary one drives retraining
+- input drift: rolling mean z-score of served weather inputs and observed PM2.5 against the
+  bundle scaler's training mean / scale
+- a city whose 1h MAE exceeds RETRAIN_MAE_RATIO x its training MAE, or whose inputs drift past
+  DRIFT_Z, is queued for retraining; retrains run one at a time in a niced worker process,
+  only inside RETRAIN_OFFPEAK_HOURS (UTC)
+
+State is in memory and per process; the evaluation loop starts with the first record().
+"""
+
+import os
+import time
+import asyncio
+import multiprocessing
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from app.utils.logging_utils import get_logger
+
+log = get_logger(__name__)
+
+MONITOR_INTERVAL = float(os.environ.get("MONITOR_INTERVAL", 3600))
+MONITOR_WINDOW = int(os.environ.get("MONITOR_WINDOW", 720))  # errors kept per city x horizon bucket
+PENDING_CAPACITY = int(os.environ.get("MONITOR_PENDING_CAPACITY", 4096))  # unjoined forecasts per city
+MIN_SAMPLES = int(os.environ.get("MONITOR_MIN_SAMPLES", 24))
+RETRAIN_MAE_RATIO = float(os.environ.get("RETRAIN_MAE_RATIO", 1.5))
+DRIFT_Z = float(os.environ.get("DRIFT_Z", 2.0))
+RETRAIN_OFFPEAK_HOURS = os.environ.get("RETRAIN_OFFPEAK_HOURS", "1-5")  # UTC, "start-end"; empty = any time
+RETRAIN_MIN_INTERVAL = float(os.environ.get("RETRAIN_MIN_INTERVAL", 12 * 3600))
+RETRAIN_NICE = int(os.environ.get("RETRAIN_NICE", 10))
+RETRAIN_DAYS = int(os.environ.get("RETRAIN_DAYS", 30))
+
+# horizon buckets: 1h, 2-6h, 7-24h, 25-72h, 73h+
+HORIZON_EDGES = np.array([1, 6, 24, 72])
+HORIZON_LABELS = ["1h", "2-6h", "7-24h", "25-72h", "73h+"]
+
+# served inputs checked for drift (pm25 is compared through the pm25_lag_1 training stats)
+DRIFT_FEATURES = ["pm25", "temp", "humidity", "pressure", "wind", "precipitation"]
+
+PRIMARY = "primary"
+
+PENDING_DTYPE = np.dtype([("target", np.int64), ("horizon", np.int16), ("pred", np.float32)])
+
+
+def _epoch_hours(values) -> np.ndarray:
+    dt = pd.to_datetime(pd.Series(values), utc=True)
+    return (dt.astype("int64") // 3_600_000_000_000).to_numpy()
+
+
+def _parse_hours(spec: str):
+    if not spec:
+        return None
+    start, end = (int(x) for x in spec.split("-"))
+    return start, end
+
+
+def in_offpeak(now: datetime = None, spec: str = RETRAIN_OFFPEAK_HOURS) -> bool:
+    hours = _parse_hours(spec)
+    if hours is None:
+        return True
+    hour = (now or datetime.now(timezone.utc)).hour
+    start, end = hours
+    return start <= hour < end if start <= end else (hour >= start or hour < end)
+
+
+def _nice_worker():
+    try:
+        os.nice(RETRAIN_NICE)
+    except (AttributeError, OSError):
+        pass
+
+
+def _train(key: str, frames: dict) -> dict:
+    """Runs inside the retrain process."""
+    from app.ml.global_model import GLOBAL_KEY, train_global_model
+    if key == GLOBAL_KEY:
+        return train_global_model(frames)
+    from app.ml.model import train_model
+    return train_model(key, *frames[key])
+
+
+# -----------------------
+# Ring buffers
+# -----------------------
+class RollingErrors:
+    """Last `capacity` signed errors (pred - observed) per horizon bucket, float32."""
+
+    def __init__(self, capacity: int = MONITOR_WINDOW):
+        self.capacity = capacity
+        self.err = np.zeros((len(HORIZON_LABELS), capacity), dtype=np.float32)
+        self.pushed = np.zeros(len(HORIZON_LABELS), dtype=np.int64)
+
+    def push(self, buckets: np.ndarray, errors: np.ndarray):
+        for b in np.unique(buckets):
+            e = errors[buckets == b][-self.capacity:]
+            idx = (self.pushed[b] + np.arange(len(e))) % self.capacity
+            self.err[b, idx] = e
+            self.pushed[b] += len(e)
+
+    def stats(self) -> dict:
+        out = {}
+        for b, label in enumerate(HORIZON_LABELS):
+            n = int(min(self.pushed[b], self.capacity))
+            if n == 0:
+                continue
+            e = self.err[b, :n].astype(np.float64)
+            out[label] = {
+                "n": n,
+                "MAE": round(float(np.abs(e).mean()), 4),
+                "RMSE": round(float(np.sqrt((e ** 2).mean())), 4),
+                "bias": round(float(e.mean()), 4),
+            }
+        return out
+
+
+class DriftWindow:
+    """Last `capacity` per-batch mean z-scores of the drift features (NaN where not observed)."""
+
+    def __init__(self, capacity: int = 200):
+        self.capacity = capacity
+        self.z = np.full((capacity, len(DRIFT_FEATURES)), np.nan, dtype=np.float32)
+        self.pushed = 0
+
+    def push(self, z: np.ndarray):
+        self.z[self.pushed % self.capacity] = z
+        self.pushed += 1
+
+    def scores(self) -> dict:
+        rows = self.z[:min(self.pushed, self.capacity)]
+        out = {}
+        for j, name in enumerate(DRIFT_FEATURES):
+            col = rows[:, j]
+            col = col[~np.isnan(col)]
+            if len(col):
+                out[name] = round(float(col.mean()), 3)
+        return out
+
+
+class CityMonitor:
+    __slots__ = ("pending", "pending_pushed", "errors", "drift", "stats_mean", "stats_scale", "last_issue", "last_retrain", "reasons")
+
+    def __init__(self):
+        self.pending = np.zeros(PENDING_CAPACITY, dtype=PENDING_DTYPE)
+        self.pending["target"] = -1
+        self.pending_pushed = 0
+        self.errors = RollingErrors()
+        self.drift = DriftWindow()
+        self.stats_mean = None  # training mean / scale of DRIFT_FEATURES, from the bundle scaler
+        self.stats_scale = None
+        self.last_issue = (None, 0)  # (first target hour, steps recorded) of the latest forecast
+        self.last_retrain = 0.0
+        self.reasons = []
+
+    def reset(self):
+        self.pending["target"] = -1
+        self.errors = RollingErrors()
+        self.drift = DriftWindow()
+        self.stats_mean = self.stats_scale = None
+        self.last_issue = (None, 0)
+        self.reasons = []
+
+
+# -----------------------
+# Monitor
+# -----------------------
+class ForecastMonitor:
+    """
+    `fetch_history(city, days)`, `fetch_training_frames(city, days)` and `get_metrics(key)` are
+    injected so this module stays free of app.main imports.
+    """
+
+    def __init__(self, fetch_history, fetch_training_frames, get_metrics):
+        self.fetch_history = fetch_history
+        self.fetch_training_frames = fetch_training_frames
+        self.get_metrics = get_metrics
+        self.cities = {}
+        self.variants = {}  # (city, variant) -> CityMonitor for non-primary variants
+        self.retrain_queue = []
+        self.retraining = None
+        self._task = None
+        self._pool = None
+
+    def _city(self, city: str, variant: str = PRIMARY) -> CityMonitor:
+        store, key = (self.cities, city) if variant == PRIMARY else (self.variants, (city, variant))
+        mon = store.get(key)
+        if mon is None:
+            mon = store[key] = CityMonitor()
+        return mon
+
+    def _monitors(self, city: str) -> dict:
+        out = {PRIMARY: self.cities[city]} if city in self.cities else {}
+        out.update({v: mon for (c, v), mon in self.variants.items() if c == city})
+        return out
+
+    def _ensure_started(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    # ---- recording ----
+    def record(self, city: str, datetimes, predictions, df_weather: pd.DataFrame = None, bundle: dict = None, variant: str = PRIMARY):
+        """Keeps a served forecast for later scoring. Repeats within the same hour are recorded once."""
+        self._ensure_started()
+        mon = self._city(city, variant)
+        targets = _epoch_hours(datetimes)
+        preds = np.asarray(predictions, dtype=np.float32)
+        if len(targets) == 0:
+            return
+
+        if mon.stats_mean is None and bundle is not None:
+            self._set_training_stats(mon, bundle)
+
+        first, recorded = mon.last_issue
+        skip = recorded if first == targets[0] else 0
+        if skip >= len(targets):
+            return
+        mon.last_issue = (targets[0], len(targets))
+
+        horizons = np.arange(1, len(targets) + 1)
+        keep = slice(skip, len(targets))
+        self._push_pending(mon, targets[keep], horizons[keep], preds[keep])
+
+        if df_weather is not None and mon.stats_mean is not None and not skip:
+            z = np.full(len(DRIFT_FEATURES), np.nan, dtype=np.float32)
+            for j, col in enumerate(DRIFT_FEATURES[1:], start=1):
+                if col in df_weather.columns and not np.isnan(mon.stats_mean[j]):
+                    vals = pd.to_numeric(df_weather[col], errors="coerce").to_numpy(dtype=float)
+                    z[j] = (np.nanmean(vals) - mon.stats_mean[j]) / mon.stats_scale[j]
+            mon.drift.push(z)
+
+    @staticmethod
+    def _set_training_stats(mon: CityMonitor, bundle: dict):
+        scaler = bundle.get("scaler")
+        names = bundle.get("feature_names", [])
+        if scaler is None or not hasattr(scaler, "mean_"):
+            return
+        mean = np.full(len(DRIFT_FEATURES), np.nan)
+        scale = np.ones(len(DRIFT_FEATURES))
+        for j, col in enumerate(DRIFT_FEATURES):
+            src = "pm25_lag_1" if col == "pm25" else col
+            if src in names:
+                i = names.index(src)
+                mean[j] = scaler.mean_[i]
+                scale[j] = scaler.scale_[i] or 1.0
+        mon.stats_mean, mon.stats_scale = mean, scale
+
+    @staticmethod
+    def _push_pending(mon: CityMonitor, targets, horizons, preds):
+        n = len(targets)
+        if n > PENDING_CAPACITY:
+            targets, horizons, preds = targets[-PENDING_CAPACITY:], horizons[-PENDING_CAPACITY:], preds[-PENDING_CAPACITY:]
+            n = PENDING_CAPACITY
+        idx = (mon.pending_pushed + np.arange(n)) % PENDING_CAPACITY
+        mon.pending["target"][idx] = targets
+        mon.pending["horizon"][idx] = horizons
+        mon.pending["pred"][idx] = preds
+        mon.pending_pushed += n
+
+    # ---- joining ----
+    def join(self, city: str, df_obs: pd.DataFrame, variant: str = PRIMARY) -> int:
+        """Scores pending forecasts whose target hour is in `df_obs` (datetime, pm25). Returns rows scored."""
+        mon = self._city(city, variant)
+        if df_obs is None or df_obs.empty:
+            return 0
+
+        obs = df_obs.dropna(subset=["pm25"])
+        obs_hours = _epoch_hours(obs["datetime"])
+        # fetch_history ends with Open-Meteo's forecast days: only hours that have happened are observations
+        past = obs_hours <= int(time.time()) // 3600
+        order = np.argsort(obs_hours[past])
+        obs_hours = obs_hours[past][order]
+        obs_vals = obs["pm25"].to_numpy(dtype=float)[past][order]
+
+        if mon.stats_mean is not None and not np.isnan(mon.stats_mean[0]) and len(obs_vals):
+            z = np.full(len(DRIFT_FEATURES), np.nan, dtype=np.float32)
+            z[0] = (obs_vals[-24:].mean() - mon.stats_mean[0]) / mon.stats_scale[0]
+            mon.drift.push(z)
+
+        pend = mon.pending
+        live = pend["target"] >= 0
+        idx = np.searchsorted(obs_hours, pend["target"])
+        idx = np.clip(idx, 0, max(len(obs_hours) - 1, 0))
+        hit = live & (len(obs_hours) > 0) & (obs_hours[idx] == pend["target"])
+        if not hit.any():
+            return 0
+
+        errors = (pend["pred"][hit] - obs_vals[idx[hit]]).astype(np.float32)
+        buckets = np.searchsorted(HORIZON_EDGES, pend["horizon"][hit], side="left")
+        mon.errors.push(buckets, errors)
+        pend["target"][hit] = -1
+        return int(hit.sum())
+
+    # ---- triggers ----
+    def _training_mae(self, city: str):
+        from app.ml.global_model import MODEL_MODE, GLOBAL_KEY
+        metrics = self.get_metrics(GLOBAL_KEY if MODEL_MODE == "global" else city) or {}
+        per_city = metrics.get("per_city", {}).get(city)
+        return (per_city or metrics).get("MAE")
+
+    def check(self, city: str) -> list:
+        """Returns the reasons `city` should be retrained (empty when it is healthy)."""
+        mon = self._city(city)
+        reasons = []
+        first = mon.errors.stats().get(HORIZON_LABELS[0])
+        train_mae = self._training_mae(city)
+        if first and first["n"] >= MIN_SAMPLES and train_mae:
+            if first["MAE"] > RETRAIN_MAE_RATIO * train_mae:
+                reasons.append(f"mae {first['MAE']} > {RETRAIN_MAE_RATIO} x training {train_mae}")
+        for name, score in mon.drift.scores().items():
+            if abs(score) > DRIFT_Z:
+                reasons.append(f"drift {name} z={score}")
+        mon.reasons = reasons
+        return reasons
+
+    def _schedule(self, city: str, reasons: list):
+        from app.ml.global_model import MODEL_MODE, GLOBAL_KEY
+        key = GLOBAL_KEY if MODEL_MODE == "global" else city
+        mon = self._city(city)
+        if not reasons or key in self.retrain_queue or key == self.retraining:
+            return
+        if time.time() - mon.last_retrain < RETRAIN_MIN_INTERVAL:
+            return
+        log.warning("Retrain queued", extra={"key": key, "reasons": reasons})
+        self.retrain_queue.append(key)
+
+    # ---- loop ----
+    async def evaluate(self) -> dict:
+        """One pass: join observations, check thresholds, start at most one retrain if off-peak."""
+        scored = {}
+        cities = set(self.cities) | {c for c, _ in self.variants}
+        for city in sorted(cities):
+            monitors = self._monitors(city)
+            if not any((mon.pending["target"] >= 0).any() for mon in monitors.values()):
+                continue
+            try:
+                df_obs = await asyncio.to_thread(self.fetch_history, city, 2)
+            except Exception as e:
+                log.error("Monitor history fetch failed", extra={"city": city, "error": str(e)})
+                continue
+            scored[city] = sum(self.join(city, df_obs, variant) for variant in monitors)
+            if city in self.cities:
+                self._schedule(city, self.check(city))
+
+        if self.retrain_queue and self.retraining is None and in_offpeak():
+            self.retraining = self.retrain_queue.pop(0)
+            asyncio.create_task(self._retrain(self.retraining))
+        return scored
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(MONITOR_INTERVAL)
+            try:
+                await self.evaluate()
+            except Exception as e:
+                log.exception("Monitor pass failed")
+
+    async def _retrain(self, key: str):
+        from app.ml.global_model import GLOBAL_KEY
+        from app.utils.locations import CITY_COORDS
+
+        cities = list(CITY_COORDS) if key == GLOBAL_KEY else [key]
+        try:
+            results = await asyncio.gather(
+                *[asyncio.to_thread(self.fetch_training_frames, c, RETRAIN_DAYS) for c in cities],
+                return_exceptions=True
+            )
+            frames = {c: r for c, r in zip(cities, results) if not isinstance(r, Exception)}
+            if not frames:
+                raise ValueError("no training data")
+
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"), initializer=_nice_worker)
+            loop = asyncio.get_running_loop()
+            metrics = await loop.run_in_executor(self._pool, _train, key, frames)
+            log.info("Retrained", extra={"key": key, "mae": metrics.get("MAE")})
+
+            # new bundle: earlier forecasts and drift stats belonged to the old one
+            for c in cities:
+                mon = self._city(c)
+                mon.reset()
+                mon.last_retrain = time.time()
+        except Exception as e:
+            log.error("Retrain failed", extra={"key": key, "error": str(e)})
+        finally:
+            self.retraining = None
+
+    # ---- reporting ----
+    def city_stats(self, city: str) -> dict:
+        mon = self.cities.get(city)
+        variants = {v: {"horizons": m.errors.stats(), "pending": int((m.pending["target"] >= 0).sum())}
+                    for v, m in self._monitors(city).items() if v != PRIMARY}
+        if mon is None:
+            return {"horizons": {}, "drift_z": {}, "pending": 0, "variants": variants}
+        return {
+            "horizons": mon.errors.stats(),
+            "drift_z": mon.drift.scores(),
+            "pending": int((mon.pending["target"] >= 0).sum()),
+            "retrain_reasons": mon.reasons,
+            "last_retrain": datetime.fromtimestamp(mon.last_retrain, timezone.utc).isoformat() if mon.last_retrain else None,
+            "variants": variants,
+        }
+
+    def snapshot(self) -> dict:
+        return {
+            "cities": {city: self.city_stats(city) for city in sorted(set(self.cities) | {c for c, _ in self.variants})},
+            "retrain_queue": list(self.retrain_queue),
+            "retraining": self.retraining,
+            "offpeak_hours_utc": RETRAIN_OFFPEAK_HOURS or "any",
+            "thresholds": {"mae_ratio": RETRAIN_MAE_RATIO, "drift_z": DRIFT_Z, "min_samples": MIN_SAMPLES},
+        }
+
+    async def shutdown(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
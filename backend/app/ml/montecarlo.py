@@ -0,0 +1,142 @@
+# app/ml/montecarlo.py
+"""
+Probabilistic (ensemble) forecasts: many iterative trajectories instead of one.
+- every trajectory (path) follows one weather scenario: a weather-ensemble member
+  (fetch_ensemble_weather) or, without members, the deterministic forecast with AR(1) noise
+  whose spread grows with lead time (perturbed_members)
+- each path also draws one-step model residuals (N(0, sigma) from the bundle's validation
+  residuals), which feed back through the pm25 lags like real forecast errors do
+- all paths advance together: one (paths x features) matrix per hour and one predictor call, like
+  predict_future_batch does for cities; exogenous columns are built and scaled once per member
+- the result is per-hour percentiles over the paths
+
+GET /predict?mode=ensemble&paths=200
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from app.ml.model import DEFAULT_LAGS, exogenous_matrix, _scale
+from app.ml.inference import get_predictor
+
+ENSEMBLE_PATHS = int(os.environ.get("ENSEMBLE_PATHS", 200))
+MAX_ENSEMBLE_PATHS = int(os.environ.get("MAX_ENSEMBLE_PATHS", 1000))
+PERCENTILES = (5, 25, 50, 75, 95)
+
+# weather perturbation at +24h lead time: column -> ("add", sd in its unit) or ("mul", relative sd);
+# the sd grows with sqrt(lead / 24h)
+PERTURBATION = {
+    "temp": ("add", 1.0),
+    "humidity": ("add", 5.0),
+    "pressure": ("add", 1.0),
+    "wind": ("mul", 0.15),
+    "precipitation": ("mul", 0.5),
+}
+PERTURB_RHO = 0.9  # hour-to-hour autocorrelation of the perturbation
+
+
+def align_members(members: list, base: pd.DataFrame) -> list:
+    """Members on the datetimes of the deterministic forecast `base`; whatever a member lacks comes from `base`."""
+    base = base.set_index("datetime")
+    out = []
+    for m in members:
+        m = m.copy()
+        m["datetime"] = pd.to_datetime(m["datetime"], utc=True)
+        m = m.drop_duplicates("datetime").set_index("datetime").reindex(base.index)
+        m = m.apply(pd.to_numeric, errors="coerce").combine_first(base)[base.columns]
+        out.append(m.reset_index())
+    return out
+
+
+def perturbed_members(E: np.ndarray, feature_names: list, members: int, rng: np.random.Generator) -> np.ndarray:
+    """(members, hours, features) copies of E with correlated noise on the PERTURBATION columns; member 0 is E."""
+    T = len(E)
+    out = np.repeat(E[None], members, axis=0)
+    lead = np.sqrt(np.arange(1, T + 1) / 24.0)
+    for j, col in enumerate(feature_names):
+        if col not in PERTURBATION:
+            continue
+        kind, sd = PERTURBATION[col]
+        # AR(1) with unit variance, then scaled to the lead-time spread
+        shocks = rng.standard_normal((members - 1, T))
+        noise = np.empty_like(shocks)
+        noise[:, 0] = shocks[:, 0]
+        for t in range(1, T):
+            noise[:, t] = PERTURB_RHO * noise[:, t - 1] + np.sqrt(1 - PERTURB_RHO ** 2) * shocks[:, t]
+        noise *= sd * lead
+        if kind == "mul":
+            out[1:, :, j] = out[1:, :, j] * np.exp(noise)
+        else:
+            out[1:, :, j] = out[1:, :, j] + noise
+        if col == "humidity":
+            np.clip(out[:, :, j], 0, 100, out=out[:, :, j])
+    return out
+
+
+def simulate(bundle: dict, scaler: "StandardScaler", future_weather: pd.DataFrame, last_history: pd.DataFrame,
+             members: list = None, paths: int = ENSEMBLE_PATHS, sigma: float = 0.0, seed: int = None) -> dict:
+    """
+    Runs `paths` trajectories over len(future_weather) hours. `members` are weather-ensemble
+    frames (perturbed copies of future_weather are used when there are none). `sigma` is the
+    one-step residual sd. Returns datetimes, percentiles {p: array}, mean and the scenario source.
+    """
+    if bundle is None:
+        raise ValueError("Model bundle missing")
+    if last_history is None or last_history.empty:
+        raise ValueError("last_history required for iterative predictions.")
+    rng = np.random.default_rng(seed)
+    paths = max(1, min(int(paths), MAX_ENSEMBLE_PATHS))
+
+    feature_names = bundle.get("feature_names", [])
+    lags = bundle.get("lags", DEFAULT_LAGS)
+    max_lag = max(lags)
+    lag_idx = [(feature_names.index(f"pm25_lag_{lag}"), lag) for lag in lags if f"pm25_lag_{lag}" in feature_names]
+    lag_cols = np.array([j for j, _ in lag_idx], dtype=np.intp)
+    lag_back = np.array([lag for _, lag in lag_idx], dtype=np.intp)
+
+    future = future_weather.copy()
+    future["datetime"] = pd.to_datetime(future["datetime"], utc=True)
+    future = future.sort_values("datetime").reset_index(drop=True)
+    T = len(future)
+
+    # exogenous features per weather scenario, scaled once
+    skip = set(lag_cols.tolist())
+    if members:
+        source = "weather_ensemble"
+        E = np.stack([exogenous_matrix(m, feature_names, skip) for m in align_members(members, future)])
+    else:
+        source = "perturbed"
+        E = perturbed_members(exogenous_matrix(future, feature_names, skip), feature_names, min(paths, 50), rng)
+    E = _scale(scaler, E.reshape(-1, len(feature_names))).reshape(E.shape)
+    member_of = np.arange(paths) % len(E)
+
+    # history buffer per path: max_lag observed values followed by the T simulated ones
+    hist = last_history.copy()
+    hist["datetime"] = pd.to_datetime(hist["datetime"])
+    recent = hist.sort_values("datetime")["pm25"].tail(max_lag).to_numpy(dtype=float)
+    if len(recent) < max_lag:
+        pad_val = float(np.nanmean(hist["pm25"])) if hist["pm25"].notna().any() else 0.0
+        recent = np.concatenate([np.full(max_lag - len(recent), pad_val), recent])
+    H = np.empty((paths, max_lag + T))
+    H[:, :max_lag] = recent
+
+    predictor = get_predictor(bundle)
+    lag_mean = scaler.mean_[lag_cols] if scaler.with_mean else 0.0
+    lag_scale = scaler.scale_[lag_cols] if scaler.with_std else 1.0
+    noise = rng.normal(0.0, sigma, size=(paths, T)) if sigma > 0 else np.zeros((paths, T))
+    for t in range(T):
+        X = E[member_of, t]  # fancy indexing: a fresh (paths, features) matrix
+        X[:, lag_cols] = (H[:, max_lag + t - lag_back] - lag_mean) / lag_scale
+        H[:, max_lag + t] = np.maximum(np.asarray(predictor.predict(X), dtype=float).ravel() + noise[:, t], 0.0)
+
+    sims = H[:, max_lag:]
+    return {
+        "datetimes": [str(d) for d in future["datetime"]],
+        "percentiles": dict(zip(PERCENTILES, np.percentile(sims, PERCENTILES, axis=0))),
+        "mean": sims.mean(axis=0),
+        "paths": paths,
+        "members": len(E),
+        "source": source,
+    }
@@ -0,0 +1,230 @@
+# app/ml/multi_pollutant.py
+"""
+Multi-pollutant forecasting engine: PM2.5, PM10, NO2, O3, SO2 and CO from one bundle per city.
+- one feature matrix per city (make_multi_features): lags of every pollutant + weather + time,
+  so each pollutant also sees the others' recent history
+- the XGBoost / RandomForest / LinearRegression ensemble is fitted once on all targets
+  (standardized, so CO's large µg/m³ values don't dominate the split criterion): RandomForest
+  and XGBoost (multi_output_tree) grow trees whose leaves hold all pollutants at once
+- forecasting is one model call per hour for every pollutant together; the overall AQI comes
+  from the forecast sub-indices (app/utils/aqi.py)
+- stored through save_bundle as the "multi" variant, next to the PM2.5 bundle
+
+    GET /train?engine=multi, GET /predict?engine=multi
+"""
+
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from app.ml.model import DEFAULT_LAGS, ENSEMBLE_WEIGHTS, get_xgb_regressor, accuracy_from_mae, save_bundle
+from app.utils.history_utils import POLLUTANTS
+from app.utils.aqi import overall_aqi
+
+ENGINE = "multi"
+TARGETS = list(POLLUTANTS)
+AQI_CONTEXT_HOURS = 24  # observed hours in front of a forecast for the AQI averaging periods
+
+
+def _fit_models(X: np.ndarray, Y: np.ndarray, sample_weight, n_jobs: int) -> tuple:
+    """(models, weights) of the multi-output ensemble."""
+    from sklearn.linear_model import LinearRegression
+    from sklearn.ensemble import RandomForestRegressor
+    XGBRegressor = get_xgb_regressor()
+
+    weights = dict(ENSEMBLE_WEIGHTS)
+    models = {"xgb": None}
+    if XGBRegressor is not None:
+        xgb = XGBRegressor(n_estimators=250, learning_rate=0.05, max_depth=6, subsample=0.9, colsample_bytree=0.9,
+                           objective="reg:squarederror", tree_method="hist", multi_strategy="multi_output_tree",
+                           random_state=42, verbosity=0, n_jobs=n_jobs)
+        xgb.fit(X, Y, sample_weight=sample_weight)
+        models["xgb"] = xgb
+    else:
+        weights = {"xgb": 0, "rf": 0.6, "lr": 0.4}
+
+    models["rf"] = RandomForestRegressor(n_estimators=200, n_jobs=n_jobs, random_state=42).fit(X, Y, sample_weight=sample_weight)
+    # forecasts predict one row per call, where fanning out to threads costs more than it saves
+    models["rf"].set_params(n_jobs=1)
+    models["lr"] = LinearRegression().fit(X, Y, sample_weight=sample_weight)
+    return models, weights
+
+
+def _predict_z(models: dict, weights: dict, X: np.ndarray) -> np.ndarray:
+    """Standardized ensemble output, (rows, targets)."""
+    z = weights.get("rf", 0) * models["rf"].predict(X) + weights.get("lr", 0) * models["lr"].predict(X)
+    if models.get("xgb") is not None:
+        z = z + weights.get("xgb", 0) * models["xgb"].predict(X)
+    return z.reshape(len(X), -1)
+
+
+# -----------------------
+# Training
+# -----------------------
+def train_multi(city: str, df_pollutants: pd.DataFrame, df_weather: pd.DataFrame, lags: list = None, horizon: int = 1,
+                n_jobs: int = -1) -> dict:
+    """
+    Trains the multi-pollutant bundle for `city` from fetch_pollutants() + weather frames and
+    saves it as the "multi" variant. Returns per-pollutant and AQI metrics.
+    """
+    from app.utils.preprocess import merge_pm25_weather, make_multi_features, WEIGHT_COLUMN
+    from sklearn.preprocessing import StandardScaler
+
+    t0 = time.perf_counter()
+    lags = lags or DEFAULT_LAGS
+    if df_pollutants is None or df_weather is None:
+        raise ValueError("Missing input dataframes")
+    targets = [p for p in TARGETS if p in df_pollutants.columns and df_pollutants[p].notna().any()]
+    if "pm25" not in targets:
+        raise ValueError("Multi-pollutant training needs pm25 data")
+
+    merged = merge_pm25_weather(df_pollutants, df_weather, targets=targets)
+    if merged is None or merged.empty:
+        raise ValueError("Merged data is empty")
+    df_feat = make_multi_features(merged, targets, lags=lags, horizon=horizon)
+    n = len(df_feat)
+    if n < 30:
+        raise ValueError(f"Not enough rows to train for {city} (need >=30 rows, got {n}).")
+
+    y_cols = [f"y_{p}" for p in targets]
+    Y = df_feat[y_cols].to_numpy(dtype=np.float64)
+    sample_weight = df_feat[WEIGHT_COLUMN].to_numpy() if WEIGHT_COLUMN in df_feat.columns else None
+    X_df = df_feat.drop(columns=["datetime", *y_cols, WEIGHT_COLUMN], errors="ignore")
+    feature_names = list(X_df.columns)
+    X = X_df.to_numpy(dtype=np.float64)
+
+    # chronological split
+    split_idx = int(n * 0.8)
+    scaler = StandardScaler().fit(X[:split_idx])
+    X_scaled = scaler.transform(X)
+    y_mean = Y[:split_idx].mean(axis=0)
+    y_std = Y[:split_idx].std(axis=0)
+    y_std[y_std == 0] = 1.0
+    Z = (Y - y_mean) / y_std
+
+    w_train = sample_weight[:split_idx] if sample_weight is not None else None
+    models, weights = _fit_models(X_scaled[:split_idx], Z[:split_idx], w_train, n_jobs)
+
+    # test metrics in µg/m³, per pollutant and for the hourly AQI they imply
+    pred = _predict_z(models, weights, X_scaled[split_idx:]) * y_std + y_mean
+    actual = Y[split_idx:]
+    err = pred - actual
+    per_target = {}
+    for j, p in enumerate(targets):
+        mae = float(np.abs(err[:, j]).mean())
+        per_target[p] = {
+            "MAE": round(mae, 4),
+            "RMSE": round(float(np.sqrt((err[:, j] ** 2).mean())), 4),
+            "accuracy_percent": round(accuracy_from_mae(mae, float(actual[:, j].mean())), 2),
+            "residual_std": round(float(err[:, j].std(ddof=1)), 4) if len(err) > 1 else 0.0,
+        }
+    aqi_pred, _, _ = overall_aqi({p: np.clip(pred[:, j], 0, None) for j, p in enumerate(targets)}, averaged=True)
+    aqi_true, _, _ = overall_aqi({p: actual[:, j] for j, p in enumerate(targets)}, averaged=True)
+
+    bundle = {
+        "engine": ENGINE,
+        "models": models,
+        "scaler": scaler,
+        "feature_names": feature_names,
+        "targets": targets,
+        "lags": lags,
+        "horizon": horizon,
+        "weights": weights,
+        "y_mean": y_mean,
+        "y_std": y_std,
+        "trained_at": datetime.utcnow().isoformat(),
+    }
+    metrics = {
+        "status": "trained",
+        "engine": ENGINE,
+        "city": city,
+        "rows": int(n),
+        "test_rows": int(n - split_idx),
+        "targets": targets,
+        # headline numbers are PM2.5's, comparable with the single-target bundle
+        "MAE": per_target["pm25"]["MAE"],
+        "accuracy_percent": per_target["pm25"]["accuracy_percent"],
+        "pollutants": per_target,
+        "AQI_MAE": round(float(np.nanmean(np.abs(aqi_pred - aqi_true))), 2),
+        "weights": weights,
+        "train_seconds": round(time.perf_counter() - t0, 2),
+        "trained_at": bundle["trained_at"],
+    }
+    save_bundle(city, bundle, metrics, variant=ENGINE)
+    return metrics
+
+
+# -----------------------
+# Forecast
+# -----------------------
+def forecast(bundle: dict, last_history: pd.DataFrame, future_weather: pd.DataFrame) -> dict:
+    """
+    Iterative horizon=1 forecast of every target for len(future_weather) hours, one model call
+    per hour. Weather / time columns are built and scaled for all hours up front; only the lag
+    columns are filled in per step. Returns datetimes, {pollutant: array} and the AQI per hour.
+    """
+    from app.utils.preprocess import _ensure_dt
+
+    targets = bundle["targets"]
+    lags = bundle["lags"]
+    feature_names = bundle["feature_names"]
+    scaler = bundle["scaler"]
+    if last_history is None or last_history.empty:
+        raise ValueError("last_history required for iterative predictions.")
+
+    future = _ensure_dt(future_weather).sort_values("datetime").reset_index(drop=True)
+    hist = _ensure_dt(last_history).sort_values("datetime").reset_index(drop=True)
+
+    # recent values per target; gaps take the last reading, missing pollutants their training mean
+    max_lag = max(lags)
+    past = np.column_stack([
+        hist[p].ffill().to_numpy(dtype=np.float64) if p in hist.columns else np.full(len(hist), np.nan)
+        for p in targets
+    ])
+    past = np.where(np.isnan(past), bundle["y_mean"], past)
+    if len(past) < max_lag:
+        past = np.vstack([np.repeat(past.mean(axis=0, keepdims=True), max_lag - len(past), axis=0), past])
+    recent = past[-max_lag:]
+
+    n = len(future)
+    X = np.zeros((n, len(feature_names)))
+    dt = future["datetime"]
+    time_cols = {"hour": dt.dt.hour, "day": dt.dt.day, "month": dt.dt.month, "weekday": dt.dt.weekday}
+    lag_slots = []  # (feature index, target index, lag)
+    for i, col in enumerate(feature_names):
+        target, _, lag = col.rpartition("_lag_")
+        if target in targets and lag.isdigit():
+            lag_slots.append((i, targets.index(target), int(lag)))
+        elif col in time_cols:
+            X[:, i] = time_cols[col].to_numpy()
+        elif col in future.columns:
+            X[:, i] = pd.to_numeric(future[col], errors="coerce").fillna(0.0).to_numpy()
+    X_scaled = (X - scaler.mean_) / scaler.scale_
+    lag_idx = np.array([s[0] for s in lag_slots], dtype=np.intp)
+    lag_tgt = np.array([s[1] for s in lag_slots], dtype=np.intp)
+    lag_back = np.array([s[2] for s in lag_slots], dtype=np.intp)
+    lag_mean, lag_scale = scaler.mean_[lag_idx], scaler.scale_[lag_idx]
+
+    buffer = np.vstack([recent, np.zeros((n, len(targets)))])
+    models, weights = bundle["models"], bundle["weights"]
+    for h in range(n):
+        row = X_scaled[h:h + 1]
+        row[0, lag_idx] = (buffer[max_lag + h - lag_back, lag_tgt] - lag_mean) / lag_scale
+        step = _predict_z(models, weights, row)[0] * bundle["y_std"] + bundle["y_mean"]
+        buffer[max_lag + h] = np.clip(step, 0, None)
+    preds = buffer[max_lag:]
+
+    # AQI averaging periods reach back into observed hours
+    context = past[-AQI_CONTEXT_HOURS:]
+    series = np.vstack([context, preds])
+    aqi, dominant, subs = overall_aqi({p: series[:, j] for j, p in enumerate(targets)})
+    k = len(context)
+    return {
+        "datetimes": [str(d) for d in dt],
+        "predictions": {p: preds[:, j] for j, p in enumerate(targets)},
+        "aqi": aqi[k:],
+        "dominant": dominant[k:],
+        "sub_indices": {p: s[k:] for p, s in subs.items()},
+    }
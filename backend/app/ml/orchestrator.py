@@ -0,0 +1,168 @@
+# app/ml/orchestrator.py
+"""
+Trains every city in one job instead of lazily, one request at a time.
+- training frames for all cities are fetched concurrently (threads; the upstream governor
+  enforces the per-API limits)
+- cities then train in `parallel` spawn processes, each capped to cores // parallel threads
+  (XGBoost / RandomForest n_jobs and BLAS via threadpoolctl), largest dataset first, so
+  concurrent fits never oversubscribe the machine
+- bundles are stored as new versions by save_bundle (written aside, renamed into place, then the
+  pointer swapped); serving workers pick them up through load_model's pointer check
+- MODEL_MODE=global trains the single cross-city bundle with all cores instead
+
+    python -m app.ml.orchestrator --days 30
+    python -m app.ml.orchestrator --cities Delhi Mumbai --cores 4 --parallel 2 --variant candidate
+
+POST /train/all runs the same job from the API.
+"""
+
+import os
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+from app.utils.locations import CITY_COORDS
+from app.ml.global_model import MODEL_MODE, GLOBAL_KEY
+from app.utils.logging_utils import get_logger
+
+log = get_logger(__name__)
+
+FETCH_WORKERS = int(os.environ.get("TRAIN_FETCH_WORKERS", 8))
+
+
+def available_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def plan(n_jobs: int, cores: int = None, parallel: int = None):
+    """(parallel processes, threads per process) for n_jobs trainings on `cores` cores."""
+    cores = max(1, cores or available_cores())
+    parallel = max(1, min(parallel or cores, n_jobs, cores))
+    return parallel, max(1, cores // parallel)
+
+
+def _train_city(city: str, frames, variant: str, n_jobs: int) -> dict:
+    """Runs inside a training process."""
+    t0 = time.perf_counter()
+    try:
+        from threadpoolctl import threadpool_limits
+        limits = threadpool_limits(n_jobs)
+    except ImportError:
+        limits = None
+    try:
+        if city == GLOBAL_KEY:
+            from app.ml.global_model import train_global_model
+            metrics = train_global_model(frames, variant=variant, n_jobs=n_jobs)
+        else:
+            from app.ml.model import train_model
+            metrics = train_model(city, *frames, variant=variant, n_jobs=n_jobs)
+    finally:
+        if limits is not None:
+            limits.unregister()
+    return {"metrics": metrics, "train_seconds": time.perf_counter() - t0, "pid": os.getpid()}
+
+
+def _timed_fetch(fetch_frames, city: str, days: int):
+    t0 = time.perf_counter()
+    frames = fetch_frames(city, days)
+    return frames, time.perf_counter() - t0
+
+
+def train_all(fetch_frames, cities: list = None, days: int = 30, cores: int = None, parallel: int = None,
+              variant: str = None, mode: str = None) -> dict:
+    """
+    fetch_frames(city, days) -> (df_pm25, df_weather), e.g. app.main.fetch_training_frames.
+    Returns a summary with wall time, the core split and per-city fetch / train timings.
+    """
+    t_start = time.perf_counter()
+    cities = [c for c in (cities or list(CITY_COORDS)) if c in CITY_COORDS]
+    mode = mode or MODEL_MODE
+    results = {c: {"status": "pending"} for c in cities}
+
+    # ---- fetch all cities concurrently ----
+    frames = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(FETCH_WORKERS, len(cities)))) as ex:
+        futures = {ex.submit(_timed_fetch, fetch_frames, c, days): c for c in cities}
+        for fut in as_completed(futures):
+            city = futures[fut]
+            try:
+                frames[city], seconds = fut.result()
+                results[city].update(fetch_seconds=round(seconds, 3), rows=int(len(frames[city][0])))
+            except Exception as e:
+                results[city] = {"status": "failed", "stage": "fetch", "error": str(e)}
+                log.error("Training data fetch failed", extra={"city": city, "error": str(e)})
+    fetch_seconds = time.perf_counter() - t_start
+
+    # ---- train ----
+    if mode == "global":
+        jobs = [(GLOBAL_KEY, frames)] if frames else []
+    else:
+        # longest jobs first so the last process to finish is not the one holding the biggest city
+        jobs = sorted(((c, f) for c, f in frames.items()), key=lambda cf: -len(cf[1][0]))
+    parallel, threads = plan(len(jobs) or 1, cores, parallel)
+
+    t_train = time.perf_counter()
+    if jobs:
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=parallel, mp_context=ctx) as pool:
+            futures = {pool.submit(_train_city, key, f, variant, threads): key for key, f in jobs}
+            for fut in as_completed(futures):
+                key = futures[fut]
+                entry = results.setdefault(key, {})
+                try:
+                    out = fut.result()
+                    m = out["metrics"]
+                    entry.update(status="trained", train_seconds=round(out["train_seconds"], 3),
+                                 MAE=m.get("MAE"), accuracy_percent=m.get("accuracy_percent"), version=m.get("version"))
+                    if key == GLOBAL_KEY:
+                        for c in frames:
+                            results[c]["status"] = "trained"
+                    log.info("Trained", extra={"key": key, "train_seconds": round(out["train_seconds"], 1), "mae": m.get("MAE")})
+                except Exception as e:
+                    entry.update(status="failed", stage="train", error=str(e))
+                    log.error("Training failed", extra={"key": key, "error": str(e)})
+    train_seconds = time.perf_counter() - t_train
+
+    return {
+        "mode": mode,
+        "variant": variant,
+        "days": days,
+        "cores": max(1, cores or available_cores()),
+        "parallel": parallel,
+        "threads_per_job": threads,
+        "fetch_seconds": round(fetch_seconds, 3),
+        "train_seconds": round(train_seconds, 3),
+        "wall_seconds": round(time.perf_counter() - t_start, 3),
+        "trained": sum(1 for r in results.values() if r.get("status") == "trained"),
+        "failed": [c for c, r in results.items() if r.get("status") == "failed"],
+        "cities": results,
+    }
+
+
+# -----------------------
+# CLI
+# -----------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train models for all cities in one job.")
+    parser.add_argument("--cities", nargs="+", default=list(CITY_COORDS), help="Cities to train (default: all)")
+    parser.add_argument("--days", type=int, default=30, help="Training window in days")
+    parser.add_argument("--cores", type=int, default=None, help="Cores to use (default: all available)")
+    parser.add_argument("--parallel", type=int, default=None, help="Cities trained at once (default: one per core)")
+    parser.add_argument("--variant", default=None, help='Bundle variant, e.g. "candidate"')
+    parser.add_argument("--mode", choices=["per_city", "global"], default=None, help="Default: MODEL_MODE")
+    args = parser.parse_args(argv)
+
+    from app.main import fetch_training_frames
+
+    summary = train_all(fetch_training_frames, args.cities, args.days, args.cores, args.parallel, args.variant, args.mode)
+    print(json.dumps(summary, indent=2))
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,151 @@
+# app/ml/shadow.py
+"""
+Shadow / A-B evaluation of a candidate bundle (the version weights/<city>/candidate points at).
+- choose(): picks the variant that serves a request; CANDIDATE_TRAFFIC is the candidate's share
+- submit(): scores the other variant off the request path; the result goes to the forecast
+  monitor (scored against actuals like every served forecast) and to a JSONL log
+- shadow scoring runs in SHADOW_WORKERS niced, single-threaded processes, so it never holds
+  the server's GIL or cores; at most SHADOW_MAX_PENDING calls wait, the rest are dropped
+
+Train a candidate with /train?variant=candidate, promote it with POST /models/{city}/promote.
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import multiprocessing
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+from app.ml.model import get_model_paths
+from app.ml.monitoring import PRIMARY
+from app.utils.logging_utils import get_logger
+
+log = get_logger(__name__)
+
+CANDIDATE = "candidate"
+SHADOW_EVAL = os.environ.get("SHADOW_EVAL", "1") == "1"
+CANDIDATE_TRAFFIC = float(os.environ.get("CANDIDATE_TRAFFIC", 0.0))  # share of requests served by the candidate
+SHADOW_WORKERS = int(os.environ.get("SHADOW_WORKERS", 1))
+SHADOW_MAX_PENDING = int(os.environ.get("SHADOW_MAX_PENDING", 8))
+SHADOW_NICE = int(os.environ.get("SHADOW_NICE", 10))
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+SHADOW_LOG_DIR = Path(os.environ.get("SHADOW_LOG_DIR", BASE_DIR / "data" / "shadow"))
+
+
+def _init_worker():
+    """One core's worth of work at most: nice the process and keep BLAS/OpenMP to one thread."""
+    try:
+        os.nice(SHADOW_NICE)
+    except (AttributeError, OSError):
+        pass
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(1)
+    except ImportError:
+        pass
+
+
+def _shadow_predict(key: str, variant: str, df_weather, df_pm25):
+    """Runs inside a shadow process. Bundles stay cached there (load_model follows the version pointer)."""
+    from app.ml.model import load_model, predict_future
+
+    t0 = time.perf_counter()
+    bundle, scaler, _ = load_model(key, None if variant == PRIMARY else variant)
+    if bundle is None:
+        raise FileNotFoundError(f"No {variant} bundle for {key}")
+    for model in bundle.get("models", {}).values():
+        if model is not None and hasattr(model, "n_jobs"):
+            model.n_jobs = 1
+
+    output = predict_future(bundle, scaler, df_weather, last_history=df_pm25)
+    return output["datetimes"], output["predictions"].tolist(), time.perf_counter() - t0
+
+
+class ShadowEvaluator:
+    """Routes requests between primary and candidate and scores the unserved one in the background."""
+
+    def __init__(self, monitor, workers: int = SHADOW_WORKERS, max_pending: int = SHADOW_MAX_PENDING):
+        self.monitor = monitor
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.pending = 0
+        self.stats = {"submitted": 0, "completed": 0, "dropped": 0, "failed": 0, "shadow_seconds": 0.0}
+        self._pool = None
+
+    @staticmethod
+    def has_candidate(key: str) -> bool:
+        return get_model_paths(key, CANDIDATE)[0].exists()
+
+    def choose(self, key: str) -> str:
+        """Variant that serves this request: the candidate for CANDIDATE_TRAFFIC of requests, if one exists."""
+        if CANDIDATE_TRAFFIC > 0 and random.random() < CANDIDATE_TRAFFIC and self.has_candidate(key):
+            return CANDIDATE
+        return PRIMARY
+
+    def submit(self, city: str, key: str, served: str, df_weather, df_pm25) -> bool:
+        """
+        Schedules the variant that did not serve this request. Never blocks: returns False when
+        shadowing is off, there is no candidate, or the backlog is full.
+        """
+        if not SHADOW_EVAL or not self.has_candidate(key):
+            return False
+        if self.pending >= self.max_pending:
+            self.stats["dropped"] += 1
+            return False
+
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker)
+
+        variant = PRIMARY if served == CANDIDATE else CANDIDATE
+        loop = asyncio.get_running_loop()
+        future = self._pool.submit(_shadow_predict, key, variant, df_weather, df_pm25)
+        self.pending += 1
+        self.stats["submitted"] += 1
+        future.add_done_callback(lambda f: loop.call_soon_threadsafe(self._done, f, city, variant, served))
+        return True
+
+    def _done(self, future, city: str, variant: str, served: str):
+        self.pending -= 1
+        try:
+            datetimes, predictions, seconds = future.result()
+        except Exception as e:
+            self.stats["failed"] += 1
+            log.error("Shadow prediction failed", extra={"city": city, "variant": variant, "error": str(e)})
+            return
+
+        self.stats["completed"] += 1
+        self.stats["shadow_seconds"] += seconds
+        self.monitor.record(city, datetimes, predictions, variant=variant)
+        self._log(city, variant, served, datetimes, predictions, seconds)
+
+    @staticmethod
+    def _log(city, variant, served, datetimes, predictions, seconds):
+        try:
+            SHADOW_LOG_DIR.mkdir(parents=True, exist_ok=True)
+            line = {"logged_at": datetime.utcnow().isoformat(), "city": city, "variant": variant, "served": served,
+                    "seconds": round(seconds, 4), "datetimes": datetimes, "predictions": [round(p, 3) for p in predictions]}
+            with open(SHADOW_LOG_DIR / f"{city.lower().replace(' ', '_')}.jsonl", "a", encoding="utf-8") as f:
+                f.write(json.dumps(line) + "\n")
+        except OSError as e:
+            log.error("Shadow log write failed", extra={"error": str(e)})
+
+    def snapshot(self) -> dict:
+        done = self.stats["completed"]
+        return {
+            "shadow_eval": SHADOW_EVAL,
+            "candidate_traffic": CANDIDATE_TRAFFIC,
+            "workers": self.workers,
+            "pending": self.pending,
+            **{k: v for k, v in self.stats.items() if k != "shadow_seconds"},
+            "mean_shadow_seconds": round(self.stats["shadow_seconds"] / done, 4) if done else None,
+        }
+
+    async def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
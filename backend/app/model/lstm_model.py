@@ -0,0 +1,298 @@
+# backend/app/model/lstm_model.py
+"""
+Sequence-model (LSTM) forecasting engine.
+- inputs come from merge_pm25_weather, like make_features: the encoder reads the last SEQ_LEN
+  hours of pm25 + time-of-day / weekday features, the head reads the forecast weather columns
+  (+ time features) for every horizon hour, and one forward pass emits all HORIZON steps
+- training windows are sliding_window_view views over the hourly arrays; batches are gathered
+  from them inside a streaming tf.data generator, so no per-window copies are ever materialized
+- after training the Keras weights are exported as plain NumPy arrays into a normal bundle
+  (saved through save_bundle as the "lstm" variant); serving runs a NumPy forward pass, so
+  tensorflow is only needed to train
+
+    python -m app.model.train_lstm --city Delhi --days 60
+    GET /train?engine=lstm, GET /predict?engine=lstm
+"""
+
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from app.utils.resample import epoch_hours, hourly_grid, fill_gaps
+
+ENGINE = "lstm"
+SEQ_LEN = int(os.environ.get("LSTM_SEQ_LEN", 48))
+HORIZON = int(os.environ.get("LSTM_HORIZON", 72))
+UNITS = int(os.environ.get("LSTM_UNITS", 64))
+EPOCHS = int(os.environ.get("LSTM_EPOCHS", 30))
+BATCH_SIZE = int(os.environ.get("LSTM_BATCH_SIZE", 64))
+
+TIME_FEATURES = ["hour_sin", "hour_cos", "weekday_sin", "weekday_cos"]
+
+
+def _time_features(hours: np.ndarray) -> np.ndarray:
+    """Cyclic hour-of-day / weekday encodings for epoch hours, (n, 4) float32."""
+    hod = (hours % 24) * (2 * np.pi / 24)
+    dow = ((hours // 24 + 3) % 7) * (2 * np.pi / 7)  # 1970-01-01 was a Thursday -> Monday = 0
+    return np.stack([np.sin(hod), np.cos(hod), np.sin(dow), np.cos(dow)], axis=1).astype(np.float32)
+
+
+# -----------------------
+# Arrays + windows
+# -----------------------
+def build_arrays(merged: pd.DataFrame, weather_cols: list, stats: dict):
+    """
+    (past, future, target) float32 arrays over the merged hourly grid, standardized with `stats`.
+    past: pm25 + time features; future: weather + time features; target: pm25.
+    """
+    hours = epoch_hours(merged["datetime"])
+    tf_ = _time_features(hours)
+    pm25 = ((merged["pm25"].to_numpy(dtype=np.float64) - stats["pm25_mean"]) / stats["pm25_std"]).astype(np.float32)
+    weather = ((merged[weather_cols].to_numpy(dtype=np.float64) - stats["weather_mean"]) / stats["weather_std"]).astype(np.float32)
+    past = np.concatenate([pm25[:, None], tf_], axis=1)
+    future = np.concatenate([weather, tf_], axis=1)
+    return past, future, pm25
+
+
+def make_windows(past: np.ndarray, future: np.ndarray, target: np.ndarray, seq_len: int = SEQ_LEN, horizon: int = HORIZON):
+    """
+    Zero-copy training windows. Sample i reads past hours [i, i+seq_len) and predicts hours
+    [i+seq_len, i+seq_len+horizon). Returns (past_w, future_w, y_w, valid_idx): the three are
+    strided views (n, seq_len, P) / (n, horizon, F) / (n, horizon); valid_idx lists the samples
+    with no NaN anywhere in their window (found with cumulative sums, O(n)).
+    """
+    n = len(target) - seq_len - horizon + 1
+    if n <= 0:
+        return None, None, None, np.zeros(0, dtype=np.int64)
+
+    past_w = sliding_window_view(past, seq_len, axis=0)[:n].transpose(0, 2, 1)
+    future_w = sliding_window_view(future[seq_len:], horizon, axis=0)[:n].transpose(0, 2, 1)
+    y_w = sliding_window_view(target[seq_len:], horizon)[:n]
+
+    def bad_in_window(bad: np.ndarray, start: int, length: int) -> np.ndarray:
+        c = np.concatenate(([0], np.cumsum(bad)))
+        return c[start + length:start + length + n] - c[start:start + n] > 0
+
+    bad_past = np.isnan(past).any(axis=1)
+    bad_future = np.isnan(future).any(axis=1) | np.isnan(target)
+    valid = ~(bad_in_window(bad_past, 0, seq_len) | bad_in_window(bad_future, seq_len, horizon))
+    return past_w, future_w, y_w, np.flatnonzero(valid)
+
+
+# -----------------------
+# NumPy inference
+# -----------------------
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def forward(weights: dict, past: np.ndarray, future: np.ndarray) -> np.ndarray:
+    """
+    The exported network on a batch: past (B, seq_len, P), future (B, horizon, F) -> (B, horizon),
+    in standardized pm25 units. Mirrors build_keras_model layer for layer.
+    """
+    W, U, b = weights["lstm_kernel"], weights["lstm_recurrent"], weights["lstm_bias"]
+    units = U.shape[0]
+    xw = past @ W + b  # input projection for every step in one matmul
+    h = np.zeros((len(past), units), dtype=np.float32)
+    c = np.zeros_like(h)
+    for t in range(past.shape[1]):
+        z = xw[:, t] + h @ U
+        i = _sigmoid(z[:, :units])
+        f = _sigmoid(z[:, units:2 * units])
+        g = np.tanh(z[:, 2 * units:3 * units])
+        o = _sigmoid(z[:, 3 * units:])
+        c = f * c + i * g
+        h = o * np.tanh(c)
+
+    fut = np.maximum(future @ weights["future_kernel"] + weights["future_bias"], 0.0)
+    z = np.concatenate([h, fut.reshape(len(future), -1)], axis=1)
+    z = np.maximum(z @ weights["hidden_kernel"] + weights["hidden_bias"], 0.0)
+    return z @ weights["out_kernel"] + weights["out_bias"]
+
+
+def forecast(bundle: dict, last_history: pd.DataFrame, future_weather: pd.DataFrame) -> dict:
+    """
+    All forecast hours of `future_weather` (up to the bundle's horizon) in one forward pass.
+    Returns the same {"datetimes", "predictions", "result_df"} shape as predict_future.
+    """
+    seq_len, horizon = bundle["seq_len"], bundle["horizon"]
+    stats, weather_cols = bundle["stats"], bundle["weather_cols"]
+
+    w_hours = epoch_hours(future_weather["datetime"])
+    anchor = int(w_hours.min()) - 1  # the encoder window ends right before the first forecast hour
+    steps = w_hours - anchor
+    keep = steps <= horizon
+    if not keep.any():
+        raise ValueError("Forecast weather starts beyond the LSTM horizon")
+
+    # past pm25 on the hourly grid, short gaps filled the same way as in training
+    p_hours = epoch_hours(last_history["datetime"])
+    _, pm25 = hourly_grid(p_hours, pd.to_numeric(last_history["pm25"], errors="coerce").to_numpy(dtype=np.float64),
+                          anchor - seq_len + 1, anchor)
+    pm25, _, _ = fill_gaps(pm25[:, 0], bundle.get("max_gap", 6))
+    if np.isnan(pm25).any():
+        raise ValueError(f"Not enough recent PM2.5 history for the {seq_len}h LSTM window")
+
+    past_hours = np.arange(anchor - seq_len + 1, anchor + 1)
+    past = np.concatenate([((pm25 - stats["pm25_mean"]) / stats["pm25_std"])[:, None], _time_features(past_hours)], axis=1)
+
+    # forecast weather for horizon hours anchor+1 .. anchor+horizon; hours past the forecast repeat its last value
+    fut_hours = np.arange(anchor + 1, anchor + horizon + 1)
+    _, weather = hourly_grid(w_hours, future_weather[weather_cols].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64),
+                             anchor + 1, anchor + horizon)
+    for j in range(weather.shape[1]):
+        fill_gaps(weather[:, j], horizon)
+    weather = np.nan_to_num((weather - stats["weather_mean"]) / stats["weather_std"])
+    future = np.concatenate([weather, _time_features(fut_hours)], axis=1)
+
+    z = forward(bundle["weights"], past[None].astype(np.float32), future[None].astype(np.float32))[0]
+    preds_all = np.maximum(z * stats["pm25_std"] + stats["pm25_mean"], 0.0)
+    preds = preds_all[steps[keep] - 1]
+
+    result_df = future_weather.iloc[np.flatnonzero(keep)].copy().reset_index(drop=True)
+    result_df["pm25_pred"] = preds
+    return {"datetimes": [str(dt) for dt in result_df["datetime"]], "predictions": preds, "result_df": result_df}
+
+
+# -----------------------
+# Training (tensorflow)
+# -----------------------
+def build_keras_model(seq_len: int, horizon: int, n_past: int, n_future: int, units: int = UNITS):
+    from tensorflow import keras
+    from tensorflow.keras import layers
+
+    past = keras.Input(shape=(seq_len, n_past), name="past")
+    future = keras.Input(shape=(horizon, n_future), name="future")
+    h = layers.LSTM(units, name="lstm")(past)
+    f = layers.Dense(8, activation="relu", name="future_proj")(future)  # per forecast hour
+    f = layers.Flatten(name="flatten")(f)
+    z = layers.Concatenate(name="concat")([h, f])
+    z = layers.Dense(64, activation="relu", name="hidden")(z)
+    out = layers.Dense(horizon, name="out")(z)
+    model = keras.Model(inputs={"past": past, "future": future}, outputs=out)
+    model.compile(optimizer=keras.optimizers.Adam(1e-3), loss="mse")
+    return model
+
+
+def export_weights(model) -> dict:
+    """Keras layers -> the float32 arrays forward() uses."""
+    lstm = model.get_layer("lstm").get_weights()
+    out = {"lstm_kernel": lstm[0], "lstm_recurrent": lstm[1], "lstm_bias": lstm[2]}
+    for name in ("future", "hidden", "out"):
+        kernel, bias = model.get_layer("future_proj" if name == "future" else name).get_weights()
+        out[f"{name}_kernel"], out[f"{name}_bias"] = kernel, bias
+    return {k: np.asarray(v, dtype=np.float32) for k, v in out.items()}
+
+
+def _batches(past_w, future_w, y_w, idx: np.ndarray, batch_size: int, shuffle: bool, seed: int = 42):
+    """Yields ({"past", "future"}, y) batches gathered from the window views (one batch copied at a time)."""
+    rng = np.random.default_rng(seed)
+
+    def gen():
+        order = rng.permutation(idx) if shuffle else idx
+        for s in range(0, len(order), batch_size):
+            b = order[s:s + batch_size]
+            yield {"past": past_w[b], "future": future_w[b]}, y_w[b]
+
+    return gen
+
+
+def train_lstm(city: str, df_pm25: pd.DataFrame, df_weather: pd.DataFrame, seq_len: int = SEQ_LEN, horizon: int = HORIZON,
+               epochs: int = EPOCHS, batch_size: int = BATCH_SIZE) -> dict:
+    """Trains the LSTM engine for `city` and saves it as the city's "lstm" bundle. Needs tensorflow."""
+    try:
+        import tensorflow as tf
+        from tensorflow import keras
+    except ImportError:
+        raise RuntimeError("tensorflow is required to train the LSTM engine (pip install tensorflow)")
+
+    from app.utils.preprocess import merge_pm25_weather, MASK_COLUMNS
+    from app.utils.resample import MAX_GAP_HOURS
+    from app.ml.model import save_bundle, accuracy_from_mae
+
+    t0 = time.perf_counter()
+    merged = merge_pm25_weather(df_pm25, df_weather)
+    if merged is None or merged.empty:
+        raise ValueError("Merged data is empty")
+    weather_cols = [c for c in merged.columns if c not in ("datetime", "pm25", *MASK_COLUMNS)]
+
+    # chronological split; standardization stats from the training part only
+    n_hours = len(merged)
+    split_hour = int(n_hours * 0.8)
+    train_part = merged.iloc[:split_hour]
+    train_weather = train_part[weather_cols].to_numpy(dtype=np.float64)
+    weather_std = np.nanstd(train_weather, axis=0)
+    stats = {
+        "pm25_mean": float(np.nanmean(train_part["pm25"])),
+        "pm25_std": float(np.nanstd(train_part["pm25"])) or 1.0,
+        "weather_mean": np.nanmean(train_weather, axis=0),
+        "weather_std": np.where(weather_std > 0, weather_std, 1.0),
+    }
+
+    past, future, target = build_arrays(merged, weather_cols, stats)
+    past_w, future_w, y_w, valid = make_windows(past, future, target, seq_len, horizon)
+    # a sample belongs to validation once its targets reach into the last 20% of hours
+    train_idx = valid[valid + seq_len + horizon <= split_hour]
+    val_idx = valid[valid + seq_len >= split_hour]
+    if len(train_idx) < batch_size or len(val_idx) == 0:
+        raise ValueError(f"Not enough contiguous history to train the LSTM for {city} "
+                         f"({len(train_idx)} train / {len(val_idx)} val windows of {seq_len}+{horizon}h)")
+
+    signature = (
+        {"past": tf.TensorSpec((None, seq_len, past.shape[1]), tf.float32),
+         "future": tf.TensorSpec((None, horizon, future.shape[1]), tf.float32)},
+        tf.TensorSpec((None, horizon), tf.float32),
+    )
+    train_ds = tf.data.Dataset.from_generator(_batches(past_w, future_w, y_w, train_idx, batch_size, True), output_signature=signature).prefetch(2)
+    val_ds = tf.data.Dataset.from_generator(_batches(past_w, future_w, y_w, val_idx, batch_size, False), output_signature=signature).prefetch(2)
+
+    model = build_keras_model(seq_len, horizon, past.shape[1], future.shape[1])
+    stop = keras.callbacks.EarlyStopping(monitor="val_loss", patience=5, restore_best_weights=True)
+    history = model.fit(train_ds, validation_data=val_ds, epochs=epochs, callbacks=[stop], verbose=0)
+
+    weights = export_weights(model)
+
+    # validation error in pm25 units with the exported NumPy network (what serving runs)
+    z = np.concatenate([forward(weights, past_w[b], future_w[b]) for b in np.array_split(val_idx, max(1, len(val_idx) // 256))])
+    pred = z * stats["pm25_std"] + stats["pm25_mean"]
+    actual = y_w[val_idx] * stats["pm25_std"] + stats["pm25_mean"]
+    err = pred - actual
+    keras_z = model.predict({"past": past_w[val_idx[:64]], "future": future_w[val_idx[:64]]}, verbose=0)
+    export_diff = float(np.abs(keras_z - z[:64]).max())
+
+    bundle = {
+        "engine": ENGINE,
+        "weights": weights,
+        "stats": stats,
+        "weather_cols": weather_cols,
+        "seq_len": seq_len,
+        "horizon": horizon,
+        "max_gap": MAX_GAP_HOURS,
+        "trained_at": datetime.utcnow().isoformat(),
+    }
+    mae = float(np.abs(err).mean())
+    metrics = {
+        "status": "trained",
+        "engine": ENGINE,
+        "city": city,
+        "train_windows": int(len(train_idx)),
+        "val_windows": int(len(val_idx)),
+        "epochs": len(history.history.get("loss", [])),
+        "MAE": round(mae, 4),
+        "MAE_1h": round(float(np.abs(err[:, 0]).mean()), 4),
+        "RMSE": round(float(np.sqrt((err ** 2).mean())), 4),
+        "accuracy_percent": round(accuracy_from_mae(mae, float(actual.mean())), 2),
+        "residual_std_by_step": [round(float(s), 4) for s in err.std(axis=0, ddof=1)],
+        "export_max_abs_diff": round(export_diff, 6),
+        "seq_len": seq_len,
+        "horizon": horizon,
+        "train_seconds": round(time.perf_counter() - t0, 2),
+        "trained_at": bundle["trained_at"],
+    }
+    save_bundle(city, bundle, metrics, variant=ENGINE)
+    return metrics
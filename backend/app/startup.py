@@ -0,0 +1,188 @@
+# app/startup.py
+"""
+Startup tooling for BreatheBetter.
+- warm_start(): preload heavy modules, font caches, model bundles and compiled predictors
+  in a parent process, then freeze the GC so forked workers share them copy-on-write
+- profile: import-time profile of app.main (python -X importtime)
+- ttfr: time-to-first-response of a fresh server, lazy (uvicorn) or preload-then-fork (gunicorn)
+
+    python -m app.startup profile --top 20
+    python -m app.startup ttfr
+    python -m app.startup ttfr --preload --workers 2
+"""
+
+import gc
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+from pathlib import Path
+
+import httpx
+
+from app.utils.logging_utils import get_logger
+
+log = get_logger(__name__)
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+# -----------------------
+# Preload
+# -----------------------
+def warm_start() -> dict:
+    """Imports and loads everything a worker would otherwise do on its first requests."""
+    t0 = time.perf_counter()
+    timings = {}
+
+    def _step(name, fn):
+        t = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:
+            log.error("Warm start step failed", extra={"step": name, "error": str(e)})
+        timings[name] = round(time.perf_counter() - t, 3)
+
+    def _ml_modules():
+        import sklearn.ensemble  # noqa: F401
+        import sklearn.linear_model  # noqa: F401
+        import sklearn.preprocessing  # noqa: F401
+        from app.ml.model import get_xgb_regressor
+        get_xgb_regressor()
+
+    def _matplotlib():
+        import matplotlib
+        matplotlib.use("Agg")
+        from matplotlib import font_manager
+        font_manager.fontManager.findfont("DejaVu Sans")  # builds / loads the font cache
+
+    def _bundles():
+        from app.ml.model import load_model
+        from app.ml.inference import get_predictor
+        from app.utils.locations import CITY_COORDS
+        from app.ml.global_model import MODEL_MODE, GLOBAL_KEY
+
+        keys = [GLOBAL_KEY] if MODEL_MODE == "global" else list(CITY_COORDS)
+        for key in keys:
+            bundle, _, _ = load_model(key)
+            if bundle is not None:
+                get_predictor(bundle)
+
+    _step("ml_modules", _ml_modules)
+    _step("matplotlib", _matplotlib)
+    _step("bundles", _bundles)
+
+    # everything allocated so far is long-lived: keep the collector from touching (and un-sharing) those pages
+    gc.collect()
+    gc.freeze()
+
+    timings["total"] = round(time.perf_counter() - t0, 3)
+    log.info("Warm start done", extra={"timings": timings})
+    return timings
+
+
+# -----------------------
+# Import-time profile
+# -----------------------
+def import_profile(module: str = "app.main", top: int = 20) -> dict:
+    """Runs `python -X importtime -c 'import module'` and returns the slowest imports by cumulative time."""
+    env = dict(os.environ, PYTHONPATH=str(BACKEND_DIR))
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=BACKEND_DIR, env=env, capture_output=True, text=True)
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cum_us, name = line[len("import time:"):].split("|", 2)
+        # one space after the bar, then two per nesting level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append({"module": name.strip(), "self_ms": int(self_us) / 1000, "cumulative_ms": int(cum_us) / 1000, "depth": depth})
+
+    total = next((r["cumulative_ms"] for r in rows if r["module"] == module), None)
+    top_level = sorted((r for r in rows if r["depth"] <= 1), key=lambda r: -r["cumulative_ms"])[:top]
+    return {"module": module, "total_ms": total, "top": top_level}
+
+
+# -----------------------
+# Time to first response
+# -----------------------
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_to_first_response(preload: bool = False, workers: int = 1, path: str = "/", timeout: float = 120.0) -> dict:
+    """Starts a fresh server and measures the wall time until `path` first answers."""
+    port = _free_port()
+    if preload:
+        cmd = [sys.executable, "-m", "gunicorn", "-c", str(BACKEND_DIR / "gunicorn.conf.py"),
+               "--bind", f"127.0.0.1:{port}", "--workers", str(workers), "app.main:app"]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--workers", str(workers)]
+
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        first = None
+        while time.perf_counter() - t0 < timeout:
+            try:
+                r = httpx.get(f"http://127.0.0.1:{port}{path}", timeout=5.0)
+                if r.status_code < 500:
+                    first = time.perf_counter() - t0
+                    break
+            except httpx.HTTPError:
+                time.sleep(0.05)
+
+        # a second request shows the steady-state latency once the worker is warm
+        t1 = time.perf_counter()
+        if first is not None:
+            httpx.get(f"http://127.0.0.1:{port}{path}", timeout=30.0)
+        warm = time.perf_counter() - t1
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+    return {
+        "mode": "preload" if preload else "lazy",
+        "workers": workers,
+        "path": path,
+        "time_to_first_response_s": round(first, 3) if first is not None else None,
+        "second_request_s": round(warm, 4) if first is not None else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="BreatheBetter startup tooling.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_prof = sub.add_parser("profile", help="import-time profile of app.main")
+    p_prof.add_argument("--module", default="app.main")
+    p_prof.add_argument("--top", type=int, default=20)
+
+    p_ttfr = sub.add_parser("ttfr", help="time to first response of a fresh server")
+    p_ttfr.add_argument("--preload", action="store_true", help="gunicorn preload-then-fork instead of plain uvicorn")
+    p_ttfr.add_argument("--workers", type=int, default=1)
+    p_ttfr.add_argument("--path", default="/")
+
+    sub.add_parser("warm", help="run warm_start() once and print its timings")
+
+    args = parser.parse_args(argv)
+    if args.cmd == "profile":
+        report = import_profile(args.module, args.top)
+    elif args.cmd == "ttfr":
+        report = time_to_first_response(args.preload, args.workers, args.path)
+    else:
+        report = warm_start()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
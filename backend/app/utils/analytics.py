@@ -0,0 +1,408 @@
+# app/utils/analytics.py
+"""
+Pre-aggregated PM2.5 rollups per city for long-range analytics.
+- hourly values are kept as one dense float32 column indexed by epoch hour (NaN = missing)
+- day / week (Monday) / month rollups keep count, sum, sumsq, min, max, fixed percentiles and a
+  t-digest per bucket; ingest() recomputes only the buckets whose hours changed, so re-ingesting
+  the same data is a no-op
+- queries slice the arrays: per-bucket rows come straight from the rollups, range percentiles
+  merge the digests of the fewest months / days / hours that cover the range
+
+Data arrives from fetch_history (registered as a listener; observed hours only) and from the local
+Parquet dataset, whose partitions are re-read when their mtime changes.
+"""
+
+import time
+import threading
+
+import numpy as np
+import pandas as pd
+
+from app.utils.dataset import list_partitions
+
+GRANULARITIES = ["hour", "day", "week", "month"]
+ROLLUP_QUANTILES = [0.5, 0.9, 0.99]
+TDIGEST_COMPRESSION = 100
+
+NS_PER_HOUR = 3_600_000_000_000
+
+
+# -----------------------
+# t-digest
+# -----------------------
+class TDigest:
+    """Merging t-digest (k1 scale): at most ~compression/2 centroids, mergeable across buckets."""
+    __slots__ = ("means", "weights")
+
+    def __init__(self, means=None, weights=None):
+        self.means = np.asarray(means if means is not None else [], dtype=np.float64)
+        self.weights = np.asarray(weights if weights is not None else [], dtype=np.float64)
+
+    @classmethod
+    def from_values(cls, values, compression: int = TDIGEST_COMPRESSION):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        return cls._compress(values, np.ones(len(values)), compression)
+
+    @classmethod
+    def merge(cls, digests, compression: int = TDIGEST_COMPRESSION):
+        digests = [d for d in digests if len(d.means)]
+        if not digests:
+            return cls()
+        means = np.concatenate([d.means for d in digests])
+        weights = np.concatenate([d.weights for d in digests])
+        return cls._compress(means, weights, compression)
+
+    @classmethod
+    def _compress(cls, means, weights, compression):
+        if len(means) == 0:
+            return cls()
+        order = np.argsort(means, kind="stable")
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        q_left = (np.cumsum(weights) - weights) / total
+        # k1 scale: fine clusters near the tails, coarse in the middle
+        k = compression / (2 * np.pi) * np.arcsin(np.clip(2 * q_left - 1, -1, 1))
+        group = np.floor(k - k[0]).astype(np.int64)
+        group = np.unique(group, return_inverse=True)[1]
+        w = np.bincount(group, weights=weights)
+        m = np.bincount(group, weights=weights * means) / w
+        return cls(m, w)
+
+    def quantile(self, q: float) -> float:
+        if len(self.means) == 0:
+            return float("nan")
+        if len(self.means) == 1:
+            return float(self.means[0])
+        centers = np.cumsum(self.weights) - self.weights / 2
+        return float(np.interp(q * self.weights.sum(), centers, self.means))
+
+
+# -----------------------
+# Calendar buckets (epoch hours -> bucket ids)
+# -----------------------
+def bucket_ids(hours: np.ndarray, granularity: str) -> np.ndarray:
+    hours = np.asarray(hours, dtype=np.int64)
+    if granularity == "hour":
+        return hours
+    if granularity == "day":
+        return hours // 24
+    if granularity == "week":
+        return (hours // 24 + 3) // 7  # 1970-01-01 was a Thursday; weeks start on Monday
+    if granularity == "month":
+        return hours.astype("datetime64[h]").astype("datetime64[M]").astype(np.int64)
+    raise ValueError(f"Unknown granularity: {granularity}")
+
+
+def bucket_start(ids: np.ndarray, granularity: str) -> np.ndarray:
+    """First epoch hour of each bucket."""
+    ids = np.asarray(ids, dtype=np.int64)
+    if granularity == "hour":
+        return ids
+    if granularity == "day":
+        return ids * 24
+    if granularity == "week":
+        return (ids * 7 - 3) * 24
+    return ids.astype("datetime64[M]").astype("datetime64[h]").astype(np.int64)
+
+
+class Rollup:
+    """Dense per-bucket aggregates for one granularity, from bucket id `origin` onwards."""
+
+    def __init__(self, granularity: str):
+        self.granularity = granularity
+        self.origin = None
+        self.count = np.zeros(0, dtype=np.int32)
+        self.sum = np.zeros(0)
+        self.sumsq = np.zeros(0)
+        self.min = np.zeros(0, dtype=np.float32)
+        self.max = np.zeros(0, dtype=np.float32)
+        self.quantiles = np.zeros((0, len(ROLLUP_QUANTILES)), dtype=np.float32)
+        self.digests = []
+
+    def _extend(self, lo: int, hi: int):
+        """Makes bucket ids [lo, hi] addressable."""
+        if self.origin is None:
+            self.origin = lo
+        new_origin = min(self.origin, lo)
+        before = self.origin - new_origin
+        after = max(0, hi - (self.origin + len(self.count) - 1))
+        if before or after:
+            pad = (before, after)
+            self.count = np.pad(self.count, pad)
+            self.sum = np.pad(self.sum, pad)
+            self.sumsq = np.pad(self.sumsq, pad)
+            self.min = np.pad(self.min, pad, constant_values=np.nan)
+            self.max = np.pad(self.max, pad, constant_values=np.nan)
+            self.quantiles = np.pad(self.quantiles, (pad, (0, 0)), constant_values=np.nan)
+            self.digests = [TDigest() for _ in range(before)] + self.digests + [TDigest() for _ in range(after)]
+            self.origin = new_origin
+
+    def recompute(self, ids: np.ndarray, store: "CityStore"):
+        if len(ids) == 0:
+            return
+        self._extend(int(ids.min()), int(ids.max()))
+        starts = bucket_start(ids, self.granularity)
+        ends = bucket_start(ids + 1, self.granularity)
+        for bid, s, e in zip(ids, starts, ends):
+            vals = store.slice(int(s), int(e))
+            vals = vals[~np.isnan(vals)].astype(np.float64)
+            i = int(bid) - self.origin
+            self.count[i] = len(vals)
+            if len(vals) == 0:
+                self.sum[i] = self.sumsq[i] = 0.0
+                self.min[i] = self.max[i] = np.nan
+                self.quantiles[i] = np.nan
+                self.digests[i] = TDigest()
+                continue
+            self.sum[i] = vals.sum()
+            self.sumsq[i] = (vals ** 2).sum()
+            self.min[i] = vals.min()
+            self.max[i] = vals.max()
+            self.quantiles[i] = np.quantile(vals, ROLLUP_QUANTILES)
+            self.digests[i] = TDigest.from_values(vals)
+
+    def window(self, lo: int, hi: int):
+        """Index range of bucket ids [lo, hi) in the arrays (clipped)."""
+        if self.origin is None:
+            return 0, 0
+        a = max(lo - self.origin, 0)
+        b = min(hi - self.origin, len(self.count))
+        return a, max(a, b)
+
+
+# -----------------------
+# Per-city store
+# -----------------------
+class CityStore:
+
+    def __init__(self):
+        self.origin = None  # epoch hour of values[0]
+        self.values = np.zeros(0, dtype=np.float32)
+        self.rollups = {g: Rollup(g) for g in GRANULARITIES if g != "hour"}
+        self.partition_mtimes = {}
+
+    def slice(self, start: int, end: int) -> np.ndarray:
+        """Hourly values for epoch hours [start, end), NaN-padded outside the stored range."""
+        out = np.full(max(0, end - start), np.nan, dtype=np.float32)
+        if self.origin is None or end <= start:
+            return out
+        a, b = max(start, self.origin), min(end, self.origin + len(self.values))
+        if a < b:
+            out[a - start:b - start] = self.values[a - self.origin:b - self.origin]
+        return out
+
+    def ingest(self, hours: np.ndarray, vals: np.ndarray) -> int:
+        """Writes hourly values (last one wins per hour) and refreshes the affected buckets. Returns hours changed."""
+        if len(hours) == 0:
+            return 0
+        hours = np.asarray(hours, dtype=np.int64)
+        vals = np.asarray(vals, dtype=np.float32)
+        # keep the last value per hour
+        rev_unique = np.unique(hours[::-1], return_index=True)[1]
+        keep = len(hours) - 1 - rev_unique
+        hours, vals = hours[keep], vals[keep]
+
+        lo, hi = int(hours.min()), int(hours.max()) + 1
+        if self.origin is None:
+            self.origin = lo
+            self.values = np.full(hi - lo, np.nan, dtype=np.float32)
+        else:
+            before = max(0, self.origin - lo)
+            after = max(0, hi - (self.origin + len(self.values)))
+            if before or after:
+                self.values = np.pad(self.values, (before, after), constant_values=np.nan)
+                self.origin -= before
+
+        idx = hours - self.origin
+        old = self.values[idx]
+        changed = ~((old == vals) | (np.isnan(old) & np.isnan(vals)))
+        if not changed.any():
+            return 0
+        self.values[idx[changed]] = vals[changed]
+
+        changed_hours = hours[changed]
+        for g, rollup in self.rollups.items():
+            rollup.recompute(np.unique(bucket_ids(changed_hours, g)), self)
+        return int(changed.sum())
+
+    def covering_digest(self, start: int, end: int) -> TDigest:
+        """Digest of [start, end) from whole months, then whole days, then raw hours at the edges."""
+        parts = []
+        pending = [(start, end)]
+        for g in ("month", "day"):
+            rollup = self.rollups[g]
+            rest = []
+            for s, e in pending:
+                first = int(bucket_ids(np.array([s]), g)[0])
+                if bucket_start(np.array([first]), g)[0] < s:
+                    first += 1
+                last = int(bucket_ids(np.array([e]), g)[0])  # exclusive: the bucket containing `e` is not whole
+                if first >= last:
+                    rest.append((s, e))
+                    continue
+                a, b = rollup.window(first, last)
+                parts.extend(rollup.digests[a:b])
+                inner_s = int(bucket_start(np.array([first]), g)[0])
+                inner_e = int(bucket_start(np.array([last]), g)[0])
+                rest.extend(r for r in ((s, inner_s), (inner_e, e)) if r[0] < r[1])
+            pending = rest
+        for s, e in pending:
+            parts.append(TDigest.from_values(self.slice(s, e)))
+        return TDigest.merge(parts)
+
+
+# -----------------------
+# Store
+# -----------------------
+class AnalyticsStore:
+
+    def __init__(self):
+        self.cities = {}
+        self.lock = threading.Lock()
+
+    def _city(self, city: str) -> CityStore:
+        store = self.cities.get(city)
+        if store is None:
+            store = self.cities[city] = CityStore()
+        return store
+
+    def ingest(self, city: str, df: pd.DataFrame) -> int:
+        """
+        Adds (datetime, pm25) rows up to the current hour; later rows (the forecast days fetch_history
+        ends with) are not observations and are dropped. Safe to call with overlapping or repeated data.
+        """
+        if df is None or df.empty or "pm25" not in df.columns:
+            return 0
+        dt = pd.to_datetime(df["datetime"], utc=True)
+        hours = (dt.astype("int64") // NS_PER_HOUR).to_numpy()
+        vals = pd.to_numeric(df["pm25"], errors="coerce").to_numpy(dtype=np.float32)
+        past = hours <= int(time.time()) // 3600
+        hours, vals = hours[past], vals[past]
+        with self.lock:
+            return self._city(city).ingest(hours, vals)
+
+    def sync_dataset(self, city: str) -> int:
+        """Ingests local Parquet partitions that are new or changed since the last sync."""
+        store = self._city(city)
+        changed = 0
+        for year, month, path in list_partitions(city):
+            try:
+                mtime = path.stat().st_mtime_ns
+            except OSError:
+                continue
+            if store.partition_mtimes.get(path) == mtime:
+                continue
+            df = pd.read_parquet(path, columns=["datetime", "pm25"])
+            changed += self.ingest(city, df)
+            store.partition_mtimes[path] = mtime
+        return changed
+
+    def query(self, city: str, granularity: str = "day", start=None, end=None, percentiles: list = None) -> dict:
+        t0 = time.perf_counter()
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"granularity must be one of {GRANULARITIES}")
+        percentiles = percentiles or [50, 90, 99]
+
+        with self.lock:
+            store = self._city(city)
+            if store.origin is None:
+                return {"city": city, "granularity": granularity, "buckets": [], "summary": {"count": 0}}
+
+            data_end = store.origin + len(store.values)
+            s = store.origin if start is None else _epoch_hour(start)
+            e = data_end if end is None else _epoch_hour(end)
+            s, e = max(s, store.origin), min(e, data_end)  # nothing is stored outside
+            if e <= s:
+                return {"city": city, "granularity": granularity, "buckets": [], "summary": {"count": 0}}
+            # align to whole buckets
+            lo = int(bucket_ids(np.array([s]), granularity)[0])
+            hi = int(bucket_ids(np.array([max(s, e - 1)]), granularity)[0]) + 1
+            s, e = int(bucket_start(np.array([lo]), granularity)[0]), int(bucket_start(np.array([hi]), granularity)[0])
+
+            values = store.slice(s, e)
+            buckets = self._buckets(store, granularity, lo, hi, values, s)
+            summary = self._summary(values)
+            digest = store.covering_digest(s, e)
+            summary["percentiles"] = {f"p{p:g}": _round(digest.quantile(p / 100)) for p in percentiles}
+            diurnal = self._diurnal(values, s)
+
+        return {
+            "city": city,
+            "granularity": granularity,
+            "from": str(pd.Timestamp(s * NS_PER_HOUR, tz="UTC")),
+            "to": str(pd.Timestamp(e * NS_PER_HOUR, tz="UTC")),
+            "summary": summary,
+            "diurnal": diurnal,
+            "buckets": buckets,
+            "elapsed_ms": round((time.perf_counter() - t0) * 1000, 2),
+        }
+
+    @staticmethod
+    def _buckets(store: CityStore, granularity: str, lo: int, hi: int, values: np.ndarray, s: int) -> list:
+        if granularity == "hour":
+            keep = np.flatnonzero(~np.isnan(values))
+            columns = {"count": np.ones(len(keep), dtype=np.int64), "mean": values[keep]}
+            ids = s + keep
+        else:
+            r = store.rollups[granularity]
+            a, b = r.window(lo, hi)
+            count = r.count[a:b]
+            keep = np.flatnonzero(count > 0)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean = r.sum[a:b] / count
+                std = np.sqrt(np.maximum(r.sumsq[a:b] / count - mean ** 2, 0.0))
+            columns = {"count": count[keep], "mean": mean[keep], "std": std[keep],
+                       "min": r.min[a:b][keep], "max": r.max[a:b][keep]}
+            for j, q in enumerate(ROLLUP_QUANTILES):
+                columns[f"p{int(q * 100)}"] = r.quantiles[a:b, j][keep]
+            ids = r.origin + a + keep
+
+        # column-wise rounding and conversion; rows are only zipped together at the end
+        starts = np.datetime_as_string(bucket_start(ids, granularity).astype("datetime64[h]"), unit="s")
+        lists = {"start": [f"{t}Z" for t in starts]}
+        for name, col in columns.items():
+            lists[name] = col.tolist() if name == "count" else np.round(col.astype(np.float64), 3).tolist()
+        names = list(lists)
+        return [dict(zip(names, row)) for row in zip(*lists.values())]
+
+    @staticmethod
+    def _summary(values: np.ndarray) -> dict:
+        v = values[~np.isnan(values)].astype(np.float64)
+        if len(v) == 0:
+            return {"count": 0}
+        return {"count": int(len(v)), "mean": _round(v.mean()), "std": _round(v.std()),
+                "min": _round(v.min()), "max": _round(v.max())}
+
+    @staticmethod
+    def _diurnal(values: np.ndarray, s: int) -> list:
+        ok = ~np.isnan(values)
+        hod = (np.arange(s, s + len(values)) % 24)[ok]
+        counts = np.bincount(hod, minlength=24)
+        sums = np.bincount(hod, weights=values[ok].astype(np.float64), minlength=24)
+        return [{"hour": h, "count": int(counts[h]), "mean": _round(sums[h] / counts[h]) if counts[h] else None} for h in range(24)]
+
+    def status(self) -> dict:
+        with self.lock:
+            return {
+                city: {
+                    "hours": int((~np.isnan(st.values)).sum()),
+                    "from": str(pd.Timestamp(st.origin * NS_PER_HOUR, tz="UTC")) if st.origin is not None else None,
+                    "to": str(pd.Timestamp((st.origin + len(st.values)) * NS_PER_HOUR, tz="UTC")) if st.origin is not None else None,
+                }
+                for city, st in self.cities.items()
+            }
+
+
+def _epoch_hour(value) -> int:
+    ts = pd.Timestamp(value)
+    ts = ts.tz_localize("UTC") if ts.tzinfo is None else ts.tz_convert("UTC")
+    return int(ts.value // NS_PER_HOUR)
+
+
+def _round(x, nd: int = 3):
+    x = float(x)
+    return None if np.isnan(x) else round(x, nd)
+
+
+ANALYTICS = AnalyticsStore()
@@ -0,0 +1,86 @@
+# app/utils/aqi.py
+"""
+US EPA AQI from pollutant concentrations, vectorized over hourly arrays.
+- inputs are Open-Meteo's µg/m³ for every pollutant; gases are converted to the ppb / ppm the
+  EPA breakpoints use (25 °C, 1 atm)
+- each pollutant is averaged over its EPA period first (24 h for particles, 8 h for O3 and CO,
+  1 h for NO2 and SO2) as a trailing mean, so pass some observed hours before a forecast
+- the overall AQI is the highest sub-index; its pollutant is the dominant one
+- O3 above 200 ppb uses the 1-hour table's upper segments on the 8-hour mean, an approximation
+"""
+
+import numpy as np
+
+MOLAR_VOLUME = 24.45  # litres per mole at 25 °C, 1 atm
+
+# pollutant -> averaging hours, µg/m³ -> EPA unit factor, EPA truncation decimals,
+# breakpoints (C_lo, C_hi, I_lo, I_hi) in EPA units
+AQI_TABLES = {
+    "pm25": {"hours": 24, "factor": 1.0, "decimals": 1, "unit": "µg/m³", "table": [
+        (0.0, 9.0, 0, 50), (9.1, 35.4, 51, 100), (35.5, 55.4, 101, 150),
+        (55.5, 125.4, 151, 200), (125.5, 225.4, 201, 300), (225.5, 325.4, 301, 500)]},
+    "pm10": {"hours": 24, "factor": 1.0, "decimals": 0, "unit": "µg/m³", "table": [
+        (0, 54, 0, 50), (55, 154, 51, 100), (155, 254, 101, 150),
+        (255, 354, 151, 200), (355, 424, 201, 300), (425, 604, 301, 500)]},
+    "o3": {"hours": 8, "factor": MOLAR_VOLUME / 48.00, "decimals": 0, "unit": "ppb", "table": [
+        (0, 54, 0, 50), (55, 70, 51, 100), (71, 85, 101, 150),
+        (86, 105, 151, 200), (106, 200, 201, 300), (201, 604, 301, 500)]},
+    "no2": {"hours": 1, "factor": MOLAR_VOLUME / 46.01, "decimals": 0, "unit": "ppb", "table": [
+        (0, 53, 0, 50), (54, 100, 51, 100), (101, 360, 101, 150),
+        (361, 649, 151, 200), (650, 1249, 201, 300), (1250, 2049, 301, 500)]},
+    "so2": {"hours": 1, "factor": MOLAR_VOLUME / 64.07, "decimals": 0, "unit": "ppb", "table": [
+        (0, 35, 0, 50), (36, 75, 51, 100), (76, 185, 101, 150),
+        (186, 304, 151, 200), (305, 604, 201, 300), (605, 1004, 301, 500)]},
+    "co": {"hours": 8, "factor": MOLAR_VOLUME / 28.01 / 1000, "decimals": 1, "unit": "ppm", "table": [
+        (0.0, 4.4, 0, 50), (4.5, 9.4, 51, 100), (9.5, 12.4, 101, 150),
+        (12.5, 15.4, 151, 200), (15.5, 30.4, 201, 300), (30.5, 50.4, 301, 500)]},
+}
+
+
+def trailing_mean(values: np.ndarray, hours: int) -> np.ndarray:
+    """Mean of the last `hours` values at every position (fewer at the start), ignoring NaN."""
+    values = np.asarray(values, dtype=np.float64)
+    if hours <= 1:
+        return values.copy()
+    ok = ~np.isnan(values)
+    sums = np.concatenate(([0.0], np.cumsum(np.where(ok, values, 0.0))))
+    counts = np.concatenate(([0], np.cumsum(ok)))
+    hi = np.arange(1, len(values) + 1)
+    lo = np.maximum(0, hi - hours)
+    n = counts[hi] - counts[lo]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(n > 0, (sums[hi] - sums[lo]) / n, np.nan)
+
+
+def sub_index(pollutant: str, conc: np.ndarray, averaged: bool = False) -> np.ndarray:
+    """AQI sub-index of hourly µg/m³ concentrations (NaN stays NaN). averaged=True skips the trailing mean."""
+    spec = AQI_TABLES[pollutant]
+    c = np.asarray(conc, dtype=np.float64)
+    if not averaged:
+        c = trailing_mean(c, spec["hours"])
+    scale = 10 ** spec["decimals"]
+    c = np.floor(np.clip(c, 0, None) * spec["factor"] * scale) / scale
+
+    table = np.asarray(spec["table"], dtype=np.float64)
+    seg = np.minimum(np.searchsorted(table[:, 1], np.nan_to_num(c), side="left"), len(table) - 1)
+    c_lo, c_hi, i_lo, i_hi = table[seg].T
+    aqi = (i_hi - i_lo) / (c_hi - c_lo) * (np.maximum(c, c_lo) - c_lo) + i_lo
+    aqi = np.where(c > table[-1, 1], 500.0, aqi)  # beyond the index
+    return np.where(np.isnan(c), np.nan, np.round(aqi))
+
+
+def overall_aqi(concentrations: dict, averaged: bool = False):
+    """
+    concentrations: pollutant -> hourly µg/m³ array (same length). Unknown pollutants are ignored.
+    Returns (aqi array, dominant pollutant per hour, {pollutant: sub-index array}).
+    """
+    subs = {p: sub_index(p, c, averaged) for p, c in concentrations.items() if p in AQI_TABLES}
+    if not subs:
+        raise ValueError("No pollutant with an AQI table")
+    names = list(subs)
+    stack = np.vstack([subs[p] for p in names])
+    filled = np.where(np.isnan(stack), -1.0, stack)
+    top = filled.argmax(axis=0)
+    aqi = filled.max(axis=0)
+    dominant = [names[i] if a >= 0 else None for i, a in zip(top, aqi)]
+    return np.where(aqi >= 0, aqi, np.nan), dominant, subs
@@ -0,0 +1,195 @@
+# app/utils/backfill.py
+"""
+Bulk historical backfill for BreatheBetter.
+
+Pulls years of hourly PM2.5 (Open-Meteo air-quality) and weather (Open-Meteo archive)
+per city in month-sized chunks, several chunks in flight at once, and writes each
+month to the local Parquet dataset (see app/utils/dataset.py).
+
+Progress is checkpointed per (city, month), so an interrupted run resumes where it stopped:
+
+    python -m app.utils.backfill --start 2023-01-01 --workers 4
+    python -m app.utils.backfill --cities Delhi Mumbai --start 2022-08-01 --end 2024-12-31
+"""
+
+import json
+import time
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+import pandas as pd
+
+from app.utils.locations import CITY_COORDS
+from app.utils.history_utils import AIR_QUALITY_URL
+from app.utils.weather_utils import ARCHIVE_URL, HOURLY_VARS, hourly_to_frame
+from app.utils.dataset import DATASET_DIR, city_slug, write_partition
+
+CHECKPOINT_PATH = DATASET_DIR / "_checkpoint.json"
+MAX_RETRIES = 5
+
+
+# -----------------------
+# Checkpoint
+# -----------------------
+class Checkpoint:
+    """Thread-safe record of finished (city, month) chunks, saved atomically after each update."""
+
+    def __init__(self, path=CHECKPOINT_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done = {}
+        if path.exists():
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.done = json.load(f)
+            except Exception:
+                self.done = {}
+
+    @staticmethod
+    def key(city: str, year: int, month: int) -> str:
+        return f"{city_slug(city)}/{year:04d}-{month:02d}"
+
+    def is_done(self, city: str, year: int, month: int) -> bool:
+        entry = self.done.get(self.key(city, year, month))
+        # partial months (the current one) are always refetched
+        return bool(entry) and not entry.get("partial", False)
+
+    def mark(self, city: str, year: int, month: int, rows: int, partial: bool):
+        with self.lock:
+            self.done[self.key(city, year, month)] = {
+                "rows": rows,
+                "partial": partial,
+                "fetched_at": datetime.utcnow().isoformat(),
+            }
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(".json.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.done, f, indent=2, sort_keys=True)
+            tmp.replace(self.path)
+
+
+# -----------------------
+# Chunking + fetching
+# -----------------------
+def month_chunks(start: pd.Timestamp, end: pd.Timestamp) -> list:
+    """Splits [start, end] into [(year, month, chunk_start, chunk_end)] by calendar month."""
+    chunks = []
+    cur = start.normalize().replace(day=1)
+    while cur <= end:
+        nxt = cur + pd.offsets.MonthBegin(1)
+        chunk_start = max(cur, start.normalize())
+        chunk_end = min(nxt - pd.Timedelta(days=1), end.normalize())
+        chunks.append((cur.year, cur.month, chunk_start, chunk_end))
+        cur = nxt
+    return chunks
+
+
+def _get_json(session: requests.Session, url: str, params: dict) -> dict:
+    """GET with exponential backoff on network errors, 429 and 5xx."""
+    delay = 1.0
+    for attempt in range(MAX_RETRIES):
+        try:
+            r = session.get(url, params=params, timeout=60)
+            if r.status_code == 429 or r.status_code >= 500:
+                raise requests.HTTPError(f"HTTP {r.status_code}", response=r)
+            r.raise_for_status()
+            return r.json()
+        except requests.RequestException:
+            if attempt == MAX_RETRIES - 1:
+                raise
+            time.sleep(delay)
+            delay *= 2
+
+
+def fetch_chunk(session: requests.Session, lat: float, lon: float, start: pd.Timestamp, end: pd.Timestamp) -> pd.DataFrame:
+    """Fetches PM2.5 + weather for [start, end] (inclusive dates) and outer-joins them on the hour."""
+    dates = {"start_date": start.strftime("%Y-%m-%d"), "end_date": end.strftime("%Y-%m-%d"), "timezone": "UTC"}
+
+    aq = _get_json(session, AIR_QUALITY_URL, {"latitude": lat, "longitude": lon, "hourly": "pm2_5", **dates})
+    hourly = aq.get("hourly", {})
+    df_pm25 = pd.DataFrame({
+        "datetime": pd.to_datetime(hourly.get("time", []), utc=True),
+        "pm25": hourly.get("pm2_5", []),
+    })
+
+    wx = _get_json(session, ARCHIVE_URL, {"latitude": lat, "longitude": lon, "hourly": ",".join(HOURLY_VARS), **dates})
+    wx_hourly = wx.get("hourly", {})
+    df_weather = hourly_to_frame(wx_hourly) if wx_hourly.get("time") else pd.DataFrame(columns=["datetime"])
+
+    return pd.merge(df_pm25, df_weather, on="datetime", how="outer")
+
+
+# -----------------------
+# Backfill
+# -----------------------
+def backfill(cities: list, start, end=None, workers: int = 4, resume: bool = True) -> dict:
+    """
+    Fetches every (city, month) chunk in [start, end] with `workers` concurrent requests.
+    Returns a summary with per-city row counts and failures.
+    """
+    start = pd.Timestamp(start)
+    end = pd.Timestamp(end) if end is not None else pd.Timestamp.now("UTC").tz_localize(None)
+    today = pd.Timestamp.now("UTC").tz_localize(None).normalize()
+
+    checkpoint = Checkpoint()
+    jobs = []
+    for city in cities:
+        if city not in CITY_COORDS:
+            print(f"❌ Backfill: {city} not supported")
+            continue
+        for year, month, c_start, c_end in month_chunks(start, end):
+            if resume and checkpoint.is_done(city, year, month):
+                continue
+            jobs.append((city, year, month, c_start, c_end))
+
+    print(f"📦 Backfill: {len(jobs)} chunks for {len(cities)} cities ({start.date()} → {end.date()}), {workers} workers")
+
+    summary = {"chunks": len(jobs), "rows": {}, "failed": []}
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount("https://", adapter)
+
+    def run(job):
+        city, year, month, c_start, c_end = job
+        lat, lon = CITY_COORDS[city]
+        df = fetch_chunk(session, lat, lon, c_start, c_end)
+        write_partition(city, year, month, df)
+        checkpoint.mark(city, year, month, rows=len(df), partial=c_end >= today)
+        return len(df)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run, job): job for job in jobs}
+        for fut in as_completed(futures):
+            city, year, month, _, _ = futures[fut]
+            try:
+                rows = fut.result()
+                summary["rows"][city] = summary["rows"].get(city, 0) + rows
+                print(f"✅ {city} {year:04d}-{month:02d}: {rows} rows")
+            except Exception as e:
+                summary["failed"].append(f"{city} {year:04d}-{month:02d}: {e}")
+                print(f"❌ {city} {year:04d}-{month:02d}: {e}")
+
+    summary["seconds"] = round(time.perf_counter() - t0, 2)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backfill hourly PM2.5 + weather into the local Parquet dataset.")
+    parser.add_argument("--cities", nargs="+", default=list(CITY_COORDS), help="Cities to backfill (default: all)")
+    parser.add_argument("--start", required=True, help="First date, YYYY-MM-DD")
+    parser.add_argument("--end", default=None, help="Last date, YYYY-MM-DD (default: today)")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent chunk requests")
+    parser.add_argument("--no-resume", action="store_true", help="Refetch chunks already in the checkpoint")
+    args = parser.parse_args(argv)
+
+    summary = backfill(args.cities, args.start, args.end, workers=args.workers, resume=not args.no_resume)
+    print(json.dumps(summary, indent=2))
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
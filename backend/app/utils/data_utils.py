@@ -99,14 +99,7 @@ def category(aqi):
     return "Hazardous"
 
 # -------------------------------------------------------------------
-# NEW ADDITION FOR THE SPATIAL HEATMAP
-# (This is the part that is missing)
+# SPATIAL HEATMAP BOUNDING BOXES
+# (now derived from the location registry, see app/utils/locations.py)
 # -------------------------------------------------------------------
-CITY_BOUNDING_BOXES = {
-    "Delhi": {"lat_min": 28.4, "lat_max": 28.9, "lon_min": 76.8, "lon_max": 77.4},
-    "Mumbai": {"lat_min": 18.8, "lat_max": 19.3, "lon_min": 72.7, "lon_max": 73.1},
-    "Bengaluru": {"lat_min": 12.8, "lat_max": 13.1, "lon_min": 77.4, "lon_max": 77.8},
-    "Hyderabad": {"lat_min": 17.2, "lat_max": 17.6, "lon_min": 78.2, "lon_max": 78.7},
-    "Chennai": {"lat_min": 12.9, "lat_max": 13.2, "lon_min": 80.1, "lon_max": 80.4},
-    "Kolkata": {"lat_min": 22.4, "lat_max": 22.7, "lon_min": 88.2, "lon_max": 88.5},
-}
\ No newline at end of file
+from app.utils.locations import CITY_BOUNDING_BOXES  # noqa: E402
@@ -0,0 +1,132 @@
+# app/utils/dataset.py
+"""
+Local historical dataset for BreatheBetter.
+- Hourly PM2.5 + weather per city, stored as Parquet partitions:
+    app/data/history/city=<slug>/year=YYYY/month=MM.parquet
+- Written by app/utils/backfill.py, read back one partition at a time so
+  long training windows never need a single multi-year DataFrame.
+"""
+
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+DATASET_DIR = Path(os.environ.get("DATASET_DIR", BASE_DIR / "data" / "history"))
+# a dataset whose newest row is older than this is topped up from the APIs before training
+DATASET_MAX_LAG_HOURS = float(os.environ.get("DATASET_MAX_LAG_HOURS", 48))
+
+PM25_COLUMNS = ["pm25"]
+WEATHER_COLUMNS = ["temp", "humidity", "pressure", "wind", "precipitation"]
+COLUMNS = ["datetime"] + PM25_COLUMNS + WEATHER_COLUMNS
+
+
+def city_slug(city: str) -> str:
+    return city.lower().replace(" ", "_")
+
+
+def _utc(ts):
+    if ts is None:
+        return None
+    ts = pd.Timestamp(ts)
+    return ts.tz_localize("UTC") if ts.tzinfo is None else ts.tz_convert("UTC")
+
+
+def partition_path(city: str, year: int, month: int) -> Path:
+    return DATASET_DIR / f"city={city_slug(city)}" / f"year={year:04d}" / f"month={month:02d}.parquet"
+
+
+def write_partition(city: str, year: int, month: int, df: pd.DataFrame) -> Path:
+    """Writes one month atomically (temp file + rename), measurements as float32."""
+    path = partition_path(city, year, month)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    out = pd.DataFrame({"datetime": pd.to_datetime(df["datetime"], utc=True)})
+    for col in COLUMNS[1:]:
+        values = df[col] if col in df.columns else np.nan
+        out[col] = pd.to_numeric(values, errors="coerce").astype("float32")
+    out = out.sort_values("datetime").drop_duplicates(subset="datetime", keep="last").reset_index(drop=True)
+
+    tmp = path.with_suffix(".parquet.tmp")
+    out.to_parquet(tmp, engine="pyarrow", compression="zstd", index=False)
+    os.replace(tmp, path)
+    return path
+
+
+def list_partitions(city: str) -> list:
+    """Returns sorted [(year, month, path)] for a city."""
+    root = DATASET_DIR / f"city={city_slug(city)}"
+    parts = []
+    for p in root.glob("year=*/month=*.parquet"):
+        try:
+            year = int(p.parent.name.split("=")[1])
+            month = int(p.stem.split("=")[1])
+        except (IndexError, ValueError):
+            continue
+        parts.append((year, month, p))
+    return sorted(parts)
+
+
+def has_dataset(city: str) -> bool:
+    return len(list_partitions(city)) > 0
+
+
+def iter_dataset(city: str, start=None, end=None, columns: list = None):
+    """
+    Yields one DataFrame per monthly partition, in chronological order,
+    clipped to [start, end]. Only `columns` (plus datetime) are read.
+    """
+    start, end = _utc(start), _utc(end)
+
+    read_cols = None
+    if columns is not None:
+        read_cols = ["datetime"] + [c for c in columns if c != "datetime"]
+
+    for year, month, path in list_partitions(city):
+        # partition pruning on the month boundaries
+        month_start = pd.Timestamp(year=year, month=month, day=1, tz="UTC")
+        month_end = month_start + pd.offsets.MonthBegin(1)
+        if start is not None and month_end <= start:
+            continue
+        if end is not None and month_start > end:
+            continue
+
+        df = pd.read_parquet(path, engine="pyarrow", columns=read_cols)
+        if start is not None:
+            df = df[df["datetime"] >= start]
+        if end is not None:
+            df = df[df["datetime"] <= end]
+        if not df.empty:
+            yield df.reset_index(drop=True)
+
+
+def dataset_end(city: str):
+    """Newest stored timestamp (UTC) or None; only the last partition is read."""
+    parts = list_partitions(city)
+    if not parts:
+        return None
+    last = pd.read_parquet(parts[-1][2], engine="pyarrow", columns=["datetime"])
+    return _utc(last["datetime"].max()) if not last.empty else None
+
+
+def read_window(city: str, days: int, end=None):
+    """
+    Returns (df_pm25, df_weather) for the `days` before `end` (default: the newest stored row) from
+    the local dataset, in the same shape as fetch_history / fetch_hourly_weather. Empty frames if
+    nothing is stored there.
+    """
+    end = _utc(end) if end is not None else dataset_end(city)
+    if end is None:
+        return pd.DataFrame(), pd.DataFrame()
+    start = end - pd.Timedelta(days=days)
+
+    chunks = list(iter_dataset(city, start=start, end=end))
+    if not chunks:
+        return pd.DataFrame(), pd.DataFrame()
+    df = pd.concat(chunks, ignore_index=True)
+
+    df_pm25 = df[["datetime"] + PM25_COLUMNS].dropna().reset_index(drop=True)
+    df_weather = df[["datetime"] + WEATHER_COLUMNS].dropna(how="all", subset=WEATHER_COLUMNS).reset_index(drop=True)
+    return df_pm25, df_weather
@@ -0,0 +1,150 @@
+# app/utils/history_feed.py
+"""
+Per-city PM2.5 history kept between requests, for delta / conditional responses.
+- get(): the latest fetch_history result for a city, refetched only once it is older than
+  HISTORY_TTL (or a longer window is asked for); rows are pre-rendered to JSON-ready records
+- every city has a data version that increases whenever a refetch brings new or changed rows
+  (seeded from the clock, so it keeps increasing across restarts); ETags are built from it
+- peek(): the feed if it is still fresh, without fetching: conditional requests are answered
+  with 304 from this alone, never touching upstream or pandas
+- records cover observed hours only (up to the current hour): Open-Meteo appends forecast days,
+  which would put a client's newest row in the future and leave every delta empty
+- window(): records of the last `days`, or only the ones newer than `since`, via a binary search.
+  A client that says which version it holds gets the full window instead when rows it already has
+  were revised after that version (`revised`), so corrected values are not lost
+
+Versions are per process: behind several workers a client may see a 200 after switching worker.
+"""
+
+import os
+import time
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+
+from app.utils.resample import epoch_hours
+
+HISTORY_TTL = float(os.environ.get("HISTORY_TTL", 300))  # seconds a fetched history is served as current
+
+
+class CityFeed:
+    __slots__ = ("days", "df", "hours", "values", "records", "version", "revised", "fetched_at")
+
+    def __init__(self, days, df, hours, values, records, version, revised, fetched_at):
+        self.days = days
+        self.df = df
+        self.hours = hours          # observed rows only, like records and values
+        self.values = values
+        self.records = records
+        self.version = version
+        self.revised = revised      # last version that changed or dropped an observed row an earlier version had
+        self.fetched_at = fetched_at
+
+    def fresh(self, days: int) -> bool:
+        return self.days >= days and time.monotonic() - self.fetched_at < HISTORY_TTL
+
+
+class HistoryFeed:
+    """`fetch_history(city, days)` is injected so this module stays free of app.main imports."""
+
+    def __init__(self, fetch_history):
+        self.fetch_history = fetch_history
+        self.feeds = {}
+        self.lock = threading.Lock()
+
+    def peek(self, city: str, days: int):
+        feed = self.feeds.get(city)
+        return feed if feed is not None and feed.fresh(days) else None
+
+    def get(self, city: str, days: int):
+        """Fresh feed for `city` covering `days`, refetching if needed. Falls back to a stale feed if upstream fails."""
+        feed = self.peek(city, days)
+        if feed is not None:
+            return feed
+        old = self.feeds.get(city)
+        df = self.fetch_history(city, max(days, old.days if old is not None else 0))
+        if df is None or df.empty:
+            return old
+        return self._update(city, df, max(days, old.days if old is not None else 0))
+
+    def _update(self, city: str, df, days: int) -> CityFeed:
+        dt = df["datetime"]
+        hours = epoch_hours(dt, rounding="floor")
+        values = df["pm25"].to_numpy(dtype=np.float64)
+        observed = hours <= int(time.time()) // 3600
+        obs_hours, obs_values = hours[observed], values[observed]
+
+        with self.lock:
+            old = self.feeds.get(city)
+            unchanged = old is not None and len(old.df) == len(hours) \
+                and np.array_equal(epoch_hours(old.df["datetime"], rounding="floor"), hours) \
+                and np.array_equal(old.df["pm25"].to_numpy(dtype=np.float64), values, equal_nan=True)
+            if unchanged:
+                version = old.version
+            else:
+                now_ms = int(time.time() * 1000)
+                version = max(now_ms, old.version + 1) if old is not None else now_ms
+            if old is not None and _revised(old, obs_hours, obs_values):
+                revised = version
+            else:
+                revised = old.revised if old is not None else version
+            if old is not None and np.array_equal(old.hours, obs_hours) and np.array_equal(old.values, obs_values, equal_nan=True):
+                records = old.records
+            else:
+                records = [{"datetime": ts.isoformat(), "pm25": float(v)} for ts, v in zip(dt[observed], obs_values)]
+            feed = CityFeed(days, df, obs_hours, obs_values, records, version, revised, time.monotonic())
+            self.feeds[city] = feed
+        return feed
+
+    @staticmethod
+    def delta_ok(feed: CityFeed, version: int = None) -> bool:
+        """Whether a client holding `version` can merge a since= delta (nothing it has was revised since)."""
+        return version is None or version >= feed.revised
+
+    @staticmethod
+    def window(feed: CityFeed, days: int, since: str = None) -> list:
+        """Records from the start of the day `days` days ago (UTC, like Open-Meteo's past_days), or after `since`."""
+        today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        start = int(today.timestamp()) // 3600 - days * 24
+        lo = int(np.searchsorted(feed.hours, start, side="left"))
+        if since is not None:
+            lo = max(lo, int(np.searchsorted(feed.hours, since_hour(since), side="right")))
+        return feed.records[lo:]
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        return {city: {"version": f.version, "rows": len(f.records), "days": f.days, "age_seconds": round(now - f.fetched_at, 1)}
+                for city, f in self.feeds.items()}
+
+
+def _revised(old: CityFeed, hours, values) -> bool:
+    """True if an observed row of `old` still inside the new range is missing or has a different value."""
+    if not len(old.hours):
+        return False
+    keep = old.hours >= hours[0] if len(hours) else np.ones(len(old.hours), dtype=bool)
+    common, i_old, i_new = np.intersect1d(old.hours, hours, assume_unique=True, return_indices=True)
+    if len(common) != int(keep.sum()):
+        return True
+    return not np.array_equal(old.values[i_old], values[i_new], equal_nan=True)
+
+
+def since_hour(since: str) -> int:
+    """Epoch hour of an ISO timestamp (naive = UTC). Raises ValueError if it does not parse."""
+    text = since.strip().replace("Z", "+00:00")
+    if "T" in text and " " in text:
+        text = text.replace(" ", "+")  # an unescaped "+00:00" arrives as " 00:00"
+    ts = datetime.fromisoformat(text)
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return int(ts.timestamp()) // 3600
+
+
+def etag(*parts) -> str:
+    return 'W/"' + "-".join(str(p) for p in parts).replace('"', "") + '"'
+
+
+def etag_matches(if_none_match: str, tag: str) -> bool:
+    if not if_none_match:
+        return False
+    return any(t.strip() in (tag, "*", tag[2:]) for t in if_none_match.split(","))
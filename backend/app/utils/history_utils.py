@@ -1,18 +1,32 @@
 # backend/app/utils/history_utils.py
-import requests
 import pandas as pd
 from datetime import datetime
 
-# Coordinates of supported Indian cities
-CITY_COORDS = {
-    "Delhi": (28.7041, 77.1025),
-    "Mumbai": (19.0760, 72.8777),
-    "Bengaluru": (12.9716, 77.5946),
-    "Hyderabad": (17.3850, 78.4867),
-    "Chennai": (13.0827, 80.2707),
-    "Kolkata": (22.5726, 88.3639)
+from app.utils.locations import CITY_COORDS
+from app.utils.upstream import GOVERNOR, UpstreamError
+from app.utils.logging_utils import get_logger, stage
+
+log = get_logger(__name__)
+
+AIR_QUALITY_URL = "https://air-quality-api.open-meteo.com/v1/air-quality"
+# our column name -> Open-Meteo hourly variable
+POLLUTANTS = {
+    "pm25": "pm2_5",
+    "pm10": "pm10",
+    "no2": "nitrogen_dioxide",
+    "o3": "ozone",
+    "so2": "sulphur_dioxide",
+    "co": "carbon_monoxide",
 }
 
+# callables (city, df) notified with every successful city fetch, e.g. the analytics rollups
+_HISTORY_LISTENERS = []
+
+def on_history(fn):
+    """Registers fn(city, df) to be called with each non-empty fetch_history result."""
+    _HISTORY_LISTENERS.append(fn)
+    return fn
+
 def fetch_history(city: str, days: int = 7):
     """
     Fetch historical PM2.5 for the last `days` using Open-Meteo Air Quality API.
@@ -20,48 +34,84 @@ def fetch_history(city: str, days: int = 7):
     """
     # Validate City
     if city not in CITY_COORDS:
-        print(f"❌ History Error: {city} not supported")
+        log.error("History city not supported", extra={"city": city})
         return pd.DataFrame()
 
     lat, lon = CITY_COORDS[city]
-    
+    df = fetch_history_point(lat, lon, days=days, label=city)
+
+    if not df.empty:
+        for fn in _HISTORY_LISTENERS:
+            try:
+                fn(city, df)
+            except Exception as e:
+                log.warning("History listener failed", extra={"city": city, "error": str(e)})
+    return df
+
+def fetch_history_point(lat: float, lon: float, days: int = 7, label: str = None):
+    """
+    Same as fetch_history, but for an arbitrary coordinate (e.g. a registry station).
+    """
+    return _fetch_air_quality(lat, lon, days, label, ["pm25"])
+
+def fetch_pollutants(city: str, days: int = 7):
+    """
+    All POLLUTANTS for the last `days` in one Open-Meteo request (µg/m³, CO included).
+    Returns DataFrame with datetime and one column per pollutant; rows missing some pollutants are kept.
+    """
+    if city not in CITY_COORDS:
+        log.error("History city not supported", extra={"city": city})
+        return pd.DataFrame()
+    lat, lon = CITY_COORDS[city]
+    return fetch_pollutants_point(lat, lon, days=days, label=city)
+
+def fetch_pollutants_point(lat: float, lon: float, days: int = 7, label: str = None):
+    """
+    Same as fetch_pollutants, but for an arbitrary coordinate.
+    """
+    return _fetch_air_quality(lat, lon, days, label, list(POLLUTANTS))
+
+def _fetch_air_quality(lat: float, lon: float, days: int, label: str, pollutants: list):
+    label = label or f"({lat:.4f}, {lon:.4f})"
+
     # Validate Days
     if days < 1: days = 1
     if days > 90: days = 90 # Open-Meteo limit
     
     # API URL
     url = (
-        "https://air-quality-api.open-meteo.com/v1/air-quality"
+        f"{AIR_QUALITY_URL}"
         f"?latitude={lat}"
         f"&longitude={lon}"
-        f"&hourly=pm2_5"
+        f"&hourly={','.join(POLLUTANTS[p] for p in pollutants)}"
         f"&past_days={days}"  # 🔥 Dynamic Days
         f"&timezone=UTC"
     )
 
-    print(f"📡 Fetching History for {city} ({days} days): {url}")
+    log.info("Fetching history", extra={"label": label, "days": days, "url": url})
 
     try:
-        res = requests.get(url, timeout=15).json()
+        with stage("history_fetch"):
+            res = GOVERNOR.get_json("open_meteo", url, timeout=15)
 
-        if "hourly" not in res or "pm2_5" not in res["hourly"]:
-            print(f"❌ Open-Meteo returned no data for {city}")
+        hourly = res.get("hourly", {})
+        if any(POLLUTANTS[p] not in hourly for p in pollutants):
+            log.error("Open-Meteo returned no history data", extra={"label": label})
             return pd.DataFrame()
 
-        times = res["hourly"]["time"]
-        pm25_values = res["hourly"]["pm2_5"]
-
-        df = pd.DataFrame({
-            "datetime": pd.to_datetime(times, utc=True),
-            "pm25": pm25_values
-        })
+        df = pd.DataFrame({"datetime": pd.to_datetime(hourly["time"], utc=True)})
+        for p in pollutants:
+            df[p] = pd.to_numeric(pd.Series(hourly[POLLUTANTS[p]]), errors="coerce")
 
         # Clean data
-        df = df.dropna().sort_values("datetime").reset_index(drop=True)
+        df = df.dropna(how="all", subset=pollutants).sort_values("datetime").reset_index(drop=True)
         
-        print(f"✅ Fetched {len(df)} rows for {city}")
+        log.info("Fetched history", extra={"label": label, "rows": len(df)})
         return df
 
+    except UpstreamError:
+        # already counted and logged by the governor
+        return pd.DataFrame()
     except Exception as e:
-        print(f"❌ History Exception: {e}")
-        return pd.DataFrame()
\ No newline at end of file
+        log.exception("History fetch failed", extra={"label": label})
+        return pd.DataFrame()
@@ -0,0 +1,134 @@
+# app/utils/locations.py
+"""
+Location registry for BreatheBetter.
+- Stations and clusters are loaded from app/data/locations.json (override with LOCATIONS_FILE)
+- A KD-tree over unit-sphere coordinates resolves any (lat, lon) to the nearest station in O(log n)
+- Models are keyed per cluster, so every station in a cluster shares one trained bundle
+
+CITY_COORDS / CITY_BOUNDING_BOXES are derived from the clusters for existing callers.
+"""
+
+import os
+import json
+import math
+from pathlib import Path
+
+import numpy as np
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+LOCATIONS_FILE = Path(os.environ.get("LOCATIONS_FILE", BASE_DIR / "data" / "locations.json"))
+
+EARTH_RADIUS_KM = 6371.0088
+# points further than this from every station are treated as unsupported
+MAX_STATION_DISTANCE_KM = float(os.environ.get("MAX_STATION_DISTANCE_KM", 100))
+
+
+def _to_xyz(lat, lon) -> np.ndarray:
+    """Lat/lon in degrees -> points on the unit sphere (chord distance is monotonic in great-circle distance)."""
+    lat = np.radians(np.asarray(lat, dtype=float))
+    lon = np.radians(np.asarray(lon, dtype=float))
+    cos_lat = np.cos(lat)
+    return np.stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def _chord_to_km(chord: float) -> float:
+    return 2.0 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2.0))
+
+
+# -----------------------
+# KD-tree
+# -----------------------
+class KDTree:
+    """
+    Static 3-d KD-tree stored implicitly in a permuted point array.
+    Node [lo, hi) splits at its median index on axis depth % 3.
+    """
+
+    def __init__(self, points: np.ndarray):
+        self.points = np.asarray(points, dtype=float).reshape(-1, 3)
+        self.index = np.arange(len(self.points))
+        self._build(0, len(self.points), 0)
+
+    def _build(self, lo: int, hi: int, depth: int):
+        if hi - lo <= 1:
+            return
+        axis = depth % 3
+        mid = (lo + hi) // 2
+        order = np.argpartition(self.points[self.index[lo:hi], axis], mid - lo)
+        self.index[lo:hi] = self.index[lo:hi][order]
+        self._build(lo, mid, depth + 1)
+        self._build(mid + 1, hi, depth + 1)
+
+    def query(self, point: np.ndarray):
+        """Returns (original_index, chord_distance) of the nearest point."""
+        if len(self.points) == 0:
+            return None, math.inf
+        best = [None, math.inf]
+        self._query(point, 0, len(self.points), 0, best)
+        return best[0], math.sqrt(best[1])
+
+    def _query(self, point, lo, hi, depth, best):
+        if lo >= hi:
+            return
+        mid = (lo + hi) // 2
+        idx = self.index[mid]
+        node = self.points[idx]
+        d2 = float(((node - point) ** 2).sum())
+        if d2 < best[1]:
+            best[0], best[1] = int(idx), d2
+
+        axis = depth % 3
+        diff = point[axis] - node[axis]
+        near, far = ((lo, mid), (mid + 1, hi)) if diff < 0 else ((mid + 1, hi), (lo, mid))
+        self._query(point, near[0], near[1], depth + 1, best)
+        if diff * diff < best[1]:
+            self._query(point, far[0], far[1], depth + 1, best)
+
+
+# -----------------------
+# Registry
+# -----------------------
+class LocationRegistry:
+    def __init__(self, clusters: dict, stations: list):
+        self.clusters = clusters
+        self.stations = stations
+        self.stations_by_id = {s["id"]: s for s in stations}
+        self.tree = KDTree(_to_xyz([s["lat"] for s in stations], [s["lon"] for s in stations]))
+
+    @classmethod
+    def from_file(cls, path: Path = LOCATIONS_FILE):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        clusters = data.get("clusters", {})
+        stations = data.get("stations", [])
+        for s in stations:
+            if s.get("cluster") not in clusters:
+                raise ValueError(f"Station {s.get('id')} references unknown cluster {s.get('cluster')}")
+        return cls(clusters, stations)
+
+    def nearest(self, lat: float, lon: float, max_km: float = MAX_STATION_DISTANCE_KM):
+        """Returns (station, distance_km) for the closest station, or (None, distance_km) if out of range."""
+        idx, chord = self.tree.query(_to_xyz(lat, lon))
+        if idx is None:
+            return None, math.inf
+        dist_km = _chord_to_km(chord)
+        if max_km is not None and dist_km > max_km:
+            return None, dist_km
+        return self.stations[idx], dist_km
+
+    def cluster_for(self, lat: float, lon: float, max_km: float = MAX_STATION_DISTANCE_KM):
+        station, _ = self.nearest(lat, lon, max_km=max_km)
+        return station["cluster"] if station else None
+
+    def city_coords(self) -> dict:
+        return {name: (c["lat"], c["lon"]) for name, c in self.clusters.items()}
+
+    def bounding_boxes(self) -> dict:
+        return {name: c["bbox"] for name, c in self.clusters.items() if "bbox" in c}
+
+
+REGISTRY = LocationRegistry.from_file()
+
+CITY_COORDS = REGISTRY.city_coords()
+CITY_BOUNDING_BOXES = REGISTRY.bounding_boxes()
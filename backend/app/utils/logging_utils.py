@@ -0,0 +1,300 @@
+# app/utils/logging_utils.py
+"""
+Non-blocking structured logging for the server.
+- every "app.*" logger writes into an in-process queue (QueueHandler); one QueueListener thread
+  formats and writes to stdout, so a request never waits on a contended stdout write. When the
+  queue is full records are dropped (and counted on the next one), never waited for. A forked
+  worker (gunicorn preload) starts its own writer thread
+- records are JSON lines (LOG_FORMAT=text for a terminal) with the request id and any `extra` fields
+- RequestLogMiddleware: request id from X-Request-ID (or a new one), echoed in the response, and one
+  "app.access" record per request with status, duration and the stage() timings taken inside it
+- sampling: LOG_SAMPLE="app.utils.history_utils=0.1,..." keeps 1 in 10 INFO/DEBUG records of that
+  logger (and its children); warnings and errors always pass. Kept records carry sampled=N
+- redaction on the writer thread: key=/token=/appid= style query values, bearer tokens and the
+  literal values of secret environment variables (OWM_API_KEY, ADMIN_TOKEN, LOG_REDACT_ENV)
+
+    log = get_logger(__name__)
+    log.info("Fetched history", extra={"city": city, "rows": n})
+    with stage("weather"): ...
+"""
+
+import os
+import re
+import sys
+import copy
+import json
+import uuid
+import queue
+import atexit
+import logging
+import threading
+from time import perf_counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+LOG_SAMPLE = os.environ.get("LOG_SAMPLE", "app.utils.history_utils=0.1,app.utils.weather_utils=0.1")
+SECRET_ENV = ["OWM_API_KEY", "ADMIN_TOKEN"] + [v for v in os.environ.get("LOG_REDACT_ENV", "").split(",") if v]
+
+ROOT = "app"
+REDACTED = "***"
+
+_request_id = ContextVar("request_id", default=None)
+_stages = ContextVar("stages", default=None)
+
+_SECRET_PARAMS = re.compile(r"(?i)\b(appid|api_?key|key|token|access_token|secret|password)=([^&\s\"']+)")
+_BEARER = re.compile(r"(?i)\bbearer\s+[A-Za-z0-9._~+/=-]+")
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+# attributes every LogRecord has; anything else on a record came in through `extra`
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id", "sampled", "dropped"}
+
+
+def parse_sample(spec: str) -> dict:
+    """"a.b=0.1,c=0.5" -> {"a.b": 10, "c": 2}: keep one record in N."""
+    rates = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, rate = part.partition("=")
+        try:
+            rate = float(rate)
+        except ValueError:
+            continue
+        if 0 < rate < 1:
+            rates[name.strip()] = max(1, round(1 / rate))
+    return rates
+
+
+class Redactor:
+    def __init__(self, secrets=()):
+        self.secrets = sorted({s for s in secrets if s and len(s) >= 4}, key=len, reverse=True)
+
+    def __call__(self, text: str) -> str:
+        for secret in self.secrets:
+            if secret in text:
+                text = text.replace(secret, REDACTED)
+        text = _SECRET_PARAMS.sub(lambda m: f"{m.group(1)}={REDACTED}", text)
+        return _BEARER.sub(f"Bearer {REDACTED}", text)
+
+
+# -----------------------
+# Caller side (request path): tag, sample, enqueue
+# -----------------------
+class ContextFilter(logging.Filter):
+    """Adds the request id and drops sampled-out records before they are queued."""
+
+    def __init__(self, every: dict):
+        super().__init__()
+        self.every = every
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def _rate(self, name: str):
+        while name:
+            n = self.every.get(name)
+            if n is not None:
+                return name, n
+            name = name.rpartition(".")[0]
+        return None, 1
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        if record.levelno >= logging.WARNING or not self.every:
+            return True
+        key, n = self._rate(record.name)
+        if n == 1:
+            return True
+        with self._lock:
+            count = self.counts[key] = self.counts.get(key, 0) + 1
+        if count % n != 1:
+            return False
+        record.sampled = n
+        return True
+
+
+class _QueueHandler(QueueHandler):
+    """Never blocks: a full queue drops the record; prepare() only renders the message."""
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if self.dropped:
+            record.dropped, self.dropped = self.dropped, 0
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+# -----------------------
+# Writer side (listener thread): format, redact, write
+# -----------------------
+class JsonFormatter(logging.Formatter):
+    def __init__(self, redact: Redactor):
+        super().__init__()
+        self.redact = redact
+
+    def fields(self, record: logging.LogRecord) -> dict:
+        out = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", None),
+            "msg": record.msg,
+        }
+        out.update((k, v) for k, v in record.__dict__.items() if k not in _RECORD_FIELDS)
+        for k in ("sampled", "dropped"):
+            if getattr(record, k, None):
+                out[k] = getattr(record, k)
+        if record.exc_text:
+            out["exc"] = record.exc_text
+        return out
+
+    def format(self, record: logging.LogRecord) -> str:
+        return self.redact(json.dumps(self.fields(record), default=str, ensure_ascii=False))
+
+
+class TextFormatter(JsonFormatter):
+    def format(self, record: logging.LogRecord) -> str:
+        f = self.fields(record)
+        head = f"{f.pop('ts')} {f.pop('level'):<7} {f.pop('logger')}"
+        rid = f.pop("request_id")
+        msg = f.pop("msg")
+        exc = f.pop("exc", None)
+        line = f"{head} [{rid}] {msg}" if rid else f"{head} {msg}"
+        if f:
+            line += " " + " ".join(f"{k}={json.dumps(v, default=str, ensure_ascii=False)}" for k, v in f.items())
+        if exc:
+            line += "\n" + exc
+        return self.redact(line)
+
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging(stream=None):
+    """Installs the queue handler on the "app" logger and starts the writer thread (once per process)."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        q = queue.Queue(LOG_QUEUE_SIZE)
+        out = logging.StreamHandler(stream or sys.stdout)
+        formatter = TextFormatter if LOG_FORMAT == "text" else JsonFormatter
+        out.setFormatter(formatter(Redactor(os.environ.get(v) for v in SECRET_ENV)))
+
+        handler = _QueueHandler(q)
+        handler.addFilter(ContextFilter(parse_sample(LOG_SAMPLE)))
+        root = logging.getLogger(ROOT)
+        root.handlers = [handler]
+        root.setLevel(LOG_LEVEL)
+        root.propagate = False
+
+        _listener = QueueListener(q, out, respect_handler_level=False)
+        _listener.start()
+
+
+def stop_logging():
+    """Flushes the queue and stops the writer thread."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def _after_fork_in_child():
+    """A forked child (gunicorn preload) inherits _listener but not its thread: start its own writer."""
+    global _listener, _setup_lock
+    _setup_lock = threading.Lock()
+    if _listener is not None:
+        _listener = None
+        setup_logging()
+
+
+atexit.register(stop_logging)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def get_logger(name: str) -> logging.Logger:
+    setup_logging()
+    return logging.getLogger(name if name == ROOT or name.startswith(ROOT + ".") else f"{ROOT}.{name}")
+
+
+# -----------------------
+# Request context
+# -----------------------
+def request_id():
+    return _request_id.get()
+
+
+@contextmanager
+def stage(name: str):
+    """Adds the block's duration (ms) to the current request's stage timings; a no-op outside a request."""
+    t0 = perf_counter()
+    try:
+        yield
+    finally:
+        stages = _stages.get()
+        if stages is not None:
+            stages[name] = round(stages.get(name, 0.0) + (perf_counter() - t0) * 1000, 2)
+
+
+class RequestLogMiddleware:
+    """Pure ASGI: request id in, X-Request-ID out, one access record per request."""
+
+    def __init__(self, app):
+        self.app = app
+        self.log = get_logger("app.access")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        rid = None
+        for k, v in scope["headers"]:
+            if k == b"x-request-id":
+                rid = v.decode("latin-1").strip()
+                break
+        if not rid or not _REQUEST_ID.match(rid):
+            rid = uuid.uuid4().hex[:16]
+        rid_token = _request_id.set(rid)
+        stages = {}
+        stages_token = _stages.set(stages)
+        status = {"code": 500}
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", rid.encode())]
+            await send(message)
+
+        t0 = perf_counter()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            code = status["code"]
+            self.log.log(logging.ERROR if code >= 500 else logging.INFO, "request", extra={
+                "method": scope.get("method"),
+                "path": scope.get("path"),
+                "query": scope.get("query_string", b"").decode("latin-1") or None,
+                "status": code,
+                "duration_ms": round((perf_counter() - t0) * 1000, 2),
+                "stages": dict(stages),  # background work started here may still add to the live dict
+            })
+            _stages.reset(stages_token)
+            _request_id.reset(rid_token)
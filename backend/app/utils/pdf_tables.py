@@ -0,0 +1,253 @@
+# app/utils/pdf_tables.py
+"""
+Direct PDF writer for the report's table pages (matplotlib only draws the charts).
+- render_tables(): paginates any number of rows and writes each page's content stream by hand:
+  filled rectangles for the header band, table header and zebra rows, one stroked path for the
+  grid and one Tj per cell. No per-cell Python objects, so thousands of rows take milliseconds
+- text is set in the standard Helvetica / Helvetica-Bold fonts (WinAnsi, nothing embedded);
+  centring uses their AFM widths below
+- append_pages(): adds the pages to the PDF matplotlib produced as an incremental update
+  (new objects, a new page tree replacing the old one, an xref section with /Prev), so the chart
+  page is kept byte for byte
+
+    tables = [{"title": "Hourly Data Log", "columns": [...], "widths": [0.25, ...], "rows": [[...], ...]}]
+    pdf = append_pages(pdf, render_tables(("Air Quality Report: Delhi", "Generated on ..."), tables, first_page=2))
+"""
+
+import re
+import zlib
+
+# the report's figures are 8.27 x 11.69 in (A4)
+PAGE_W = 8.27 * 72
+PAGE_H = 11.69 * 72
+
+COLOR_PRIMARY = "#4F46E5"
+COLOR_TEXT = "#111827"
+COLOR_TITLE = "#374151"
+COLOR_MUTED = "#6B7280"
+COLOR_GRID = "#E5E7EB"
+BG_COLOR = "#F9FAFB"
+
+FONT_SIZE = 9
+HEADER_ROW_H = 20.0
+ROW_H = 15.0
+TABLE_X = (0.08, 0.92)          # fractions of the page width, as the matplotlib table's bbox
+TABLE_TOP = 0.80 * PAGE_H
+TABLE_BOTTOM = 0.05 * PAGE_H
+ROWS_PER_PAGE = int((TABLE_TOP - TABLE_BOTTOM - HEADER_ROW_H) // ROW_H)
+CAP_HEIGHT = 0.718  # Helvetica, em fraction
+
+# Helvetica / Helvetica-Bold advance widths (1/1000 em) for WinAnsi codes 32..126 (Adobe AFM)
+_HELVETICA = [
+    278, 278, 355, 556, 556, 889, 667, 222, 333, 333, 389, 584, 278, 333, 278, 278, 556, 556, 556, 556,
+    556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556, 1015, 667, 667, 722, 722, 667, 611, 778,
+    722, 278, 500, 667, 556, 833, 722, 778, 667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278,
+    278, 278, 469, 556, 222, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+_HELVETICA_BOLD = [
+    278, 333, 474, 556, 556, 889, 722, 278, 333, 333, 389, 584, 278, 333, 278, 278, 556, 556, 556, 556,
+    556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611, 975, 722, 722, 722, 722, 667, 611, 778,
+    722, 278, 556, 722, 611, 833, 722, 778, 667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333,
+    278, 333, 584, 556, 278, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+    611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+]
+# a few WinAnsi extras the report uses: bullet, en dash, degree, superscript two, micro
+_EXTRAS = {0x95: (350, 350), 0x96: (556, 556), 0xB0: (400, 400), 0xB2: (333, 333), 0xB5: (556, 611)}
+
+
+def _width_table(base: list, bold: int) -> list:
+    widths = [556] * 256
+    widths[32:127] = base
+    for code, w in _EXTRAS.items():
+        widths[code] = w[bold]
+    return widths
+
+
+FONTS = {
+    b"F1": ("Helvetica", _width_table(_HELVETICA, 0)),
+    b"F2": ("Helvetica-Bold", _width_table(_HELVETICA_BOLD, 1)),
+}
+
+
+def encode(text) -> bytes:
+    return str(text).encode("cp1252", errors="replace")
+
+
+def text_width(data: bytes, font: bytes, size: float) -> float:
+    widths = FONTS[font][1]
+    return sum(widths[b] for b in data) * size / 1000.0
+
+
+def _literal(data: bytes) -> bytes:
+    return b"(" + data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+def _rgb(hex_color: str) -> bytes:
+    h = hex_color.lstrip("#")
+    return b"%.3f %.3f %.3f" % tuple(int(h[i:i + 2], 16) / 255 for i in (0, 2, 4))
+
+
+# -----------------------
+# Page content
+# -----------------------
+def _text(out: list, data: bytes, x: float, y: float):
+    out.append(b"1 0 0 1 %.2f %.2f Tm %s Tj\n" % (x, y, _literal(data)))
+
+
+def _page_header(out: list, title: str, subtitle: str):
+    """Background and the indigo title band of draw_header()."""
+    out.append(_rgb(BG_COLOR) + b" rg 0 0 %.2f %.2f re f\n" % (PAGE_W, PAGE_H))
+    out.append(_rgb(COLOR_PRIMARY) + b" rg 0 %.2f %.2f %.2f re f\n" % (0.88 * PAGE_H, PAGE_W, 0.12 * PAGE_H))
+    out.append(b"BT 1 1 1 rg /F2 22 Tf\n")
+    _text(out, encode(title), 0.05 * PAGE_W, 0.94 * PAGE_H - 22 * CAP_HEIGHT / 2)
+    out.append(b"/F1 10 Tf\n")
+    _text(out, encode(subtitle), 0.05 * PAGE_W, 0.90 * PAGE_H - 10 * CAP_HEIGHT / 2)
+    out.append(b"ET\n")
+
+
+def _table(out: list, columns: list, widths: list, rows: list, first_index: int):
+    x0, x1 = TABLE_X[0] * PAGE_W, TABLE_X[1] * PAGE_W
+    total = float(sum(widths))
+    edges = [x0]
+    for w in widths:
+        edges.append(edges[-1] + (x1 - x0) * w / total)
+    top = TABLE_TOP
+    body_top = top - HEADER_ROW_H
+    bottom = body_top - ROW_H * len(rows)
+
+    # fills: header row, then white on every other body row (the rest shows the page background)
+    out.append(_rgb(COLOR_PRIMARY) + b" rg %.2f %.2f %.2f %.2f re f\n" % (x0, body_top, x1 - x0, HEADER_ROW_H))
+    out.append(b"1 1 1 rg\n")
+    out.extend(b"%.2f %.2f %.2f %.2f re\n" % (x0, body_top - ROW_H * (i + 1), x1 - x0, ROW_H)
+               for i in range(len(rows)) if (first_index + i) % 2 == 1)
+    out.append(b"f\n")
+
+    # grid: one path
+    out.append(_rgb(COLOR_GRID) + b" RG 0.5 w\n")
+    ys = [top, body_top] + [body_top - ROW_H * (i + 1) for i in range(len(rows))]
+    out.extend(b"%.2f %.2f m %.2f %.2f l\n" % (x0, y, x1, y) for y in ys)
+    out.extend(b"%.2f %.2f m %.2f %.2f l\n" % (x, top, x, bottom) for x in edges)
+    out.append(b"S\n")
+
+    # text, centred in each cell
+    out.append(b"BT 1 1 1 rg /F2 %d Tf\n" % FONT_SIZE)
+    y = body_top + (HEADER_ROW_H - FONT_SIZE * CAP_HEIGHT) / 2
+    for j, label in enumerate(columns):
+        data = encode(label)
+        _text(out, data, (edges[j] + edges[j + 1] - text_width(data, b"F2", FONT_SIZE)) / 2, y)
+    out.append(_rgb(COLOR_TEXT) + b" rg /F1 %d Tf\n" % FONT_SIZE)
+    widths_f1 = FONTS[b"F1"][1]
+    centres = [(edges[j] + edges[j + 1]) / 2 for j in range(len(columns))]
+    pad = (ROW_H - FONT_SIZE * CAP_HEIGHT) / 2
+    for i, row in enumerate(rows):
+        y = body_top - ROW_H * (i + 1) + pad
+        for j, value in enumerate(row):
+            data = encode(value)
+            half = sum(widths_f1[b] for b in data) * FONT_SIZE / 2000.0
+            out.append(b"1 0 0 1 %.2f %.2f Tm %s Tj\n" % (centres[j] - half, y, _literal(data)))
+    out.append(b"ET\n")
+
+
+def render_tables(header: tuple, tables: list, first_page: int = 1, total_pages: int = None) -> list:
+    """
+    Content streams (bytes) of the pages for `tables`: dicts with title, columns, widths (relative)
+    and rows (lists of cell values). Every table starts on a new page and continues on as many as
+    it needs. Pages are numbered from `first_page` out of `total_pages` (default: first_page - 1 +
+    the pages rendered here).
+    """
+    plan = []  # (table, row offset, part)
+    for table in tables:
+        rows = table["rows"]
+        for part, start in enumerate(range(0, max(len(rows), 1), ROWS_PER_PAGE)):
+            plan.append((table, start, part))
+    total_pages = total_pages or first_page - 1 + len(plan)
+
+    pages = []
+    for n, (table, start, part) in enumerate(plan):
+        out = []
+        _page_header(out, *header)
+        title = table["title"] if part == 0 else f"{table['title']} (continued)"
+        out.append(b"BT " + _rgb(COLOR_TITLE) + b" rg /F2 14 Tf\n")
+        _text(out, encode(title), 0.05 * PAGE_W, 0.83 * PAGE_H)
+        footer = encode(f"Page {first_page + n} of {total_pages}")
+        out.append(_rgb(COLOR_MUTED) + b" rg /F1 8 Tf\n")
+        _text(out, footer, (PAGE_W - text_width(footer, b"F1", 8)) / 2, 0.025 * PAGE_H)
+        out.append(b"ET\n")
+        _table(out, table["columns"], table["widths"], table["rows"][start:start + ROWS_PER_PAGE], start)
+        pages.append(b"".join(out))
+    return pages
+
+
+# -----------------------
+# Incremental update
+# -----------------------
+def _object(pdf: bytes, num: int) -> bytes:
+    m = re.search(rb"(?:^|[\r\n])%d 0 obj\b(.*?)endobj" % num, pdf, re.S)
+    if m is None:
+        raise ValueError(f"PDF object {num} not found")
+    return m.group(1)
+
+
+def append_pages(pdf: bytes, contents: list, compress: bool = True) -> bytes:
+    """
+    `pdf` with one page per content stream appended after its own pages. Needs a classic xref
+    table and trailer (what matplotlib writes); the original bytes are left untouched.
+    """
+    if not contents:
+        return pdf
+    tail = pdf[-4096:]
+    trailer = tail[tail.rfind(b"trailer"):]
+    size = re.search(rb"/Size\s+(\d+)", trailer)
+    root = re.search(rb"/Root\s+(\d+)\s+0\s+R", trailer)
+    startxref = re.findall(rb"startxref\s+(\d+)", tail)
+    if not (size and root and startxref):
+        raise ValueError("Unsupported PDF: no classic trailer to update")
+    info = re.search(rb"/Info\s+(\d+)\s+0\s+R", trailer)
+    pages_ref = re.search(rb"/Pages\s+(\d+)\s+0\s+R", _object(pdf, int(root.group(1))))
+    if pages_ref is None:
+        raise ValueError("Unsupported PDF: catalog without /Pages")
+    pages_id = int(pages_ref.group(1))
+    kids = re.search(rb"/Kids\s*\[(.*?)\]", _object(pdf, pages_id), re.S)
+    kids = re.findall(rb"(\d+)\s+0\s+R", kids.group(1)) if kids else []
+    media_box = re.search(rb"/MediaBox\s*\[[^\]]*\]", pdf)
+    media_box = media_box.group(0) if media_box else b"/MediaBox [0 0 %.2f %.2f]" % (PAGE_W, PAGE_H)
+
+    out = bytearray(pdf if pdf.endswith(b"\n") else pdf + b"\n")
+    offsets = {}
+    next_id = int(size.group(1))
+
+    def add(body: bytes, num: int = None) -> int:
+        nonlocal next_id
+        if num is None:
+            num, next_id = next_id, next_id + 1
+        offsets[num] = len(out)
+        out.extend(b"%d 0 obj\n" % num + body + b"\nendobj\n")
+        return num
+
+    fonts = b" ".join(
+        b"/%s %d 0 R" % (key, add(b"<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>" % name.encode()))
+        for key, (name, _) in FONTS.items()
+    )
+    resources = add(b"<< /Font << " + fonts + b" >> /ProcSet [/PDF /Text] >>")
+    new_kids = []
+    for content in contents:
+        data = zlib.compress(content, 6) if compress else content
+        stream = add(b"<< /Length %d%s >>\nstream\n" % (len(data), b" /Filter /FlateDecode" if compress else b"")
+                     + data + b"\nendstream")
+        new_kids.append(add(b"<< /Type /Page /Parent %d 0 R %s /Resources %d 0 R /Contents %d 0 R >>"
+                            % (pages_id, media_box, resources, stream)))
+    all_kids = [int(k) for k in kids] + new_kids
+    add(b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % k for k in all_kids), len(all_kids)),
+        num=pages_id)
+
+    # xref: head of the free list (readers expect a section to start at 0), the replaced page
+    # tree, then the contiguous run of new objects
+    xref_at = len(out)
+    out.extend(b"xref\n0 1\n0000000000 65535 f \n%d 1\n%010d 00000 n \n" % (pages_id, offsets[pages_id]))
+    first_new = int(size.group(1))
+    out.extend(b"%d %d\n" % (first_new, next_id - first_new))
+    out.extend(b"".join(b"%010d 00000 n \n" % offsets[n] for n in range(first_new, next_id)))
+    out.extend(b"trailer\n<< /Size %d /Root %s 0 R%s /Prev %s >>\nstartxref\n%d\n%%%%EOF\n"
+               % (next_id, root.group(1), b" /Info %s 0 R" % info.group(1) if info else b"", startxref[-1], xref_at))
+    return bytes(out)
@@ -1,13 +1,32 @@
 # app/utils/preprocess.py
 """
 Preprocessing utilities for BreatheBetter.
-- merge_pm25_weather(df_pm25, df_weather)
+- merge_pm25_weather(df_pm25, df_weather)  (targets= puts several pollutants on the same grid)
 - make_features(df, lags=[1,2,3,6,12,24], horizon=1)
+- make_multi_features(df, targets)  one matrix with lags of every pollutant and a y_<pollutant> per target
+- merge_series / feature_arrays: the same on HourlySeries / NumPy (int64 hours, float32 values),
+  used by train_model; the DataFrame functions are wrappers / kept for the other callers
+
+Resampling / imputation is done on NumPy arrays by app/utils/resample.py: gaps up to
+RESAMPLE_MAX_GAP_HOURS are filled and flagged in an `imputed` column, longer gaps stay NaN.
+IMPUTED_TARGETS decides what make_features does with rows whose target was imputed:
+"drop" (default), "weight" (adds a sample_weight column of IMPUTED_WEIGHT) or "keep".
 """
 
+import os
+
+import numpy as np
 import pandas as pd
 from typing import List
 
+from app.utils.resample import MAX_GAP_HOURS, hourly_grid, fill_gaps
+from app.utils.series import HourlySeries, calendar
+
+IMPUTED_TARGETS = os.environ.get("IMPUTED_TARGETS", "drop")  # drop | weight | keep
+IMPUTED_WEIGHT = float(os.environ.get("IMPUTED_WEIGHT", 0.3))
+MASK_COLUMNS = ["imputed", "gap_hours"]
+WEIGHT_COLUMN = "sample_weight"
+
 def _ensure_dt(df: pd.DataFrame, col="datetime"):
     df = df.copy()
     if col in df.columns:
@@ -16,85 +35,138 @@ def _ensure_dt(df: pd.DataFrame, col="datetime"):
         raise ValueError(f"Missing datetime column: {col}")
     return df
 
-def merge_pm25_weather(df_pm25: pd.DataFrame, df_weather: pd.DataFrame) -> pd.DataFrame:
+def merge_pm25_weather(df_pm25: pd.DataFrame, df_weather: pd.DataFrame, max_gap: int = None, targets: List[str] = None) -> pd.DataFrame:
     """
     Merge historical pm25 (datetime, pm25) WITH weather data (datetime, temp, humidity, etc.)
-    Clean, safe merge using 'on="datetime"' only.
+    on a dense hourly grid. Readings are averaged per (nearest) hour; gaps of at most `max_gap`
+    hours are interpolated, longer ones stay NaN so make_features drops the rows that touch them.
+    Adds `imputed` (1 where pm25 or any weather value was filled) and `gap_hours` (length of the
+    pm25 gap the hour belongs to, 0 if observed).
+    `targets` (default ["pm25"]) are the df_pm25 columns to merge; the first one decides the usable
+    range and gap_hours, the others are gap-filled the same way.
+    DataFrame wrapper around merge_series().
     """
     if df_pm25 is None or df_weather is None:
         return None
+    for df in (df_pm25, df_weather):
+        if "datetime" not in df.columns:
+            raise ValueError("Missing datetime column: datetime")
+    if df_pm25.empty or df_weather.empty:
+        return pd.DataFrame()
+    merged = merge_series(*series_inputs(df_pm25, df_weather, targets), max_gap)
+    if merged is None:
+        return pd.DataFrame()
 
-    df_pm25 = _ensure_dt(df_pm25)
-    df_weather = _ensure_dt(df_weather)
+    out = merged.to_frame(utc=isinstance(df_pm25["datetime"].dtype, pd.DatetimeTZDtype))
+    out["imputed"] = out["imputed"].astype(np.int8)
+    out["gap_hours"] = out["gap_hours"].astype(np.int32)
+    return out
 
-    # round to nearest hour
-    df_pm25["datetime"] = df_pm25["datetime"].dt.round("H")
-    df_weather["datetime"] = df_weather["datetime"].dt.round("H")
 
-    # remove duplicate datetime rows
-    df_pm25 = df_pm25.drop_duplicates(subset="datetime", keep="last")
-    df_weather = df_weather.drop_duplicates(subset="datetime", keep="last")
+def series_inputs(df_pm25: pd.DataFrame, df_weather: pd.DataFrame, targets: List[str] = None):
+    """(air, weather) HourlySeries of the two input frames, for merge_series."""
+    targets = targets or ["pm25"]
+    weather_cols = [c for c in df_weather.columns if c not in ("datetime", "pm25", "lat", "lon", *targets)]
+    return HourlySeries.from_frame(df_pm25, targets), HourlySeries.from_frame(df_weather, weather_cols)
 
-    # 🔥 THE FIX (Part 1): Create a complete hourly index
-    # This finds the earliest and latest date in *either* dataset.
-    min_dt = min(df_pm25["datetime"].min(), df_weather["datetime"].min())
-    max_dt = max(df_pm25["datetime"].max(), df_weather["datetime"].max())
-    
-    # Create a perfect, hourly index spanning the full range
-    hourly_index = pd.date_range(start=min_dt.floor('H'), end=max_dt.ceil('H'), freq='H')
-    
-    # Create a new DataFrame based on this perfect index
-    df_complete = pd.DataFrame(hourly_index, columns=["datetime"])
 
-    # Merge PM2.5 and weather data onto the perfect index
-    # We set datetime as index to merge on it, then reset it
-    df_pm25 = df_pm25.set_index("datetime")
-    df_weather = df_weather.set_index("datetime")
-    
-    df_complete = df_complete.set_index("datetime")
-    
-    df_complete = df_complete.join(df_pm25[["pm25"]])
-    df_complete = df_complete.join(df_weather.drop(columns=["lat", "lon"], errors="ignore"))
-    
-    df_complete = df_complete.reset_index()
-
-    # 🔥 THE FIX (Part 2): Robust interpolation
-    # Now that we have all rows, we can safely fill gaps.
-    
-    # Ensure all feature columns are numeric
-    all_cols = list(df_complete.columns)
-    all_cols.remove("datetime")
-    
-    for col in all_cols:
-         df_complete[col] = pd.to_numeric(df_complete[col], errors="coerce")
-         
-    # 1. Interpolate to fill most gaps (linear fill)
-    df_complete[all_cols] = df_complete[all_cols].interpolate(method='linear', limit_direction='both')
-    # 2. ffill/bfill to clean up any remaining NaNs at the start/end
-    df_complete[all_cols] = df_complete[all_cols].ffill().bfill()
-
-    # Final safety net
-    merged = df_complete.dropna().reset_index(drop=True)
+def merge_series(air: HourlySeries, weather: HourlySeries, max_gap: int = None) -> HourlySeries:
+    """
+    merge_pm25_weather on HourlySeries: `air` holds the target columns (first = pm25), `weather`
+    the weather columns. Returns the dense grid (targets, weather, imputed, gap_hours) as one
+    float32 series, or None if there is no usable target hour.
+    """
+    max_gap = MAX_GAP_HOURS if max_gap is None else max_gap
+    if len(air) == 0 or len(weather) == 0:
+        return None
 
-    return merged
+    # one grid spanning both datasets
+    start = int(min(air.hours.min(), weather.hours.min()))
+    end = int(max(air.hours.max(), weather.hours.max()))
+    grid, air_grid = hourly_grid(air.hours, air.values.T, start, end)
+    _, weather_grid = hourly_grid(weather.hours, weather.values.T, start, end)
+
+    pm25, imputed, gaps = fill_gaps(air_grid[:, 0], max_gap)
+    imputed = imputed.copy()
+    for block, first in ((air_grid, 1), (weather_grid, 0)):
+        for j in range(first, block.shape[1]):
+            _, filled, _ = fill_gaps(block[:, j], max_gap)
+            imputed |= filled
+
+    # hours before the first / after the last usable pm25 carry nothing to train on
+    usable = np.flatnonzero(~np.isnan(pm25))
+    if len(usable) == 0:
+        return None
+    rows = slice(usable[0], usable[-1] + 1)
 
+    columns = [*air.columns, *weather.columns, *MASK_COLUMNS]
+    values = np.empty((len(columns), usable[-1] + 1 - usable[0]), dtype=np.float32)
+    values[:air_grid.shape[1]] = air_grid[rows].T
+    values[air_grid.shape[1]:-2] = weather_grid[rows].T
+    values[-2] = imputed[rows]
+    values[-1] = gaps[rows]
+    return HourlySeries(grid[rows], columns, values)
 
 
-def make_features(df: pd.DataFrame, lags: List[int] = None, horizon: int = 1) -> pd.DataFrame:
+def feature_arrays(merged: HourlySeries, lags: List[int] = None, horizon: int = 1, imputed: str = None, target: str = "pm25"):
+    """
+    make_features on a merged HourlySeries, without DataFrames: returns
+    (X float32 rows x features, y float32, hours int64, feature_names, sample_weight or None)
+    with the same columns, order and row filtering as make_features.
+    """
+    if lags is None:
+        lags = [1,2,3,6,12,24]
+    imputed = imputed or IMPUTED_TARGETS
+    n = len(merged)
+    series = merged[target]
+
+    weather_cols = [c for c in merged.columns if c != target and c not in MASK_COLUMNS]
+    feature_names = [f"{target}_lag_{lag}" for lag in lags] + weather_cols + ["hour", "day", "month", "weekday"]
+    X = np.full((n, len(feature_names)), np.nan, dtype=np.float32)
+    # dense hourly grid: a shift by n rows is exactly n hours
+    for j, lag in enumerate(lags):
+        if lag < n:
+            X[lag:, j] = series[:n - lag]
+    for j, col in enumerate(weather_cols, start=len(lags)):
+        X[:, j] = merged[col]
+    for j, values in enumerate(calendar(merged.hours).values(), start=len(lags) + len(weather_cols)):
+        X[:, j] = values
+
+    y = np.full(n, np.nan, dtype=np.float32)
+    y_imputed = np.zeros(n, dtype=bool)
+    if horizon < n:
+        y[:n - horizon] = series[horizon:]
+        y_imputed[:n - horizon] = merged["imputed"][horizon:] > 0 if "imputed" in merged else False
+    keep = ~np.isnan(y) & ~np.isnan(X).any(axis=1)
+    weight = None
+    if "imputed" in merged:
+        if imputed == "drop":
+            keep &= ~y_imputed
+        elif imputed == "weight":
+            weight = np.where(y_imputed, IMPUTED_WEIGHT, 1.0).astype(np.float32)[keep]
+
+    return X[keep], y[keep], merged.hours[keep], feature_names, weight
+
+
+def make_features(df: pd.DataFrame, lags: List[int] = None, horizon: int = 1, imputed: str = None) -> pd.DataFrame:
     """
     Create features for supervised forecasting.
     - lags: list of integer lags in hours to include (e.g., [1,2,3,6,12,24])
     - horizon: how many hours ahead to predict (1 => next hour)
-    Returns DataFrame with target column 'y' and features (lag cols, weather, time features).
+    - imputed: "drop" / "weight" / "keep" rows whose target was imputed (default IMPUTED_TARGETS)
+    Returns DataFrame with target column 'y' and features (lag cols, weather, time features),
+    plus a sample_weight column in "weight" mode.
     IMPORTANT: Does NOT include raw 'pm25' as a feature (only lagged pm25).
     """
     if lags is None:
         lags = [1,2,3,6,12,24]
+    imputed = imputed or IMPUTED_TARGETS
 
     df = df.copy()
     df = _ensure_dt(df)
     
-    # Data is already sorted and interpolated from merge_pm25_weather
+    # Data is on the dense hourly grid from merge_pm25_weather, so shift(n) is exactly n hours;
+    # hours left NaN (long gaps) make every row that depends on them drop out below
     
     # create lag features from pm25
     for lag in lags:
@@ -102,6 +174,7 @@ def make_features(df: pd.DataFrame, lags: List[int] = None, horizon: int = 1) ->
 
     # create target column (future pm25 at horizon)
     df["y"] = df["pm25"].shift(-horizon)
+    y_imputed = df["imputed"].shift(-horizon).fillna(0).to_numpy() > 0 if "imputed" in df.columns else None
 
     # time features
     df["hour"] = df["datetime"].dt.hour
@@ -110,7 +183,7 @@ def make_features(df: pd.DataFrame, lags: List[int] = None, horizon: int = 1) ->
     df["weekday"] = df["datetime"].dt.weekday
 
     # collect weather columns (exclude pm25 and datetime)
-    exclude = {"datetime", "pm25", "y"}
+    exclude = {"datetime", "pm25", "y", *MASK_COLUMNS}
     weather_cols = [c for c in df.columns if c not in exclude and not c.startswith("pm25_lag_")]
 
     # keep only relevant columns: datetime, y, lag features, weather/time features
@@ -118,7 +191,47 @@ def make_features(df: pd.DataFrame, lags: List[int] = None, horizon: int = 1) ->
     keep_cols = ["datetime", "y"] + feature_cols
     out = df[keep_cols].copy()
 
+    if y_imputed is not None and imputed == "drop":
+        out = out[~y_imputed]
+    elif y_imputed is not None and imputed == "weight":
+        out[WEIGHT_COLUMN] = np.where(y_imputed, IMPUTED_WEIGHT, 1.0)
+
     # drop rows with NaN in any of feature columns or target (e.g. from lags)
     out = out.dropna().reset_index(drop=True)
 
-    return out
\ No newline at end of file
+    return out
+
+
+def make_multi_features(df: pd.DataFrame, targets: List[str], lags: List[int] = None, horizon: int = 1, imputed: str = None) -> pd.DataFrame:
+    """
+    make_features for several pollutants at once: one shared feature matrix with
+    <pollutant>_lag_<n> for every target and lag, plus weather / time features, and a
+    y_<pollutant> column per target. Rows are dropped / weighted like make_features.
+    """
+    if lags is None:
+        lags = [1,2,3,6,12,24]
+    imputed = imputed or IMPUTED_TARGETS
+
+    df = _ensure_dt(df)
+    lag_cols = {f"{p}_lag_{lag}": df[p].shift(lag) for p in targets for lag in lags}
+    y_cols = {f"y_{p}": df[p].shift(-horizon) for p in targets}
+    y_imputed = df["imputed"].shift(-horizon).fillna(0).to_numpy() > 0 if "imputed" in df.columns else None
+
+    exclude = {"datetime", "y", *targets, *MASK_COLUMNS}
+    weather_cols = [c for c in df.columns if c not in exclude]
+    time_cols = {
+        "hour": df["datetime"].dt.hour,
+        "day": df["datetime"].dt.day,
+        "month": df["datetime"].dt.month,
+        "weekday": df["datetime"].dt.weekday,
+    }
+
+    # same column order as make_features: lags, weather, time
+    out = pd.concat([df[["datetime"]], pd.DataFrame(y_cols), pd.DataFrame(lag_cols), df[weather_cols], pd.DataFrame(time_cols)], axis=1)
+
+    if y_imputed is not None and imputed == "drop":
+        out = out[~y_imputed]
+    elif y_imputed is not None and imputed == "weight":
+        out[WEIGHT_COLUMN] = np.where(y_imputed, IMPUTED_WEIGHT, 1.0)
+
+    return out.dropna().reset_index(drop=True)
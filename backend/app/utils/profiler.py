@@ -0,0 +1,229 @@
+# app/utils/profiler.py
+"""
+Statistical profiler for a live worker, for admins only (ADMIN_TOKEN; unset = disabled).
+- Sampler: a background thread reads every thread's stack with sys._current_frames() each
+  `interval` seconds and counts identical stacks; nothing is traced or instrumented, so the
+  profiled code runs at full speed and nothing at all runs while no profile is being taken
+- whole worker: GET /admin/profile?seconds=10 samples all threads for that long
+- one request: send `X-Profile: collapsed|speedscope` (plus the admin token) with any request;
+  ProfileMiddleware samples while it runs and answers with the profile instead of its body
+  (the original status is in X-Profiled-Status). Async endpoints share the event-loop thread, so
+  requests running at the same time show up in the profile as well
+- output: collapsed stacks ("a;b;c 42" lines, for flamegraph.pl / speedscope / inferno) or
+  speedscope JSON (https://www.speedscope.app)
+- stacks whose innermost frame is a known wait (lock, selector, queue) are dropped unless idle=true
+"""
+
+import os
+import sys
+import hmac
+import json
+import time
+import threading
+from collections import Counter
+
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL_MS", 5)) / 1000
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", 60))
+FORMATS = ("collapsed", "speedscope")
+
+# innermost frames of threads that are only waiting
+IDLE_LEAVES = {
+    ("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"), ("threading.py", "join"),
+    ("selectors.py", "select"), ("queue.py", "get"), ("thread.py", "_worker"),
+    ("connection.py", "_poll"), ("base_events.py", "_run_once"),
+}
+
+_PATH_MARKERS = ("site-packages" + os.sep, "lib" + os.sep + "python", os.sep + "backend" + os.sep)
+
+# one profile at a time: two samplers would double the overhead and sample each other
+_busy = threading.Lock()
+
+
+def authorized(token: str) -> bool:
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+def _short_path(path: str) -> str:
+    for marker in _PATH_MARKERS:
+        i = path.rfind(marker)
+        if i >= 0:
+            rest = path[i + len(marker):]
+            return rest.split(os.sep, 1)[1] if marker.startswith("lib") and os.sep in rest else rest
+    return path
+
+
+class Sampler:
+    """Counts stacks of all threads (or of `threads` idents only) until stop()."""
+
+    def __init__(self, interval: float = PROFILE_INTERVAL, threads=None, idle: bool = False):
+        self.interval = max(0.001, interval)
+        self.threads = set(threads) if threads else None
+        self.idle = idle
+        self.skip = set()  # thread idents never sampled (the sampler's own, a caller just sleeping on it)
+        self.stacks = Counter()
+        self.samples = 0
+        self.labels = {}  # code object -> frame label, so each function is formatted once
+        self.started = self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _label(self, code) -> str:
+        label = self.labels.get(code)
+        if label is None:
+            label = self.labels[code] = f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def _sample(self, names: dict):
+        for ident, frame in sys._current_frames().items():
+            if ident in self.skip or (self.threads is not None and ident not in self.threads):
+                continue
+            code = frame.f_code
+            if not self.idle and (os.path.basename(code.co_filename), code.co_name) in IDLE_LEAVES:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(ident) or f"thread-{ident}")
+            stack.reverse()
+            self.stacks[tuple(stack)] += 1
+
+    def _run(self):
+        self.skip.add(threading.get_ident())
+        names = {}
+        next_at = time.perf_counter()
+        while not self._stop.is_set():
+            if len(names) != threading.active_count():
+                names = {t.ident: t.name for t in threading.enumerate()}
+            self._sample(names)
+            self.samples += 1
+            next_at += self.interval
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                next_at = time.perf_counter()  # fell behind: don't burst to catch up
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self.started
+        return self
+
+    # ---- output ----
+    def collapsed(self) -> str:
+        return "".join(f"{';'.join(stack)} {n}\n" for stack, n in self.stacks.most_common())
+
+    def speedscope(self, name: str = "profile") -> dict:
+        frames, index = [], {}
+        samples, weights = [], []
+        for stack, n in self.stacks.most_common():
+            ids = []
+            for label in stack:
+                i = index.get(label)
+                if i is None:
+                    i = index[label] = len(frames)
+                    func, _, where = label.partition(" (")
+                    file, _, line = where.rstrip(")").rpartition(":")
+                    frames.append({"name": func, "file": file, "line": int(line)} if line.isdigit() else {"name": label})
+                ids.append(i)
+            samples.append(ids)
+            weights.append(round(n * self.interval, 6))
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "breathebetter-profiler",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": round(sum(weights), 6),
+                "samples": samples,
+                "weights": weights,
+            }],
+        }
+
+    def render(self, fmt: str, name: str = "profile"):
+        """(body bytes, media type) in `fmt`."""
+        if fmt == "speedscope":
+            return json.dumps(self.speedscope(name)).encode(), "application/json"
+        return self.collapsed().encode(), "text/plain; charset=utf-8"
+
+    def summary(self) -> dict:
+        return {"seconds": round(self.elapsed, 3), "samples": self.samples, "stacks": len(self.stacks),
+                "interval_ms": round(self.interval * 1000, 3)}
+
+
+def profile_for(seconds: float, interval: float = None, idle: bool = False) -> Sampler:
+    """Samples the whole process for `seconds` (blocking). Raises RuntimeError if a profile is already running."""
+    if not _busy.acquire(blocking=False):
+        raise RuntimeError("A profile is already running")
+    try:
+        sampler = Sampler(interval or PROFILE_INTERVAL, idle=idle)
+        sampler.skip.add(threading.get_ident())
+        sampler.start()
+        time.sleep(min(max(seconds, 0.01), PROFILE_MAX_SECONDS))
+        return sampler.stop()
+    finally:
+        _busy.release()
+
+
+# -----------------------
+# per-request profiling
+# -----------------------
+class ProfileMiddleware:
+    """
+    Pure ASGI middleware: requests without an X-Profile header cost one header scan and go straight
+    through. With X-Profile and a valid X-Admin-Token the request is sampled while it runs and the
+    response body is replaced by the profile.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        fmt = token = None
+        for k, v in scope["headers"]:
+            if k == b"x-profile":
+                fmt = v.decode("latin-1").strip().lower() or "collapsed"
+            elif k == b"x-admin-token":
+                token = v.decode("latin-1")
+        if fmt is None or not authorized(token) or not _busy.acquire(blocking=False):
+            return await self.app(scope, receive, send)
+
+        try:
+            status = {}
+
+            async def swallow(message):
+                if message["type"] == "http.response.start":
+                    status["code"] = message["status"]
+
+            sampler = Sampler().start()
+            try:
+                await self.app(scope, receive, swallow)
+            finally:
+                sampler.stop()
+        finally:
+            _busy.release()
+
+        path = scope.get("path", "")
+        body, media = sampler.render(fmt if fmt in FORMATS else "collapsed", name=f"{scope.get('method', '')} {path}")
+        await send({"type": "http.response.start", "status": 200, "headers": [
+            (b"content-type", media.encode()),
+            (b"content-length", str(len(body)).encode()),
+            (b"x-profiled-status", str(status.get("code", 500)).encode()),
+            (b"x-profile-samples", str(sampler.samples).encode()),
+        ]})
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,224 @@
+# app/utils/report_jobs.py
+"""
+Background PDF report jobs for BreatheBetter.
+- ReportCache: bounded on-disk store of finished reports
+- ReportJobQueue: enqueue(city, days) -> job id, a fixed pool of workers renders off the request path
+
+Rendering runs in a small process pool so matplotlib never blocks the event loop
+and at most REPORT_WORKERS reports are drawn at the same time.
+"""
+
+import os
+import uuid
+import asyncio
+import multiprocessing
+from pathlib import Path
+from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from app.utils.logging_utils import get_logger
+
+log = get_logger(__name__)
+
+REPORT_WORKERS = int(os.environ.get("REPORT_WORKERS", 2))
+REPORT_QUEUE_SIZE = int(os.environ.get("REPORT_QUEUE_SIZE", 32))
+REPORT_CACHE_MAX_FILES = int(os.environ.get("REPORT_CACHE_MAX_FILES", 64))
+REPORT_CACHE_MAX_BYTES = int(os.environ.get("REPORT_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+REPORT_CACHE_DIR = BASE_DIR / "report_cache"
+
+# job statuses
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def _render(city: str, df_history, metrics: dict, days: int) -> bytes:
+    """Runs inside a pool process: import matplotlib there, not in the server."""
+    from app.utils.report_utils import generate_pdf_report
+    return generate_pdf_report(city, df_history, metrics, days=days)
+
+
+# -----------------------
+# On-disk cache
+# -----------------------
+class ReportCache:
+    """Stores finished PDFs on disk, evicting least recently used files past the size/count caps."""
+
+    def __init__(self, directory: Path = REPORT_CACHE_DIR, max_files: int = REPORT_CACHE_MAX_FILES, max_bytes: int = REPORT_CACHE_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def path_for(self, key: str) -> Path:
+        return self.directory / f"{key}.pdf"
+
+    def get(self, key: str):
+        path = self.path_for(key)
+        if not path.exists():
+            return None
+        try:
+            os.utime(path, None)  # touch for LRU ordering
+        except OSError:
+            pass
+        return path
+
+    def put(self, key: str, data: bytes) -> Path:
+        path = self.path_for(key)
+        tmp = path.with_suffix(".pdf.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        self.evict()
+        return path
+
+    def evict(self):
+        files = []
+        for p in self.directory.glob("*.pdf"):
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, p))
+        files.sort()  # oldest first
+
+        total = sum(size for _, size, _ in files)
+        while files and (len(files) > self.max_files or total > self.max_bytes):
+            _, size, p = files.pop(0)
+            try:
+                p.unlink()
+            except OSError:
+                pass
+            total -= size
+
+
+# -----------------------
+# Job queue
+# -----------------------
+class ReportJob:
+    __slots__ = ("id", "city", "days", "key", "status", "error", "path", "created_at", "finished_at", "done_event")
+
+    def __init__(self, city: str, days: int, key: str):
+        self.id = uuid.uuid4().hex
+        self.city = city
+        self.days = days
+        self.key = key
+        self.status = PENDING
+        self.error = None
+        self.path = None
+        self.created_at = datetime.utcnow().isoformat()
+        self.finished_at = None
+        self.done_event = asyncio.Event()
+
+    def finish(self, status: str, path: Path = None, error: str = None):
+        self.status = status
+        self.path = path
+        self.error = error
+        self.finished_at = datetime.utcnow().isoformat()
+        self.done_event.set()
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "city": self.city,
+            "days": self.days,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class ReportJobQueue:
+    """
+    Bounded queue of report jobs served by REPORT_WORKERS background workers.
+    `fetch_history` and `get_metrics` are injected so this module stays free of app.main imports.
+    """
+
+    def __init__(self, fetch_history, get_metrics, workers: int = REPORT_WORKERS, queue_size: int = REPORT_QUEUE_SIZE, cache: ReportCache = None, max_jobs: int = 500):
+        self.fetch_history = fetch_history
+        self.get_metrics = get_metrics
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.cache = cache or ReportCache()
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()
+        self._inflight = {}  # cache key -> job, so identical requests share one render
+        self._queue = None
+        self._tasks = []
+        self._pool = None
+
+    @staticmethod
+    def cache_key(city: str, days: int) -> str:
+        # history is hourly, so a report is reusable for the rest of the hour
+        hour = datetime.utcnow().strftime("%Y%m%d%H")
+        return f"{city.lower().replace(' ', '_')}_{days}d_{hour}"
+
+    def _ensure_started(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def _remember(self, job: ReportJob):
+        self.jobs[job.id] = job
+        while len(self.jobs) > self.max_jobs:
+            oldest_id, oldest = next(iter(self.jobs.items()))
+            if oldest.status in (PENDING, RUNNING):
+                break
+            self.jobs.pop(oldest_id)
+
+    def submit(self, city: str, days: int) -> ReportJob:
+        """Returns a job for (city, days); raises asyncio.QueueFull when the backlog is at capacity."""
+        self._ensure_started()
+        key = self.cache_key(city, days)
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return inflight
+
+        job = ReportJob(city, days, key)
+        cached = self.cache.get(key)
+        if cached is not None:
+            job.finish(DONE, path=cached)
+            self._remember(job)
+            return job
+
+        self._queue.put_nowait(job)
+        self._inflight[key] = job
+        self._remember(job)
+        return job
+
+    def get(self, job_id: str):
+        return self.jobs.get(job_id)
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            job.status = RUNNING
+            try:
+                df_history = await asyncio.to_thread(self.fetch_history, job.city, job.days)
+                metrics = self.get_metrics(job.city) or {}
+                pdf_bytes = await loop.run_in_executor(self._pool, _render, job.city, df_history, metrics, job.days)
+                path = await asyncio.to_thread(self.cache.put, job.key, pdf_bytes)
+                job.finish(DONE, path=path)
+            except Exception as e:
+                log.error("Report job failed", extra={"city": job.city, "days": job.days, "error": str(e)})
+                job.finish(FAILED, error=str(e))
+            finally:
+                self._inflight.pop(job.key, None)
+                self._queue.task_done()
+
+    async def shutdown(self):
+        for t in self._tasks:
+            t.cancel()
+        self._tasks = []
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
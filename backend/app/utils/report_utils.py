@@ -14,6 +14,11 @@ import matplotlib.gridspec as gridspec
 import matplotlib.patches as patches
 from matplotlib.patches import FancyBboxPatch
 
+from app.utils.logging_utils import get_logger
+from app.utils.pdf_tables import append_pages, render_tables
+
+log = get_logger(__name__)
+
 # --- STYLING CONSTANTS ---
 COLOR_PRIMARY = "#4F46E5"    # Indigo
 COLOR_SECONDARY = "#6B7280"  # Gray
@@ -54,6 +59,16 @@ def draw_kpi_card(ax, x, y, width, height, title, value, unit="", color=COLOR_PR
     ax.text(x + 0.015, y + height - 0.03, title, fontsize=7, color=COLOR_SECONDARY, weight='bold', transform=ax.transAxes)
     ax.text(x + 0.015, y + 0.035, f"{value} {unit}", fontsize=12, color='#111827', weight='bold', transform=ax.transAxes)
 
+CATEGORY_EDGES = [30, 60, 90, 120]
+CATEGORY_NAMES = np.array(["Good", "Moderate", "Poor", "Unhealthy", "Severe"])
+
+def _categories(values: pd.Series) -> np.ndarray:
+    """Indian AQI band of each PM2.5 value (upper bounds inclusive)."""
+    return CATEGORY_NAMES[np.searchsorted(CATEGORY_EDGES, values.to_numpy(dtype=float), side="left")]
+
+def _fmt(values: pd.Series) -> list:
+    return [f"{v:.1f}" for v in values.to_numpy(dtype=float)]
+
 def generate_pdf_report(city: str, df_history: pd.DataFrame, metrics: dict, days: int = 7) -> bytes:
     try:
         buffer = io.BytesIO()
@@ -144,93 +159,37 @@ def generate_pdf_report(city: str, df_history: pd.DataFrame, metrics: dict, days
             pdf.savefig(fig)
             plt.close()
 
-            # ==============================
-            # PAGE 2: DATA TABLE (Smart Logic)
-            # ==============================
-            if not df.empty:
-                fig2 = plt.figure(figsize=(8.27, 11.69))
-                fig2.patch.set_facecolor(BG_COLOR)
-                
-                ax_canvas2 = fig2.add_axes([0, 0, 1, 1], zorder=0)
-                ax_canvas2.axis('off')
-                draw_header(ax_canvas2, city, now_str)
-                
-                ax_tbl = fig2.add_subplot(111)
-                ax_tbl.axis('off')
-                
-                def get_cat(x):
-                    if x <= 30: return "Good"
-                    if x <= 60: return "Moderate"
-                    if x <= 90: return "Poor"
-                    if x <= 120: return "Unhealthy"
-                    return "Severe"
-
-                # 🔥 SMART LOGIC:
-                # If days > 2, show DAILY SUMMARY (Avg, Peak, Min).
-                # Else, show HOURLY LOG.
-                if days > 2:
-                    ax_canvas2.text(0.05, 0.83, "Daily Summary Table", fontsize=14, weight='bold', color='#374151')
-                    
-                    # Resample to Daily
-                    df_daily = df.set_index('datetime').resample('D')['pm25'].agg(['mean', 'max', 'min']).reset_index()
-                    df_daily = df_daily.sort_values("datetime", ascending=False).dropna()
-                    
-                    df_daily["Date"] = df_daily["datetime"].dt.strftime("%Y-%m-%d")
-                    df_daily["Avg"] = df_daily["mean"].round(1).astype(str)
-                    df_daily["Peak"] = df_daily["max"].round(1).astype(str)
-                    df_daily["Min"] = df_daily["min"].round(1).astype(str)
-                    df_daily["Status"] = df_daily["mean"].apply(get_cat)
-                    
-                    table_data = df_daily[["Date", "Avg", "Peak", "Min", "Status"]].values.tolist()
-                    col_labels = ["Date", "Avg PM2.5", "Peak", "Min", "Status"]
-                    col_widths = [0.2, 0.2, 0.2, 0.2, 0.2]
-                    
-                else:
-                    ax_canvas2.text(0.05, 0.83, "Hourly Data Log (Last 40 Hours)", fontsize=14, weight='bold', color='#374151')
-                    
-                    subset = df.tail(40).sort_values("datetime", ascending=False).copy()
-                    subset["Date"] = subset["datetime"].dt.strftime("%Y-%m-%d")
-                    subset["Time"] = subset["datetime"].dt.strftime("%H:%M")
-                    subset["Value"] = subset["pm25"].round(1).astype(str)
-                    subset["Category"] = subset["pm25"].apply(get_cat)
-                    
-                    table_data = subset[["Date", "Time", "Value", "Category"]].values.tolist()
-                    col_labels = ["Date", "Time", "PM2.5", "Category"]
-                    col_widths = [0.25, 0.15, 0.3, 0.3]
-
-                # Draw Table
-                tbl = ax_tbl.table(
-                    cellText=table_data, 
-                    colLabels=col_labels, 
-                    colWidths=col_widths,
-                    loc='center', 
-                    cellLoc='center', 
-                    bbox=[0.08, 0.05, 0.84, 0.75]
-                )
-                
-                tbl.auto_set_font_size(False)
-                tbl.set_fontsize(9)
-                
-                for (row, col), cell in tbl.get_celld().items():
-                    cell.set_edgecolor('#E5E7EB')
-                    cell.set_linewidth(0.5)
-                    if row == 0:
-                        cell.set_text_props(weight='bold', color='white')
-                        cell.set_facecolor(COLOR_PRIMARY)
-                        cell.set_height(0.035)
-                    else:
-                        cell.set_height(0.025)
-                        if row % 2 == 0:
-                            cell.set_facecolor('white')
-                        else:
-                            cell.set_facecolor('#F9FAFB')
-
-                pdf.savefig(fig2)
-                plt.close()
-
-        buffer.seek(0)
-        return buffer.getvalue()
+        # ==============================
+        # DATA TABLES: written straight into the PDF (app/utils/pdf_tables.py), no row cap
+        # ==============================
+        pdf_bytes = buffer.getvalue()
+        if not df.empty:
+            tables = []
+            # 🔥 SMART LOGIC:
+            # If days > 2, lead with a DAILY SUMMARY (Avg, Peak, Min); the full HOURLY LOG always follows.
+            if days > 2:
+                df_daily = df.set_index('datetime').resample('D')['pm25'].agg(['mean', 'max', 'min']).reset_index()
+                df_daily = df_daily.sort_values("datetime", ascending=False).dropna()
+                tables.append({
+                    "title": "Daily Summary Table",
+                    "columns": ["Date", "Avg PM2.5", "Peak", "Min", "Status"],
+                    "widths": [0.2, 0.2, 0.2, 0.2, 0.2],
+                    "rows": list(zip(df_daily["datetime"].dt.strftime("%Y-%m-%d"), _fmt(df_daily["mean"]),
+                                     _fmt(df_daily["max"]), _fmt(df_daily["min"]), _categories(df_daily["mean"]))),
+                })
+
+            hourly = df.sort_values("datetime", ascending=False)
+            tables.append({
+                "title": f"Hourly Data Log ({len(hourly)} Hours)",
+                "columns": ["Date", "Time", "PM2.5", "Category"],
+                "widths": [0.25, 0.15, 0.3, 0.3],
+                "rows": list(zip(hourly["datetime"].dt.strftime("%Y-%m-%d"), hourly["datetime"].dt.strftime("%H:%M"),
+                                 _fmt(hourly["pm25"]), _categories(hourly["pm25"]))),
+            })
+            header = (f"Air Quality Report: {city}", f"Generated on {now_str} • BreatheBetter AI")
+            pdf_bytes = append_pages(pdf_bytes, render_tables(header, tables, first_page=2))
+        return pdf_bytes
 
     except Exception as e:
-        print(f"❌ PDF ERROR: {str(e)}")
+        log.exception("PDF report failed", extra={"city": city})
         raise e
\ No newline at end of file
@@ -0,0 +1,88 @@
+# app/utils/resample.py
+"""
+Hourly resampling and gap-capped imputation on plain NumPy arrays.
+- hourly_grid(): sub-hourly / duplicate readings -> one mean per hour on a dense epoch-hour grid
+  (np.bincount, one pass, no sort needed; NaN readings are ignored)
+- gap_lengths(): length of the missing run every hour belongs to (0 = observed)
+- fill_gaps(): linear interpolation inside gaps of at most `max_gap` hours, nearest value for
+  leading / trailing runs of at most `max_gap`; longer gaps stay NaN instead of becoming straight lines
+
+All of it is O(n) in the grid length and works column by column, in place where possible.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+MAX_GAP_HOURS = int(os.environ.get("RESAMPLE_MAX_GAP_HOURS", 6))
+NS_PER_HOUR = 3_600_000_000_000
+
+
+def epoch_hours(datetimes, rounding: str = "nearest") -> np.ndarray:
+    """int64 hours since the epoch (UTC; naive values are taken as UTC), rounded to the nearest hour or floored."""
+    ns = pd.DatetimeIndex(pd.to_datetime(datetimes, utc=True)).asi8
+    if rounding == "nearest":
+        ns = ns + NS_PER_HOUR // 2
+    return ns // NS_PER_HOUR
+
+
+def hourly_grid(hours: np.ndarray, values: np.ndarray, start: int = None, end: int = None):
+    """
+    Means of `values` (n x k) per hour on the dense grid [start, end] (default: the data's range).
+    Returns (grid_hours int64, means float64 m x k with NaN where an hour has no reading).
+    """
+    hours = np.asarray(hours, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim == 1:
+        values = values[:, None]
+    start = int(hours.min()) if start is None else start
+    end = int(hours.max()) if end is None else end
+    m = end - start + 1
+
+    inside = (hours >= start) & (hours <= end)
+    idx = hours[inside] - start
+    out = np.full((m, values.shape[1]), np.nan)
+    for j in range(values.shape[1]):
+        col = values[inside, j]
+        ok = ~np.isnan(col)
+        counts = np.bincount(idx[ok], minlength=m)
+        sums = np.bincount(idx[ok], weights=col[ok], minlength=m)
+        np.divide(sums, counts, out=out[:, j], where=counts > 0)
+    return np.arange(start, end + 1, dtype=np.int64), out
+
+
+def gap_lengths(missing: np.ndarray) -> np.ndarray:
+    """For a boolean missing-mask, the length of the missing run each position is in (0 where present)."""
+    missing = np.asarray(missing, dtype=bool)
+    out = np.zeros(len(missing), dtype=np.int32)
+    if not missing.any():
+        return out
+    edges = np.diff(np.concatenate(([0], missing.view(np.int8), [0])))
+    lengths = np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)
+    out[missing] = np.repeat(lengths, lengths)  # missing positions come run by run, in order
+    return out
+
+
+def fill_gaps(col: np.ndarray, max_gap: int = MAX_GAP_HOURS):
+    """
+    Fills NaN runs of at most `max_gap` in `col` (in place). Returns (col, imputed mask, gap lengths).
+    Runs between two readings are interpolated linearly; runs at either end take the nearest reading.
+    """
+    missing = np.isnan(col)
+    gaps = gap_lengths(missing)
+    fillable = missing & (gaps <= max_gap)
+    present = np.flatnonzero(~missing)
+    if len(present) and fillable.any():
+        pos = np.flatnonzero(fillable)
+        # np.interp clamps outside [first, last] reading, which is the nearest-value edge fill
+        col[pos] = np.interp(pos, present, col[present])
+    else:
+        fillable[:] = False
+    return col, fillable, gaps
+
+
+def resample_frame(df: pd.DataFrame, columns: list, start: int = None, end: int = None):
+    """(grid_hours, m x k means) of df[columns] on the hourly grid, via hourly_grid()."""
+    values = df[columns].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64)
+    return hourly_grid(epoch_hours(df["datetime"]), values, start, end)
@@ -0,0 +1,78 @@
+# app/utils/series.py
+"""
+Compact hourly data container passed between the data-path stages instead of DataFrames.
+- HourlySeries: int64 epoch hours + one float32 row per column (struct of arrays, (columns, n)),
+  no index, no Timestamp objects, no per-column pandas blocks
+- from_frame() / to_frame() convert at the edges (API responses, endpoints, legacy callers)
+- column access returns views; nothing is copied unless a stage builds a new series
+
+Hours are UTC; to_frame(utc=False) gives naive datetimes like the naive frames it came from.
+"""
+
+import numpy as np
+import pandas as pd
+
+from app.utils.resample import NS_PER_HOUR, epoch_hours
+
+FLOAT = np.float32
+
+
+class HourlySeries:
+    __slots__ = ("hours", "columns", "values")
+
+    def __init__(self, hours: np.ndarray, columns, values: np.ndarray):
+        self.hours = np.asarray(hours, dtype=np.int64)
+        self.columns = tuple(columns)
+        self.values = np.asarray(values, dtype=FLOAT).reshape(len(self.columns), len(self.hours))
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, columns: list = None, rounding: str = "nearest") -> "HourlySeries":
+        """Rows of `df` (any datetime column dtype) with `columns` (default: every other column) as float32."""
+        columns = columns or [c for c in df.columns if c != "datetime"]
+        values = np.empty((len(columns), len(df)), dtype=FLOAT)
+        for j, col in enumerate(columns):
+            values[j] = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=np.float64)
+        return cls(epoch_hours(df["datetime"], rounding=rounding), columns, values)
+
+    def __len__(self) -> int:
+        return len(self.hours)
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        return self.values[self.columns.index(column)]
+
+    def __contains__(self, column: str) -> bool:
+        return column in self.columns
+
+    @property
+    def nbytes(self) -> int:
+        return self.hours.nbytes + self.values.nbytes
+
+    def select(self, columns: list) -> "HourlySeries":
+        return HourlySeries(self.hours, columns, self.values[[self.columns.index(c) for c in columns]])
+
+    def datetimes(self, utc: bool = True) -> pd.DatetimeIndex:
+        dt = pd.to_datetime(self.hours * NS_PER_HOUR, utc=True)
+        return dt if utc else dt.tz_localize(None)
+
+    def to_frame(self, utc: bool = True, dtype=np.float64) -> pd.DataFrame:
+        """datetime + one column per series column (float64 by default, for JSON / legacy callers)."""
+        df = pd.DataFrame({"datetime": self.datetimes(utc)})
+        for j, col in enumerate(self.columns):
+            df[col] = self.values[j].astype(dtype, copy=False)
+        return df
+
+    def __repr__(self) -> str:
+        return f"HourlySeries({len(self)} hours, columns={list(self.columns)}, {self.nbytes / 1024:.1f} KiB)"
+
+
+def calendar(hours: np.ndarray) -> dict:
+    """hour / day / month / weekday (Monday = 0) of epoch hours, like the pandas .dt accessors."""
+    hours = np.asarray(hours, dtype=np.int64)
+    days = hours // 24
+    months = hours.astype("datetime64[h]").astype("datetime64[M]")
+    return {
+        "hour": hours % 24,
+        "day": days - months.astype("datetime64[D]").astype(np.int64) + 1,
+        "month": months.astype(np.int64) % 12 + 1,
+        "weekday": (days + 3) % 7,  # 1970-01-01 was a Thursday
+    }
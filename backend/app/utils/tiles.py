@@ -0,0 +1,339 @@
+# app/utils/tiles.py
+"""
+Pre-rendered PM2.5 heatmap tiles: one XYZ (web-mercator, 256 px) pyramid per city.
+- render_pyramid(): inverse-distance-weighted surface of the latest spatial samples
+  (/spatial_heatmap points), coloured with the AQI category ramp the map already uses, for every
+  tile of the city's bounding box on TILE_ZOOMS; outside the box is transparent
+- the surface is evaluated on a coarse grid (every TILE_GRID_STEP px) and bilinearly upsampled,
+  so a tile costs a few thousand IDW evaluations instead of 65 536
+- PNGs are written straight with zlib (no imaging library) and stored content-addressed
+  (blobs/<sha256>.png): identical tiles are stored once and a file never changes after it is written
+- TileStore: per-city manifest {"z/x/y": hash} with a version; a new render swaps the manifest and
+  sweeps blobs no manifest references
+- TileRenderer: background renders, one per city at a time, off the event loop
+
+GET /tiles/{city}/{z}/{x}/{y}.png?v=<version> is immutable for a year; without (or with an old) v
+it is cacheable for TILE_MAX_AGE and revalidated by ETag. GET /tiles/{city} gives the version.
+"""
+
+import os
+import json
+import math
+import zlib
+import struct
+import asyncio
+import hashlib
+from pathlib import Path
+from datetime import datetime
+
+import numpy as np
+
+from app.utils.logging_utils import get_logger
+
+log = get_logger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+TILE_CACHE_DIR = Path(os.environ.get("TILE_CACHE_DIR", BASE_DIR / "tile_cache"))
+_zoom_lo, _, _zoom_hi = os.environ.get("TILE_ZOOMS", "9-13").partition("-")
+TILE_ZOOMS = tuple(range(int(_zoom_lo), int(_zoom_hi or _zoom_lo) + 1))
+TILE_MAX_AGE = int(os.environ.get("TILE_MAX_AGE", 300))
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+TILE_SWEEP_GRACE = 600  # seconds; younger blobs may belong to a render whose manifest isn't written yet
+TILE_SIZE = 256
+TILE_GRID_STEP = 8
+TILE_ALPHA = 150
+IDW_POWER = 2.0
+
+# PM2.5 (µg/m³) -> colour, the Indian AQI categories of Heatmap.jsx at their band midpoints
+COLOR_STOPS = [
+    (15, (0x00, 0xE4, 0x00)),   # good
+    (45, (0xF0, 0xD4, 0x00)),   # moderate
+    (75, (0xF0, 0x75, 0x54)),   # poor
+    (105, (0xF5, 0x4E, 0x8E)),  # unhealthy
+    (185, (0x8F, 0x3F, 0x97)),  # severe
+    (315, (0x7E, 0x00, 0x23)),  # hazardous
+]
+
+
+# -----------------------
+# Tile math
+# -----------------------
+def lonlat_to_pixel(lon, lat, z: int):
+    """Global web-mercator pixel coordinates at zoom z."""
+    world = TILE_SIZE * 2 ** z
+    lat = np.clip(lat, -85.05112878, 85.05112878)
+    x = (np.asarray(lon) + 180.0) / 360.0 * world
+    s = np.sin(np.radians(lat))
+    y = (0.5 - np.log((1 + s) / (1 - s)) / (4 * math.pi)) * world
+    return x, y
+
+
+def pixel_to_lonlat(x, y, z: int):
+    world = TILE_SIZE * 2 ** z
+    lon = np.asarray(x) / world * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(math.pi * (1 - 2 * np.asarray(y) / world))))
+    return lon, lat
+
+
+def tile_range(bounds: dict, z: int):
+    """(x0, x1, y0, y1) inclusive tile indices covering a lat/lon bounding box at zoom z."""
+    px0, py0 = lonlat_to_pixel(bounds["lon_min"], bounds["lat_max"], z)
+    px1, py1 = lonlat_to_pixel(bounds["lon_max"], bounds["lat_min"], z)
+    return (int(px0 // TILE_SIZE), int(px1 // TILE_SIZE), int(py0 // TILE_SIZE), int(py1 // TILE_SIZE))
+
+
+def in_pyramid(bounds: dict, z: int, x: int, y: int, zooms=TILE_ZOOMS) -> bool:
+    if z not in zooms:
+        return False
+    x0, x1, y0, y1 = tile_range(bounds, z)
+    return x0 <= x <= x1 and y0 <= y <= y1
+
+
+# -----------------------
+# Rendering
+# -----------------------
+def _upsampler(n: int, step: int) -> np.ndarray:
+    """(n, n // step + 1) bilinear weights from grid nodes 0, step, ... n to pixel centres."""
+    centres = (np.arange(n) + 0.5) / step
+    nodes = np.arange(n // step + 1)
+    return np.clip(1.0 - np.abs(centres[:, None] - nodes[None, :]), 0.0, None)
+
+
+_UP = _upsampler(TILE_SIZE, TILE_GRID_STEP)
+
+
+def idw(points: np.ndarray, lon: np.ndarray, lat: np.ndarray, power: float = IDW_POWER) -> np.ndarray:
+    """Inverse-distance-weighted PM2.5 at (lon, lat) from (lat, lon, pm25) points; distances in local degrees."""
+    k = math.cos(math.radians(float(np.mean(points[:, 0]))))
+    dx = (lon.reshape(-1, 1) - points[None, :, 1]) * k
+    dy = lat.reshape(-1, 1) - points[None, :, 0]
+    w = 1.0 / np.maximum(dx * dx + dy * dy, 1e-10) ** (power / 2)
+    return (w @ points[:, 2] / w.sum(axis=1)).reshape(lon.shape)
+
+
+def colorize(values: np.ndarray) -> np.ndarray:
+    """(h, w) PM2.5 -> (h, w, 3) uint8 along COLOR_STOPS."""
+    stops = np.array([s for s, _ in COLOR_STOPS], dtype=np.float64)
+    rgb = np.array([c for _, c in COLOR_STOPS], dtype=np.float64)
+    out = np.empty(values.shape + (3,), dtype=np.uint8)
+    for c in range(3):
+        out[..., c] = np.interp(values, stops, rgb[:, c]).round()
+    return out
+
+
+def render_tile(points: np.ndarray, bounds: dict, z: int, x: int, y: int):
+    """(256, 256, 4) uint8 RGBA of one tile, or None when it is entirely outside the bounding box."""
+    edges = np.arange(TILE_SIZE + 1)
+    centres = edges[:-1] + 0.5
+    # pixel-centre mask: lon depends on the column only, lat on the row only
+    lon_c, _ = pixel_to_lonlat(x * TILE_SIZE + centres, 0, z)
+    _, lat_c = pixel_to_lonlat(0, y * TILE_SIZE + centres, z)
+    cols = (lon_c >= bounds["lon_min"]) & (lon_c <= bounds["lon_max"])
+    rows = (lat_c >= bounds["lat_min"]) & (lat_c <= bounds["lat_max"])
+    if not cols.any() or not rows.any():
+        return None
+
+    nodes = edges[::TILE_GRID_STEP]
+    lon_g, _ = pixel_to_lonlat(x * TILE_SIZE + nodes, 0, z)
+    _, lat_g = pixel_to_lonlat(0, y * TILE_SIZE + nodes, z)
+    grid = idw(points, *np.meshgrid(lon_g, lat_g))
+    surface = _UP @ grid @ _UP.T
+
+    rgba = np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+    rgba[..., :3] = colorize(surface)
+    rgba[..., 3] = np.where(rows[:, None] & cols[None, :], TILE_ALPHA, 0)
+    return rgba
+
+
+def encode_png(rgba: np.ndarray) -> bytes:
+    """8-bit RGBA PNG, filter type 0 on every row."""
+    h, w = rgba.shape[:2]
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    raw = np.zeros((h, w * 4 + 1), dtype=np.uint8)
+    raw[:, 1:] = rgba.reshape(h, w * 4)
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 6, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw.tobytes(), 6))
+            + chunk(b"IEND", b""))
+
+
+EMPTY_TILE = encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8))
+
+
+def render_pyramid(points: list, bounds: dict, zooms=TILE_ZOOMS):
+    """Yields ("z/x/y", png bytes) for every tile of `bounds` that has pixels inside it."""
+    pts = np.asarray([p[:3] for p in points if p[2] is not None], dtype=np.float64)
+    if len(pts) == 0:
+        raise ValueError("No samples to render")
+    for z in zooms:
+        x0, x1, y0, y1 = tile_range(bounds, z)
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                rgba = render_tile(pts, bounds, z, x, y)
+                if rgba is not None:
+                    yield f"{z}/{x}/{y}", encode_png(rgba)
+
+
+# -----------------------
+# On-disk store
+# -----------------------
+class TileStore:
+    """Content-addressed tile blobs plus one manifest per city."""
+
+    def __init__(self, directory: Path = TILE_CACHE_DIR):
+        self.directory = Path(directory)
+        self.blobs = self.directory / "blobs"
+        self.manifests = self.directory / "manifests"
+        self.blobs.mkdir(parents=True, exist_ok=True)
+        self.manifests.mkdir(parents=True, exist_ok=True)
+        self._loaded = {}  # city -> (manifest mtime, manifest)
+
+    def blob_path(self, digest: str) -> Path:
+        return self.blobs / digest[:2] / f"{digest}.png"
+
+    def _manifest_path(self, city: str) -> Path:
+        return self.manifests / f"{city}.json"
+
+    def manifest(self, city: str):
+        """Current manifest of `city` or None; re-read only when the file changed (other workers render too)."""
+        path = self._manifest_path(city)
+        try:
+            mtime = path.stat().st_mtime_ns
+        except OSError:
+            return None
+        cached = self._loaded.get(city)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        try:
+            manifest = json.loads(path.read_text())
+        except (OSError, ValueError):
+            return None
+        self._loaded[city] = (mtime, manifest)
+        return manifest
+
+    def tile(self, city: str, z: int, x: int, y: int):
+        """(path, digest) of a stored tile, or None."""
+        manifest = self.manifest(city)
+        digest = manifest["tiles"].get(f"{z}/{x}/{y}") if manifest else None
+        if digest is None:
+            return None
+        path = self.blob_path(digest)
+        return (path, digest) if path.exists() else None
+
+    def _put_blob(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(digest)
+        try:
+            os.utime(path, None)  # reused: fresh again for sweep()
+        except OSError:
+            path.parent.mkdir(exist_ok=True)
+            tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        return digest
+
+    def write(self, city: str, tiles, bounds: dict, samples: int, sampled_at: str = None, zooms=TILE_ZOOMS) -> dict:
+        """Stores the (key, png) pairs of `tiles` and swaps in the city's new manifest."""
+        index = {key: self._put_blob(data) for key, data in tiles}
+        version = hashlib.sha256(json.dumps(index, sort_keys=True).encode()).hexdigest()[:16]
+        manifest = {
+            "city": city,
+            "version": version,
+            "rendered_at": datetime.utcnow().isoformat(),
+            "sampled_at": sampled_at,
+            "samples": samples,
+            "zooms": list(zooms),
+            "bounds": bounds,
+            "tiles": index,
+        }
+        path = self._manifest_path(city)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(manifest))
+        os.replace(tmp, path)
+        self.sweep()
+        return manifest
+
+    def sweep(self) -> int:
+        """Deletes blobs no manifest references (older than TILE_SWEEP_GRACE). Returns the number removed."""
+        live = set()
+        for path in self.manifests.glob("*.json"):
+            try:
+                live.update(json.loads(path.read_text())["tiles"].values())
+            except (OSError, ValueError, KeyError):
+                return 0  # a manifest being replaced: sweep next time rather than drop live tiles
+        removed = 0
+        cutoff = datetime.now().timestamp() - TILE_SWEEP_GRACE
+        for blob in self.blobs.glob("*/*.png"):
+            if blob.stem not in live:
+                try:
+                    if blob.stat().st_mtime > cutoff:
+                        continue
+                    blob.unlink()
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+
+def summary(manifest: dict) -> dict:
+    """Manifest without the tile index, plus the versioned URL template."""
+    out = {k: v for k, v in manifest.items() if k != "tiles"}
+    out["tiles"] = len(manifest["tiles"])
+    out["url"] = f"/tiles/{manifest['city']}/{{z}}/{{x}}/{{y}}.png?v={manifest['version']}"
+    return out
+
+
+# -----------------------
+# Background renders
+# -----------------------
+class TileRenderer:
+    """
+    Renders pyramids off the event loop, at most one per city at a time: a request for a city that
+    is already rendering is folded into a single follow-up render of the newest samples.
+    """
+
+    def __init__(self, store: TileStore):
+        self.store = store
+        self._running = {}  # city -> task
+        self._next = {}     # city -> newest samples waiting for the running render
+        self.errors = {}
+
+    def rendering(self, city: str) -> bool:
+        return city in self._running
+
+    def schedule(self, city: str, points: list, bounds: dict, sampled_at: str = None) -> bool:
+        """Queues a render of `points`. Returns False when it was folded into one already queued."""
+        if city in self._running:
+            queued = city in self._next
+            self._next[city] = (points, bounds, sampled_at)
+            return not queued
+        self._running[city] = asyncio.get_running_loop().create_task(self._run(city, points, bounds, sampled_at))
+        return True
+
+    def _render(self, city: str, points: list, bounds: dict, sampled_at: str) -> dict:
+        return self.store.write(city, render_pyramid(points, bounds), bounds, len(points), sampled_at)
+
+    async def _run(self, city: str, points: list, bounds: dict, sampled_at: str):
+        try:
+            while True:
+                try:
+                    manifest = await asyncio.to_thread(self._render, city, points, bounds, sampled_at)
+                    self.errors.pop(city, None)
+                    log.info("Rendered tiles", extra={"city": city, "tiles": len(manifest["tiles"]), "version": manifest["version"]})
+                except Exception as e:
+                    self.errors[city] = str(e)
+                    log.error("Tile render failed", extra={"city": city, "error": str(e)})
+                if city not in self._next:
+                    break
+                points, bounds, sampled_at = self._next.pop(city)
+        finally:
+            self._running.pop(city, None)
+
+    async def shutdown(self):
+        tasks = list(self._running.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
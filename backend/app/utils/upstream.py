@@ -0,0 +1,353 @@
+# app/utils/upstream.py
+"""
+Upstream governor for the third-party APIs (OpenWeatherMap, Open-Meteo).
+Outbound calls go through GOVERNOR.get_json (requests, sync) or GOVERNOR.aget_json (httpx, async),
+which apply per API:
+- a token bucket (requests per second + burst); a 429's Retry-After pauses the bucket
+- an AIMD concurrency limit: +1/limit per fast success, halved on 429, 5xx or slow responses
+- a circuit breaker: opens after consecutive failures, then lets one probe through after a cooldown
+- the last good response per URL, served while the breaker is open or when a call fails
+- daily request counters (UTC day) against a configured quota, exposed by GET /upstream/quota
+
+Failures that nothing cached can stand in for raise UpstreamError, which says why.
+Counters are per process: with several server workers each one keeps its own.
+"""
+
+import os
+import time
+import asyncio
+import threading
+from datetime import datetime, timezone
+
+import httpx
+import requests
+from cachetools import LRUCache
+
+from app.utils.logging_utils import get_logger
+
+log = get_logger(__name__)
+
+BREAKER_FAILURES = int(os.environ.get("UPSTREAM_BREAKER_FAILURES", 5))
+BREAKER_COOLDOWN = float(os.environ.get("UPSTREAM_BREAKER_COOLDOWN", 60))
+STALE_CACHE_SIZE = int(os.environ.get("UPSTREAM_STALE_CACHE_SIZE", 256))
+SYNC_MAX_WAIT = float(os.environ.get("UPSTREAM_SYNC_MAX_WAIT", 10))  # local queueing cap for blocking callers
+
+# breaker states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Free-tier defaults. Override per API with <PREFIX>_RATE, _BURST, _MAX_CONCURRENCY,
+# _DAILY_QUOTA, _LATENCY_TARGET (e.g. OWM_RATE=10, OPEN_METEO_DAILY_QUOTA=50000).
+API_DEFAULTS = {
+    # 60 calls/min, 1M calls/month
+    "owm": {"prefix": "OWM", "rate": 1.0, "burst": 60, "max_concurrency": 16, "daily_quota": 30000, "latency_target": 2.0},
+    # 600 calls/min, 10k calls/day
+    "open_meteo": {"prefix": "OPEN_METEO", "rate": 10.0, "burst": 60, "max_concurrency": 8, "daily_quota": 10000, "latency_target": 5.0},
+}
+
+COUNTERS = ["requests", "ok", "http_429", "http_5xx", "http_error", "network_error", "bad_json", "slow",
+            "shed", "rejected_quota", "rejected_open", "served_stale"]
+
+
+class UpstreamError(Exception):
+    """An upstream call failed (or was refused locally) and no cached response could stand in for it."""
+
+    def __init__(self, api: str, reason: str, status: int = None):
+        super().__init__(f"{api}: {reason}" + (f" (HTTP {status})" if status else ""))
+        self.api = api
+        self.reason = reason
+        self.status = status
+
+
+def _config(defaults: dict) -> dict:
+    prefix = defaults["prefix"]
+    cfg = {}
+    for key, default in defaults.items():
+        if key == "prefix":
+            continue
+        cast = type(default)
+        cfg[key] = cast(os.environ.get(f"{prefix}_{key.upper()}", default))
+    return cfg
+
+
+def _retry_after(headers) -> float:
+    try:
+        return max(0.0, float(headers.get("Retry-After")))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+# -----------------------
+# Token bucket
+# -----------------------
+class TokenBucket:
+    """Reservation-style bucket: a caller takes a token now and sleeps for as long as it says."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def reserve(self, max_wait: float = None):
+        """Returns the wait for one token, or None (nothing taken) if it would exceed max_wait."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = max(0.0, (1 - self.tokens) / self.rate, self.paused_until - now)
+        if max_wait is not None and wait > max_wait:
+            return None
+        self.tokens -= 1
+        return wait
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = min(self.tokens, 0.0)
+
+
+# -----------------------
+# Per-API state
+# -----------------------
+class Upstream:
+    """Rate, concurrency, breaker and quota state of one API. All fields are guarded by `lock`."""
+
+    def __init__(self, name: str, cfg: dict):
+        self.name = name
+        self.cfg = cfg
+        self.lock = threading.Lock()
+        self.slot_free = threading.Condition(self.lock)
+        self.bucket = TokenBucket(cfg["rate"], cfg["burst"])
+        self.stale = LRUCache(maxsize=STALE_CACHE_SIZE)
+
+        self.limit = float(cfg["max_concurrency"])
+        self.in_flight = 0
+        self.last_decrease = 0.0
+
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.open_for = BREAKER_COOLDOWN
+        self.probing = False
+
+        self.day = None
+        self.counts = {}
+        self._roll_day()
+
+    def _roll_day(self):
+        today = datetime.now(timezone.utc).date().isoformat()
+        if today != self.day:
+            self.day = today
+            self.counts = dict.fromkeys(COUNTERS, 0)
+
+    def count(self, key: str):
+        with self.lock:
+            self._roll_day()
+            self.counts[key] += 1
+
+    def admit(self, max_wait: float = None) -> float:
+        """Quota, breaker and token bucket checks. Returns how long to sleep before sending."""
+        with self.lock:
+            self._roll_day()
+            if self.counts["requests"] >= self.cfg["daily_quota"]:
+                self.counts["rejected_quota"] += 1
+                raise UpstreamError(self.name, "quota_exhausted")
+
+            now = time.monotonic()
+            if self.state == OPEN and now - self.opened_at >= self.open_for:
+                self.state = HALF_OPEN
+            if self.state == OPEN or (self.state == HALF_OPEN and self.probing):
+                self.counts["rejected_open"] += 1
+                raise UpstreamError(self.name, "circuit_open")
+            if self.state == HALF_OPEN:
+                self.probing = True
+
+            wait = self.bucket.reserve(max_wait)
+            if wait is None:
+                self.probing = False
+                self.counts["shed"] += 1
+                raise UpstreamError(self.name, "rate_limited")
+            return wait
+
+    def shed(self) -> UpstreamError:
+        """Counts a call dropped because its local wait ran past max_wait."""
+        with self.lock:
+            self.counts["shed"] += 1
+            self.probing = False
+        return UpstreamError(self.name, "rate_limited")
+
+    def try_enter(self) -> bool:
+        with self.lock:
+            if self.in_flight < max(1, int(self.limit)):
+                self.in_flight += 1
+                self.counts["requests"] += 1
+                return True
+            return False
+
+    def enter(self, deadline: float = None):
+        """Blocks (threads) until a concurrency slot is free."""
+        with self.slot_free:
+            while self.in_flight >= max(1, int(self.limit)):
+                timeout = None if deadline is None else deadline - time.monotonic()
+                if timeout is not None and timeout <= 0:
+                    self.counts["shed"] += 1
+                    self.probing = False
+                    raise UpstreamError(self.name, "rate_limited")
+                self.slot_free.wait(timeout if timeout is not None else 1.0)
+            self.in_flight += 1
+            self.counts["requests"] += 1
+
+    def finish(self, status: int, latency: float, retry_after: float = 0.0):
+        """Records one completed call (status None = network error) and updates AIMD + breaker."""
+        with self.slot_free:
+            self.in_flight -= 1
+            self.slot_free.notify()
+            self.probing = False
+            now = time.monotonic()
+
+            failed = status is None or status == 429 or status >= 500
+            slow = latency > self.cfg["latency_target"]
+            if status is None:
+                self.counts["network_error"] += 1
+            elif status == 429:
+                self.counts["http_429"] += 1
+                self.bucket.pause(retry_after or 1.0 / self.cfg["rate"])
+            elif status >= 500:
+                self.counts["http_5xx"] += 1
+            elif status >= 400:
+                self.counts["http_error"] += 1
+            else:
+                self.counts["ok"] += 1
+            if slow:
+                self.counts["slow"] += 1
+
+            # AIMD: at most one multiplicative decrease per latency target window
+            if failed or slow:
+                if now - self.last_decrease >= self.cfg["latency_target"]:
+                    self.limit = max(1.0, self.limit / 2)
+                    self.last_decrease = now
+            elif status < 400:
+                self.limit = min(float(self.cfg["max_concurrency"]), self.limit + 1.0 / self.limit)
+
+            # breaker: 4xx other than 429 is our request's fault, not the upstream's
+            if failed:
+                self.failures += 1
+                if self.state == HALF_OPEN or self.failures >= BREAKER_FAILURES:
+                    self.state = OPEN
+                    self.opened_at = now
+                    self.open_for = max(BREAKER_COOLDOWN, retry_after)
+                    log.error("Upstream circuit open", extra={"upstream": self.name, "open_for_s": round(self.open_for), "failures": self.failures})
+            elif status < 400:
+                self.failures = 0
+                self.state = CLOSED
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            self._roll_day()
+            now = time.monotonic()
+            return {
+                "day": self.day,
+                "daily_quota": self.cfg["daily_quota"],
+                "remaining": max(0, self.cfg["daily_quota"] - self.counts["requests"]),
+                "counts": dict(self.counts),
+                "rate_per_second": self.cfg["rate"],
+                "tokens": round(min(self.bucket.burst, self.bucket.tokens + (now - self.bucket.updated) * self.bucket.rate), 2),
+                "concurrency_limit": round(self.limit, 2),
+                "max_concurrency": self.cfg["max_concurrency"],
+                "in_flight": self.in_flight,
+                "circuit": self.state,
+                "circuit_retry_in_s": round(max(0.0, self.opened_at + self.open_for - now), 1) if self.state == OPEN else 0.0,
+            }
+
+
+# -----------------------
+# Governor
+# -----------------------
+class UpstreamGovernor:
+
+    def __init__(self, apis: dict = None):
+        apis = apis or API_DEFAULTS
+        self.apis = {name: Upstream(name, _config(defaults)) for name, defaults in apis.items()}
+        self.session = requests.Session()
+
+    def _fallback(self, up: Upstream, key: str, err: UpstreamError):
+        """Serves the last good response for `key` if there is one, else re-raises with a trace."""
+        cached = up.stale.get(key)
+        if cached is not None:
+            up.count("served_stale")
+            log.warning("Upstream failed, serving cached response", extra={"upstream": up.name, "reason": err.reason})
+            return cached
+        if err.reason != "rate_limited":  # shed calls are counted, not logged one by one
+            log.error("Upstream failed", extra={"upstream": up.name, "reason": err.reason, "http_status": err.status})
+        raise err
+
+    def _handle(self, up: Upstream, key: str, response, latency: float, cache: bool):
+        status = response.status_code
+        up.finish(status, latency, _retry_after(response.headers) if status == 429 else 0.0)
+        if status >= 400:
+            reason = "http_429" if status == 429 else "http_5xx" if status >= 500 else "http_error"
+            return self._fallback(up, key, UpstreamError(up.name, reason, status))
+        try:
+            data = response.json()
+        except ValueError:
+            # a 200 that is not JSON (a captive portal, a truncated body): a failed call for the caller
+            up.count("bad_json")
+            return self._fallback(up, key, UpstreamError(up.name, "bad_json", status))
+        if cache:
+            up.stale[key] = data
+        return data
+
+    def get_json(self, api: str, url: str, params: dict = None, timeout: float = 15.0, max_wait: float = SYNC_MAX_WAIT, cache: bool = True):
+        """
+        Blocking GET returning the decoded JSON body. max_wait caps the local queueing time; it blocks
+        the calling thread, so async code runs this through asyncio.to_thread.
+        """
+        up = self.apis[api]
+        key = url if not params else f"{url}?{sorted(params.items())}"
+        deadline = None if max_wait is None else time.monotonic() + max_wait
+        try:
+            wait = up.admit(max_wait)
+            if wait:
+                time.sleep(wait)
+            up.enter(deadline)
+        except UpstreamError as e:
+            return self._fallback(up, key, e)
+
+        t0 = time.monotonic()
+        try:
+            response = self.session.get(url, params=params, timeout=timeout)
+        except requests.RequestException as e:
+            up.finish(None, time.monotonic() - t0)
+            return self._fallback(up, key, UpstreamError(api, f"network ({type(e).__name__})"))
+        return self._handle(up, key, response, time.monotonic() - t0, cache)
+
+    async def aget_json(self, api: str, url: str, client: httpx.AsyncClient, params: dict = None, timeout: float = 10.0, max_wait: float = None, cache: bool = True):
+        """Async variant of get_json on a caller-owned httpx client."""
+        up = self.apis[api]
+        key = url if not params else f"{url}?{sorted(params.items())}"
+        deadline = None if max_wait is None else time.monotonic() + max_wait
+        try:
+            wait = up.admit(max_wait)
+            if wait:
+                await asyncio.sleep(wait)
+            while not up.try_enter():
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise up.shed()
+                await asyncio.sleep(0.02)
+        except UpstreamError as e:
+            return self._fallback(up, key, e)
+
+        t0 = time.monotonic()
+        try:
+            response = await client.get(url, params=params, timeout=timeout)
+        except httpx.HTTPError as e:
+            up.finish(None, time.monotonic() - t0)
+            return self._fallback(up, key, UpstreamError(api, f"network ({type(e).__name__})"))
+        return self._handle(up, key, response, time.monotonic() - t0, cache)
+
+    def snapshot(self) -> dict:
+        return {name: up.snapshot() for name, up in self.apis.items()}
+
+
+GOVERNOR = UpstreamGovernor()
@@ -1,7 +1,43 @@
 # app/utils/weather_utils.py
-import requests
+import os
+
 import pandas as pd
 
+from app.utils.upstream import GOVERNOR, UpstreamError
+from app.utils.logging_utils import get_logger, stage
+
+log = get_logger(__name__)
+
+# Open-Meteo hourly variables, shared by the forecast and archive APIs
+HOURLY_VARS = [
+    "temperature_2m",
+    "relativehumidity_2m",
+    "pressure_msl",
+    "wind_speed_10m",
+    "precipitation"
+]
+
+ARCHIVE_URL = "https://archive-api.open-meteo.com/v1/archive"
+# weather-ensemble members for probabilistic forecasts; point WEATHER_ENSEMBLE_URL at anything
+# that answers in the Open-Meteo ensemble format (e.g. a local stand-in)
+ENSEMBLE_URL = os.environ.get("WEATHER_ENSEMBLE_URL", "https://ensemble-api.open-meteo.com/v1/ensemble")
+ENSEMBLE_MODEL = os.environ.get("WEATHER_ENSEMBLE_MODEL", "icon_seamless")
+
+
+def hourly_to_frame(hw: dict) -> pd.DataFrame:
+    """Converts an Open-Meteo `hourly` block to our weather columns."""
+    df = pd.DataFrame({
+        "datetime": pd.to_datetime(hw["time"], utc=True), # Keep utc=True
+        "temp": hw.get("temperature_2m"),
+        "humidity": hw.get("relativehumidity_2m"),
+        "pressure": hw.get("pressure_msl"),
+        "wind": hw.get("wind_speed_10m"),
+        "precipitation": hw.get("precipitation")
+    })
+    
+    # Ensure no Nones (can happen in API response)
+    return df.dropna(subset=['datetime'])
+
 def fetch_hourly_weather(lat: float, lon: float, past_days: int = 0, forecast_hours: int = 168):
     """
     Fetch hourly weather for a location.
@@ -13,27 +49,20 @@ def fetch_hourly_weather(lat: float, lon: float, past_days: int = 0, forecast_ho
     Returns DataFrame with columns: datetime (UTC), temp, humidity, pressure, wind, precipitation
     """
     # These are the variables we want from both APIs
-    hourly_vars = [
-        "temperature_2m",
-        "relativehumidity_2m",
-        "pressure_msl",
-        "wind_speed_10m",
-        "precipitation"
-    ]
-    hourly = ",".join(hourly_vars)
+    hourly = ",".join(HOURLY_VARS)
     
     # --- 🔥 NEW API LOGIC ---
     
     if past_days > 0 and forecast_hours == 0:
         # --- We need HISTORICAL data for training ---
-        print(f"Fetching HISTORICAL weather for {past_days} days...")
+        log.info("Fetching historical weather", extra={"past_days": past_days})
         
         # The Archive API needs start and end dates
         end_date = pd.Timestamp.utcnow().strftime('%Y-%m-%d')
         start_date = (pd.Timestamp.utcnow() - pd.Timedelta(days=past_days)).strftime('%Y-%m-%d')
         
         url = (
-            f"https://archive-api.open-meteo.com/v1/archive?"
+            f"{ARCHIVE_URL}?"
             f"latitude={lat}&longitude={lon}"
             f"&start_date={start_date}&end_date={end_date}"
             f"&hourly={hourly}&timezone=UTC"
@@ -41,7 +70,7 @@ def fetch_hourly_weather(lat: float, lon: float, past_days: int = 0, forecast_ho
         
     elif past_days == 0 and forecast_hours > 0:
         # --- We need FORECAST data for prediction ---
-        print(f"Fetching FORECAST weather for {forecast_hours} hours...")
+        log.info("Fetching forecast weather", extra={"forecast_hours": forecast_hours})
         url = (
             f"https://api.open-meteo.com/v1/forecast?"
             f"latitude={lat}&longitude={lon}"
@@ -51,35 +80,56 @@ def fetch_hourly_weather(lat: float, lon: float, past_days: int = 0, forecast_ho
         )
     else:
         # This function is not designed to get both at once, or neither.
-        print("Invalid weather request: Must ask for *either* past days or forecast hours, not both.")
+        log.error("Invalid weather request: ask for either past days or forecast hours",
+                  extra={"past_days": past_days, "forecast_hours": forecast_hours})
         return pd.DataFrame()
         
     # --- END NEW API LOGIC ---
     
     try:
-        r = requests.get(url, timeout=30)
-        r.raise_for_status()
-        j = r.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Weather API request failed: {e}")
+        with stage("weather_fetch"):
+            j = GOVERNOR.get_json("open_meteo", url, timeout=30)
+    except (UpstreamError, ValueError) as e:
+        log.error("Weather API request failed", extra={"error": str(e)})
         return pd.DataFrame()
 
     hw = j.get("hourly", {})
     times = hw.get("time", [])
     if not times:
-        print("Weather API returned no hourly data from the correct API.")
+        log.error("Weather API returned no hourly data", extra={"url": url})
         return pd.DataFrame()
         
-    df = pd.DataFrame({
-        "datetime": pd.to_datetime(hw["time"], utc=True), # Keep utc=True
-        "temp": hw.get("temperature_2m"),
-        "humidity": hw.get("relativehumidity_2m"),
-        "pressure": hw.get("pressure_msl"),
-        "wind": hw.get("wind_speed_10m"),
-        "precipitation": hw.get("precipitation")
-    })
-    
-    # Ensure no Nones (can happen in API response)
-    df = df.dropna(subset=['datetime'])
-    
-    return df
\ No newline at end of file
+    return hourly_to_frame(hw)
+
+def fetch_ensemble_weather(lat: float, lon: float, forecast_hours: int = 24) -> list:
+    """
+    Hourly forecasts of every weather-ensemble member (control run first) as weather frames.
+    A member missing a variable gets None in that column. Returns [] if the API fails.
+    """
+    url = (
+        f"{ENSEMBLE_URL}?"
+        f"latitude={lat}&longitude={lon}"
+        f"&hourly={','.join(HOURLY_VARS)}&models={ENSEMBLE_MODEL}"
+        f"&forecast_hours={forecast_hours}&timezone=UTC"
+    )
+    try:
+        with stage("ensemble_fetch"):
+            j = GOVERNOR.get_json("open_meteo", url, timeout=30)
+    except (UpstreamError, ValueError) as e:
+        log.error("Weather ensemble request failed", extra={"error": str(e)})
+        return []
+
+    hw = j.get("hourly", {})
+    if not hw.get("time"):
+        log.error("Weather ensemble API returned no hourly data", extra={"url": url})
+        return []
+
+    # members come as <variable>_member01, <variable>_member02, ... next to the control <variable>
+    suffixes = sorted({k.rsplit("_member", 1)[1] for k in hw if "_member" in k})
+    frames = []
+    for suffix in [None] + suffixes:
+        block = {"time": hw["time"]}
+        for var in HOURLY_VARS:
+            block[var] = hw.get(f"{var}_member{suffix}" if suffix else var)
+        frames.append(hourly_to_frame(block))
+    return frames
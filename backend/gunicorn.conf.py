@@ -0,0 +1,18 @@
+# gunicorn.conf.py
+# Preload-then-fork deployment (Linux):
+#   gunicorn -c gunicorn.conf.py app.main:app
+# The app, heavy imports, font caches and model bundles are loaded once in the master,
+# then forked workers share those pages copy-on-write instead of each cold-starting.
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = 120
+
+
+def on_starting(server):
+    # runs in the master after the app is imported and before any worker is forked
+    from app.startup import warm_start
+    warm_start()
@@ -0,0 +1,41 @@
+# tests/test_monitoring.py
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.ml.monitoring import ForecastMonitor
+
+
+def _monitor():
+    return ForecastMonitor(fetch_history=None, fetch_training_frames=None, get_metrics=lambda key: {})
+
+
+def _pending(monitor, city, start_hour, hours):
+    targets = np.arange(start_hour, start_hour + hours, dtype=np.int64)
+    monitor._push_pending(monitor._city(city), targets, np.arange(1, hours + 1), np.full(hours, 50.0, dtype=np.float32))
+
+
+def _history(start_hour, hours):
+    dt = pd.to_datetime(np.arange(start_hour, start_hour + hours) * 3600, unit="s", utc=True)
+    return pd.DataFrame({"datetime": dt, "pm25": np.full(hours, 40.0)})
+
+
+def test_forecast_tail_of_history_is_not_scored():
+    now = int(time.time()) // 3600
+    monitor = _monitor()
+    _pending(monitor, "Delhi", now + 1, 72)
+    # what fetch_history(city, 2) returns: two past days followed by Open-Meteo's forecast days
+    history = _history(now - 48, 48 + 1 + 5 * 24)
+
+    assert monitor.join("Delhi", history) == 0
+    assert (monitor._city("Delhi").pending["target"] >= 0).sum() == 72
+
+
+def test_observed_hours_are_scored():
+    now = int(time.time()) // 3600
+    monitor = _monitor()
+    _pending(monitor, "Delhi", now - 5, 10)
+
+    assert monitor.join("Delhi", _history(now - 48, 48 + 1 + 5 * 24)) == 6
+    assert (monitor._city("Delhi").pending["target"] >= 0).sum() == 4
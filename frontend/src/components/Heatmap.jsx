@@ -79,6 +79,7 @@ export default function Heatmap() {
 
   const [heatPoints, setHeatPoints] = useState([]);
   const [loadingMap, setLoadingMap] = useState(true);
+  const [tiles, setTiles] = useState(null);
 
   /* ---------------- FETCH SPATIAL AQI WITH FE CACHE ---------------- */
   const CACHE_KEY = "heatmap_cache_v1";
@@ -135,10 +136,24 @@ export default function Heatmap() {
   };
 
 
+  /* ---------------- PRE-RENDERED PM2.5 TILES ---------------- */
+  // the versioned URL changes with every render, so the browser can keep tiles forever
+  const fetchTiles = async (currentCity) => {
+    try {
+      const res = await fetch(`http://127.0.0.1:8000/tiles/${currentCity}`);
+      const meta = await res.json();
+      setTiles(res.ok ? meta : null);
+    } catch (e) {
+      console.error("Tile meta fetch error:", e);
+      setTiles(null);
+    }
+  };
+
   useEffect(() => {
     if (!city) return;
 
     fetchHeatmap(city);
+    fetchTiles(city);
   }, [city]);
 
   useEffect(() => {
@@ -233,7 +248,21 @@ export default function Heatmap() {
             <TileLayer url="https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png" />
           )}
 
-          
+
+          {/* PM2.5 surface (backend tile pyramid) */}
+          {tiles && (
+            <TileLayer
+              key={tiles.url}
+              url={`http://127.0.0.1:8000${tiles.url}`}
+              minNativeZoom={Math.min(...tiles.zooms)}
+              maxNativeZoom={Math.max(...tiles.zooms)}
+              bounds={[
+                [tiles.bounds.lat_min, tiles.bounds.lon_min],
+                [tiles.bounds.lat_max, tiles.bounds.lon_max],
+              ]}
+              zIndex={2}
+            />
+          )}
 
           {/* 🔥 AQI BUBBLE MARKERS (20 evenly spaced) */}
           {!loadingMap && bubblePoints.map((p, i) => <AQIMarker key={i} point={p} />)}
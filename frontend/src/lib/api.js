@@ -28,8 +28,33 @@ export async function getLivePollutants(city = "Delhi") {
   return fetchJson(`/live_pollutants?city=${encodeURIComponent(city)}`);
 }
 
+// last /history response per city+days; later calls only ask for rows after its newest one
+// (the browser revalidates with the ETag on its own, so an unchanged feed costs a 304)
+const historyCache = new Map();
+
 export async function getHistory(city = "Delhi", days = 7) {
-  return fetchJson(`/history?city=${encodeURIComponent(city)}&days=${days}`);
+  const key = `${city}|${days}`;
+  const cached = historyCache.get(key);
+  const last = cached?.history?.[cached.history.length - 1];
+  let path = `/history?city=${encodeURIComponent(city)}&days=${days}`;
+  // with our version the server sends the full window instead if rows we hold were revised
+  if (last) path += `&since=${encodeURIComponent(last.datetime)}&version=${cached.version}`;
+
+  const data = await fetchJson(path);
+  if (!data || !Array.isArray(data.history)) return data;
+  if (!last || data.since === undefined) {
+    historyCache.set(key, data);
+    return data;
+  }
+
+  // merge the delta and drop rows that fell out of the window
+  const today = new Date();
+  const cutoff = Date.UTC(today.getUTCFullYear(), today.getUTCMonth(), today.getUTCDate()) - days * 24 * 3600 * 1000;
+  const history = cached.history.concat(data.history).filter((r) => Date.parse(r.datetime) >= cutoff);
+  const merged = { ...data, history };
+  delete merged.since;
+  historyCache.set(key, merged);
+  return merged;
 }
 
 export async function getWeeklyForecast(city = "Delhi") {
@@ -2,6 +2,8 @@
 
 export async function fetchPredictionsCached(city, fetchFn) {
   const CACHE_DURATION = 60 * 60 * 1000; // 1 hour
+  // baseline forecasts (served while the city's model trains) are replaced as soon as it is ready
+  const BASELINE_CACHE_DURATION = 60 * 1000;
   // 🔥 CHANGE 1: Add a version prefix. Changing this string invalidates all old caches.
   const CACHE_VERSION = "v2"; 
   const key = `${CACHE_VERSION}_pred_cache_${city.toLowerCase()}`;
@@ -19,7 +21,9 @@ export async function fetchPredictionsCached(city, fetchFn) {
       // 🔥 CHANGE 2: Add a safety check. If the cached data is empty or invalid, ignore it.
       const isValidData = parsed.data && parsed.data.predictions && parsed.data.predictions.length > 0;
 
-      if (age < CACHE_DURATION && isValidData) {
+      const maxAge = parsed.data?.model === "baseline" ? BASELINE_CACHE_DURATION : CACHE_DURATION;
+
+      if (age < maxAge && isValidData) {
         console.log(`[Cache] CACHE HIT for ${city}. Returning cached data.`);
         return parsed.data; 
       }